@@ -0,0 +1,286 @@
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+
+from .face import GalleryIndex, sims_to_dist
+
+# Matchers share one small interface (see GalleryIndex):
+#   search(queries, k, metric) -> (user_ids per query, (M, k) distances)
+#   best_match(emb, metric) -> (user_id | None, distance)
+#   add(uid, embs) / append(uid, embs) / remove(uid)
+# GalleryIndex is the exact brute-force matcher; IVFIndex trades a little recall for speed
+# on very large galleries.
+
+
+class IVFIndex:
+    """
+    Inverted-file index in pure NumPy.
+    - k-means (spherical) splits the gallery into `nlist` cells
+    - a query only scores the rows of its `nprobe` nearest cells
+    nprobe/nlist is the recall/speed knob: nprobe == nlist is exact search.
+    """
+
+    def __init__(self, dim: int = 512, nlist: int = 256, nprobe: int = 16,
+                 train_iters: int = 10, retrain_growth: float = 2.0, seed: int = 0) -> None:
+        self.dim = int(dim)
+        self.nlist = max(1, int(nlist))
+        self.nprobe = max(1, int(nprobe))
+        self.train_iters = int(train_iters)
+        self.retrain_growth = float(retrain_growth)
+        self.seed = int(seed)
+        self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+        self._cells: list[np.ndarray] = []        # per cell: (n_i, dim) float32
+        self._cell_codes: list[np.ndarray] = []   # per cell: (n_i,) int32 user codes
+        self._users: dict[str, int] = {}          # uid -> code
+        self._names: dict[int, str] = {}          # code -> uid
+        self._next_code = 0
+        self._n = 0
+        self._trained_n = 0
+
+    @classmethod
+    def from_galleries(cls, galleries: dict[str, np.ndarray], **kwargs) -> "IVFIndex":
+        idx = cls(**kwargs)
+        rows, codes = [], []
+        for uid, g in galleries.items():
+            g = np.asarray(g, dtype=np.float32).reshape(-1, idx.dim)
+            if not g.shape[0]:
+                continue
+            code = idx._code_for(uid)
+            rows.append(g)
+            codes.append(np.full(g.shape[0], code, dtype=np.int32))
+        if rows:
+            # Park everything in one cell; train() redistributes it
+            idx._cells = [np.concatenate(rows, axis=0)]
+            idx._cell_codes = [np.concatenate(codes)]
+            idx._n = idx._cells[0].shape[0]
+        idx.train()
+        return idx
+
+    def __len__(self) -> int:
+        return self._n
+
+    def users(self) -> list[str]:
+        return list(self._users)
+
+    def _all_rows(self) -> tuple[np.ndarray, np.ndarray]:
+        if not self._cells:
+            return np.zeros((0, self.dim), dtype=np.float32), np.zeros(0, dtype=np.int32)
+        return np.concatenate(self._cells, axis=0), np.concatenate(self._cell_codes, axis=0)
+
+    def train(self) -> None:
+        """(Re)build the coarse quantizer from everything currently in the index."""
+        data, codes = self._all_rows()
+        n = data.shape[0]
+        k = min(self.nlist, max(n, 1))
+        rng = np.random.default_rng(self.seed)
+        if n == 0:
+            self.centroids = np.zeros((0, self.dim), dtype=np.float32)
+            self._cells, self._cell_codes = [], []
+            return
+
+        # k-means on a bounded sample; ~64 points per cell is plenty for a coarse quantizer
+        sample = data
+        if n > 64 * k:
+            sample = data[rng.choice(n, size=64 * k, replace=False)]
+        cent = sample[rng.choice(sample.shape[0], size=k, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = np.argmax(sample @ cent.T, axis=1)
+            onehot = np.zeros((sample.shape[0], k), dtype=np.float32)
+            onehot[np.arange(sample.shape[0]), assign] = 1.0
+            sums = onehot.T @ sample
+            empty = onehot.sum(axis=0) == 0
+            # Re-seed empty cells from random rows so every cell stays useful
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            cent = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+        self.centroids = cent.astype(np.float32)
+
+        assign = np.argmax(data @ self.centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(k + 1))
+        self._cells = [data[order[bounds[c]:bounds[c + 1]]] for c in range(k)]
+        self._cell_codes = [codes[order[bounds[c]:bounds[c + 1]]] for c in range(k)]
+        self._trained_n = n
+
+    def _code_for(self, uid: str) -> int:
+        code = self._users.get(uid)
+        if code is None:
+            code = self._next_code
+            self._next_code += 1
+            self._users[uid] = code
+            self._names[code] = uid
+        return code
+
+    def _add_rows(self, uid: str, embs: np.ndarray) -> None:
+        code = self._code_for(uid)
+        codes = np.full(embs.shape[0], code, dtype=np.int32)
+        if self.centroids.shape[0] == 0:
+            # Untrained: keep everything in one cell until train()
+            if not self._cells:
+                self._cells, self._cell_codes = [embs], [codes]
+            else:
+                self._cells[0] = np.concatenate([self._cells[0], embs], axis=0)
+                self._cell_codes[0] = np.concatenate([self._cell_codes[0], codes])
+        else:
+            assign = np.argmax(embs @ self.centroids.T, axis=1)
+            for c in np.unique(assign):
+                sel = assign == c
+                self._cells[c] = np.concatenate([self._cells[c], embs[sel]], axis=0)
+                self._cell_codes[c] = np.concatenate([self._cell_codes[c], codes[sel]])
+        self._n += embs.shape[0]
+
+    def add(self, uid: str, embs: np.ndarray) -> None:
+        """Set the embeddings of `uid` (replacing any it had)."""
+        self.remove(uid)
+        self.append(uid, embs)
+
+    def append(self, uid: str, embs: np.ndarray) -> None:
+        embs = np.asarray(embs, dtype=np.float32).reshape(-1, self.dim)
+        if embs.shape[0] == 0:
+            return
+        self._add_rows(uid, embs)
+        if self._n >= self.retrain_growth * max(self._trained_n, 1) or self.centroids.shape[0] == 0:
+            self.train()
+
+    def remove(self, uid: str) -> None:
+        code = self._users.pop(uid, None)
+        if code is None:
+            return
+        del self._names[code]
+        for c in range(len(self._cells)):
+            keep = self._cell_codes[c] != code
+            if not keep.all():
+                self._n -= int((~keep).sum())
+                self._cells[c] = self._cells[c][keep]
+                self._cell_codes[c] = self._cell_codes[c][keep]
+
+    def search(self, queries: np.ndarray, k: int = 1, metric: str = "cosine") -> tuple[list[list[str]], np.ndarray]:
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        m = q.shape[0]
+        uids: list[list[str]] = []
+        dists = np.full((m, k), np.inf, dtype=np.float32)
+        if self._n == 0:
+            return [[] for _ in range(m)], dists
+
+        nprobe = min(self.nprobe, self.centroids.shape[0]) if self.centroids.shape[0] else 1
+        if self.centroids.shape[0]:
+            cell_sims = q @ self.centroids.T
+            probes = np.argpartition(-cell_sims, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.zeros((m, 1), dtype=np.int64)
+
+        for i in range(m):
+            cells = [c for c in probes[i] if self._cells[c].shape[0]]
+            if not cells:
+                uids.append([])
+                continue
+            sims = np.concatenate([self._cells[c] @ q[i] for c in cells])
+            codes = np.concatenate([self._cell_codes[c] for c in cells])
+            # Only the strongest few rows can hold the top-k users; widen if they don't
+            take = min(sims.shape[0], 16 * k)
+            while True:
+                cand = np.argpartition(-sims, take - 1)[:take] if take < sims.shape[0] else np.arange(sims.shape[0])
+                order = cand[np.argsort(-sims[cand])]
+                # First occurrence of each user in descending order = that user's best row
+                _, first = np.unique(codes[order], return_index=True)
+                if first.shape[0] >= k or take >= sims.shape[0]:
+                    break
+                take = min(sims.shape[0], take * 4)
+            best = order[np.sort(first)][:k]
+            uids.append([self._names[int(c)] for c in codes[best]])
+            dists[i, :len(best)] = sims_to_dist(sims[best], metric)
+        return uids, dists
+
+    def best_match(self, emb: np.ndarray, metric: str = "cosine"):
+        uids, dists = self.search(emb, k=1, metric=metric)
+        if not uids[0]:
+            return None, float("inf")
+        return uids[0][0], float(dists[0, 0])
+
+
+def make_matcher(galleries: dict[str, np.ndarray], matcher_cfg: dict | None = None):
+    """Build the matcher selected by `face.matcher.backend` ("exact" or "ivf")."""
+    matcher_cfg = matcher_cfg or {}
+    backend = str(matcher_cfg.get("backend", "exact")).lower()
+    if backend == "exact":
+        return GalleryIndex.from_galleries(galleries)
+    if backend == "ivf":
+        return IVFIndex.from_galleries(
+            galleries,
+            nlist=int(matcher_cfg.get("nlist", 256)),
+            nprobe=int(matcher_cfg.get("nprobe", 16)),
+            train_iters=int(matcher_cfg.get("train_iters", 10)),
+        )
+    raise ValueError(f"Unknown matcher backend: {backend}")
+
+
+def recall_report(approx, exact, queries: np.ndarray, k: int = 1, metric: str = "cosine") -> dict:
+    """Compare an approximate matcher against exact search on the same queries."""
+    # One query at a time: that is how the worker looks up faces
+    t0 = time.perf_counter()
+    ex_uids = [exact.search(q, k=k, metric=metric)[0][0] for q in queries]
+    t_exact = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ap_uids = [approx.search(q, k=k, metric=metric)[0][0] for q in queries]
+    t_approx = time.perf_counter() - t0
+
+    top1 = np.mean([bool(a) and bool(e) and a[0] == e[0] for a, e in zip(ap_uids, ex_uids)])
+    at_k = np.mean([len(set(a) & set(e)) / max(len(e), 1) for a, e in zip(ap_uids, ex_uids)])
+    m = max(len(queries), 1)
+    return {
+        "queries": len(queries),
+        "top1_agreement": float(top1),
+        f"recall@{k}": float(at_k),
+        "exact_ms_per_query": 1000.0 * t_exact / m,
+        "approx_ms_per_query": 1000.0 * t_approx / m,
+    }
+
+
+def synthetic_galleries(n_users: int, per_user: int = 8, dim: int = 512, noise: float = 0.6, seed: int = 0):
+    """Clustered unit vectors that behave roughly like face embeddings; returns (galleries, queries)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_users, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+
+    def jitter(c, n):
+        x = c + noise * rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+    galleries = {f"u{i}": jitter(centers[i], per_user) for i in range(n_users)}
+    queries = np.concatenate([jitter(centers[i], 1) for i in rng.choice(n_users, size=min(500, n_users))])
+    return galleries, queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall/latency of the IVF matcher against exact search")
+    parser.add_argument("--users", type=int, default=5000, help="synthetic identities")
+    parser.add_argument("--per-user", type=int, default=8, help="embeddings per identity")
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--enrolled", action="store_true",
+                        help="use the enrolled galleries (embedding caches) instead of synthetic data")
+    args = parser.parse_args()
+
+    if args.enrolled:
+        from .face import load_all_user_galleries
+        from .users import load_users, ENROLL_DIR
+        galleries = load_all_user_galleries(load_users(), None, ENROLL_DIR)
+        queries = np.concatenate([g for g in galleries.values() if g.size] or [np.zeros((0, 512), np.float32)])
+    else:
+        galleries, queries = synthetic_galleries(args.users, args.per_user)
+
+    exact = GalleryIndex.from_galleries(galleries)
+    print(f"[ANN] {len(galleries)} users, {len(exact)} embeddings, {len(queries)} queries")
+    t0 = time.perf_counter()
+    ivf = IVFIndex.from_galleries(galleries, nlist=args.nlist)
+    print(f"[ANN] trained nlist={args.nlist} in {time.perf_counter() - t0:.2f}s")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        print(f"[ANN] nprobe={nprobe}:", recall_report(ivf, exact, queries, k=args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,54 @@
 from __future__ import annotations
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, jsonify, send_file, send_from_directory, request, stream_with_context
 from pathlib import Path
-import csv
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from .users import load_users, create_user, get_user, user_enroll_path, ENROLL_DIR
-from .face import FaceEngine, load_all_user_galleries
+from .face import build_gallery_for_dir, enroll_photos, cache_signature
+from .embed_cache import EmbeddingCache
+from .gallery_sync import publish_snapshot, update_snapshot
 import os
-from .engine_runtime import get_face_engine
+import threading
+import time
+from datetime import datetime
+import cv2
+import numpy as np
+from .engine_runtime import get_face_engine, engine_loaded
+from .event_store import REENCODED, open_event_store
+from .event_embeddings import open_event_embeddings
+from .metrics import load_snapshot, render_prometheus
+from .live import LiveReader, ring_path
+from .jobs import JobQueue
+from .thumbs import ThumbCache
+from .clusters import CLUSTERS_DIR, read_clusters, read_promoted, promote_cluster
 
-ENGINE = None
-GALLERIES = {}
+# Nothing here loads a model at import time: the face engine is built by a background
+# job (warmup at startup, or the first enrollment) so the API starts instantly and
+# event browsing never waits on ONNX.
 MIN_FACE_SIZE = 80
+DUPLICATE_SIM = float(os.getenv("ENROLL_DUPLICATE_SIM", "0.95"))
+UPLOAD_WAIT_SEC = float(os.getenv("ENROLL_WAIT_SEC", "20"))
+JOBS = JobQueue(workers=1)
 
 app = Flask(__name__)
 
 ROOT = Path(__file__).resolve().parents[1]
 EVENTS_DIR = ROOT / "data" / "events"
 CSV_PATH = EVENTS_DIR / "events.csv"
+LIVE_DIR = ROOT / "data" / "live"
+LIVE_MAX_SEC = float(os.getenv("LIVE_MAX_SEC", "600"))
+# Each MJPEG stream holds a server thread for its whole length; keep some for everything else
+LIVE_MAX_STREAMS = int(os.getenv("LIVE_MAX_STREAMS", "3"))
+LIVE_STREAMS = threading.BoundedSemaphore(max(1, LIVE_MAX_STREAMS))
+WORKER_METRICS = Path(os.getenv("WORKER_METRICS_PATH", ROOT / "data" / "metrics" / "worker.json"))
+THUMBS = ThumbCache(ROOT / "data" / "thumbs", max_bytes=int(float(os.getenv("THUMB_CACHE_MB", "64")) * (1 << 20)))
+# Image URLs are versioned: a clip never changes once written, and a snapshot changes only
+# once, when retention re-encodes it, which bumps its URL (`?v=1`). So clients may keep any URL
+IMAGE_MAX_AGE = int(os.getenv("IMAGE_MAX_AGE_SEC", str(30 * 86400)))
+# Only snapshots and clips are served from EVENTS_DIR; the event store (events.db, and the
+# face embeddings in events.emb) lives there too and must never be downloadable
+EVENT_FILE_EXTS = {".jpg", ".jpeg", ".png", ".mp4", ".avi"}
+CLUSTER_SUGGEST_SIGHTINGS = int(os.getenv("CLUSTER_SUGGEST_SIGHTINGS", "5"))
 
 @app.after_request
 def add_cors_headers(resp):
@@ -28,59 +60,466 @@ def add_cors_headers(resp):
 
 @app.get("/healthz")
 def healthz():
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "engine_loaded": engine_loaded()})
+
+
+def start_warmup() -> dict:
+    """Load the face engine in the background so the first enrollment doesn't pay for it."""
+    return JOBS.submit("warmup", lambda: get_face_engine().model_tag)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Worker stage latencies, FPS, drops and queue depths (published by the worker) in Prometheus format."""
+    snap = load_snapshot(WORKER_METRICS)
+    lines = ["# TYPE securitycam_worker_up gauge"]
+    if snap is None:
+        lines.append("securitycam_worker_up 0")
+        body = "\n".join(lines) + "\n"
+    else:
+        age = max(0.0, time.time() - snap.get("ts", 0))
+        # Stale snapshot = worker stopped publishing
+        up = age <= 3 * float(snap.get("interval", 5))
+        lines += [
+            f"securitycam_worker_up {int(up)}",
+            "# TYPE securitycam_worker_metrics_age_seconds gauge",
+            f"securitycam_worker_metrics_age_seconds {age:.1f}",
+        ]
+        body = "\n".join(lines) + "\n" + render_prometheus(snap)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+def event_image_name(img_path: str) -> str:
+    """Path of a snapshot relative to EVENTS_DIR (cameras write into per-camera subfolders)."""
+    if not img_path:
+        return ""
+    p = Path(img_path)
+    if not p.is_absolute():
+        p = ROOT / p
+    try:
+        return p.relative_to(EVENTS_DIR).as_posix()
+    except ValueError:
+        return p.name
+
+
+def _iso(t: float | None) -> str | None:
+    return datetime.fromtimestamp(t).isoformat(timespec="seconds") if t else None
+
+
+def _cursor(value: str | None) -> tuple[int | None, str | None]:
+    """`before`/`since` accept an event id (page cursor) or an ISO timestamp."""
+    if not value:
+        return None, None
+    if value.isdigit():
+        return int(value), None
+    return None, value
+
+
+def event_json(e: dict, base: str | None = None) -> dict:
+    # Build an absolute image URL so phone can load (`base` for jobs, which run outside the request)
+    filename = event_image_name(e.get("image_path", ""))
+    base = (base or request.host_url).rstrip("/")
+    # A snapshot re-encoded by retention is a new version of the file (see IMAGE_MAX_AGE)
+    version = "?v=1" if e.get("compacted") == REENCODED else ""
+    image_url = f"{base}/events/{filename}{version}" if filename else ""
+    thumbnails = {size: f"{base}/thumbs/{size}/{filename}{version}" for size in THUMBS.sizes} if filename else {}
+    # The clip is written a few seconds after the event (post-roll); empty until it exists
+    clip = event_image_name(e.get("clip_path") or "")
+    clip_url = f"{base}/events/{clip}" if clip and (EVENTS_DIR / clip).exists() else ""
+    distance = e.get("distance")
+    return {
+        "id": e["id"],
+        "timestamp": e.get("ts", ""),
+        "camera": e.get("camera", ""),
+        "label": e.get("label", ""),
+        "distance": f"{distance:.3f}" if distance is not None else "",
+        "bbox": {
+            "x": e.get("bbox_x"), "y": e.get("bbox_y"), "w": e.get("bbox_w"), "h": e.get("bbox_h")
+        },
+        "image_url": image_url,
+        "thumb_url": thumbnails.get("thumb", ""),
+        "thumbnails": thumbnails,
+        "filename": filename,
+        "clip_url": clip_url,
+        "cluster_id": e.get("cluster_id"),
+    }
 
 
 @app.get("/api/events")
 def list_events():
-    limit = int(request.args.get("limit", "100"))
+    """
+    Newest-first page of events.
+    Query: limit, before / since (event id cursor or ISO timestamp), label (comma list), camera,
+    cluster (unknown-face cluster id). Pass the returned `next_before` as `before` to fetch the next page.
+    With `since` the page holds the events right after the cursor; `next_since` is set while more follow.
+    """
+    limit = min(int(request.args.get("limit", "100")), 1000)
+    before_id, before_ts = _cursor(request.args.get("before"))
+    since_id, since_ts = _cursor(request.args.get("since"))
+    labels = [l for l in (request.args.get("label") or "").split(",") if l]
+    cluster = request.args.get("cluster")
+
+    rows = open_event_store(CSV_PATH).page(
+        limit=limit,
+        before_id=before_id,
+        since_id=since_id,
+        before_ts=before_ts,
+        since_ts=since_ts,
+        labels=labels or None,
+        camera=request.args.get("camera"),
+        cluster_id=int(cluster) if cluster and cluster.isdigit() else None,
+    )
+    events = [event_json(e) for e in rows]
+    next_before = events[-1]["id"] if len(events) == limit and events else None
+    forward = since_id is not None or since_ts
+    next_since = events[0]["id"] if forward and len(events) == limit and events else None
+    return jsonify({"events": events, "count": len(events), "next_before": next_before, "next_since": next_since})
+
+
+def _similar(query, args: dict, base: str, exclude_id: int | None = None):
+    """Events whose stored face embeddings are closest to `query`, with the list filters of /api/events (`args`)."""
+    t0 = time.perf_counter()
+    labels = [l for l in (args.get("label") or "").split(",") if l]
+    found = open_event_embeddings(CSV_PATH).search(
+        query,
+        limit=min(int(args.get("limit", "20")), 200),
+        min_similarity=float(args.get("min_similarity", "0.3")),
+        exclude_id=exclude_id,
+        since_ts=args.get("since") or None,
+        before_ts=args.get("before") or None,
+        labels=labels or None,
+        camera=args.get("camera"),
+    )
+    store = open_event_store(CSV_PATH)
     events = []
+    for event_id, sim in found:
+        e = store.get(event_id)
+        if e is not None:
+            events.append({**event_json(e, base), "similarity": round(sim, 4)})
+    return {"events": events, "count": len(events), "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
 
-    if CSV_PATH.exists():
-        with CSV_PATH.open("r", newline="") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Normalize fields
-                ts = row.get("timestamp", "")
-                label = row.get("label", "")
-                distance = row.get("distance", "")
-                bbox_x = row.get("bbox_x", "")
-                bbox_y = row.get("bbox_y", "")
-                bbox_w = row.get("bbox_w", "")
-                bbox_h = row.get("bbox_h", "")
-                img_path = row.get("image_path", "")
-
-                # Build an absolute image URL so phone can load
-                filename = Path(img_path).name if img_path else ""
-                base = request.host_url.rstrip("/")
-                image_url = f"{base}/events/{filename}" if filename else ""
-
-                events.append({
-                    "timestamp": ts,
-                    "label": label,
-                    "distance": distance,
-                    "bbox": {
-                        "x": bbox_x, "y": bbox_y, "w": bbox_w, "h": bbox_h
-                    },
-                    "image_url": image_url,
-                    "filename": filename,
-                })
-
-    # Newest first
-    events.sort(key=lambda e: e["timestamp"], reverse=True)
-    events = events[:limit]
-    return jsonify({"events": events, "count": len(events)})
+@app.get("/api/events/<int:event_id>/similar")
+def similar_to_event(event_id: int):
+    """
+    Past events with the same face as this one, most similar first.
+    Query: limit, min_similarity (cosine, default 0.3), since / before (ISO time), label, camera.
+    """
+    e = open_event_store(CSV_PATH).get(event_id)
+    if e is None:
+        return jsonify({"error": "event not found"}), 404
+    # The best face of the event comes first
+    query = open_event_embeddings(CSV_PATH).of_event(event_id)
+    if not len(query):
+        return jsonify({"error": "no face embedding stored for this event"}), 409
+    body = _similar(query[0], request.args, request.host_url, exclude_id=event_id)
+    return jsonify({"query": {"event_id": event_id}, **body})
+
+
+def similar_photo_job(img: np.ndarray, args: dict, base: str) -> dict:
+    """Detect and embed the largest face of a photo, then search the events for it."""
+    faces = get_face_engine().detect_and_embed(img, min_face_size=MIN_FACE_SIZE)
+    faces = [x for x in faces if x.get("embedding") is not None]
+    if not faces:
+        return {"error": "no face found"}
+    best = max(faces, key=lambda x: x["bbox"][2] * x["bbox"][3])
+    query = {"bbox": [int(v) for v in best["bbox"]], "det_score": round(float(best["score"]), 3)}
+    return {"query": query, **_similar(best["embedding"], args, base)}
+
+
+@app.post("/api/events/similar")
+def similar_to_photo():
+    """
+    Like /api/events/<id>/similar for the largest face in an uploaded `photo`. The face is
+    detected and embedded on the job thread; answers 202 with the job if that takes longer than `wait`.
+    """
+    f = request.files.get("photo")
+    if f is None:
+        return jsonify({"error": "no photo"}), 400
+    img = cv2.imdecode(np.frombuffer(f.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return jsonify({"error": "unreadable image"}), 400
+
+    job = JOBS.submit("similar", similar_photo_job, img, request.args.to_dict(), request.host_url)
+    wait = min(float(request.args.get("wait", UPLOAD_WAIT_SEC)), UPLOAD_WAIT_SEC)
+    job = JOBS.wait(job["id"], wait) if wait > 0 else job
+    if job["status"] == "done":
+        if "error" in job["result"]:
+            return jsonify({**job["result"], "job": job_json(job)}), 422
+        return jsonify(job["result"]), 200
+    if job["status"] == "failed":
+        return jsonify({"ok": False, "error": job["error"], "job": job_json(job)}), 500
+    return jsonify({"ok": True, "job": job_json(job)}), 202
 
 
 @app.get("/events/<path:filename>")
 def serve_event_image(filename: str):
-    return send_from_directory(EVENTS_DIR, filename, as_attachment=False)
+    # Snapshots and clips; conditional responses answer Range requests (206) so clips can be streamed
+    if Path(filename).suffix.lower() not in EVENT_FILE_EXTS:
+        return jsonify({"error": "not found"}), 404
+    resp = send_from_directory(EVENTS_DIR, filename, as_attachment=False, conditional=True, max_age=IMAGE_MAX_AGE)
+    resp.cache_control.immutable = True
+    return resp
+
+
+@app.get("/thumbs/<size>/<path:filename>")
+def serve_event_thumb(size: str, filename: str):
+    """Snapshot resized to one of THUMBS.sizes (thumb 160 px, small 320, medium 640 wide), cached on disk."""
+    if size not in THUMBS.sizes:
+        return jsonify({"error": f"unknown size, one of {sorted(THUMBS.sizes)}"}), 404
+    if Path(filename).suffix.lower() not in EVENT_FILE_EXTS:
+        return jsonify({"error": "not found"}), 404
+    src = safe_join(str(EVENTS_DIR), filename)
+    if src is None or not os.path.isfile(src):
+        return jsonify({"error": "not found"}), 404
+    out = THUMBS.get(Path(src), filename, size)
+    if out is None:
+        return jsonify({"error": "not an image"}), 415
+    resp = send_file(out, mimetype="image/jpeg", conditional=True, etag=True, max_age=IMAGE_MAX_AGE)
+    resp.cache_control.immutable = True
+    return resp
+
+def _live_reader(cam_id: str) -> LiveReader | None:
+    if secure_filename(cam_id) != cam_id:
+        return None
+    path = ring_path(LIVE_DIR, cam_id)
+    return LiveReader(path) if path.exists() else None
+
+
+def _wait_frame(reader: LiveReader, after: int, timeout: float) -> tuple[int, float, bytes] | None:
+    deadline = time.monotonic() + timeout
+    while True:
+        item = reader.latest(after=after)
+        if item is not None or time.monotonic() >= deadline:
+            return item
+        time.sleep(0.02)
+
+
+@app.get("/api/live")
+def list_live():
+    """Cameras publishing a live view, with their stream URLs."""
+    base = request.host_url.rstrip("/")
+    cams = []
+    for p in sorted(LIVE_DIR.glob("*.ring")):
+        reader = LiveReader(p)
+        cams.append({
+            "id": p.stem,
+            "mjpeg_url": f"{base}/api/live/{p.stem}.mjpg",
+            "jpeg_url": f"{base}/api/live/{p.stem}.jpg",
+            "last_frame_ts": reader.writer_ts(),
+        })
+        reader.close()
+    return jsonify({"cameras": cams})
+
+
+@app.get("/api/live/<cam_id>.jpg")
+def live_jpeg(cam_id: str):
+    """Latest frame of a camera as one JPEG (for clients that poll)."""
+    reader = _live_reader(cam_id)
+    if reader is None:
+        return jsonify({"error": "camera not live"}), 404
+    try:
+        item = reader.latest()
+        if item is None or time.time() - item[1] > 2.0:
+            # The worker only encodes while someone watches; give it a moment to wake up
+            item = _wait_frame(reader, item[0] if item else 0, timeout=2.0) or item
+    finally:
+        reader.close()
+    if item is None:
+        return jsonify({"error": "no frame yet"}), 503
+    resp = Response(item[2], mimetype="image/jpeg")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@app.get("/api/live/<cam_id>.mjpg")
+def live_mjpeg(cam_id: str):
+    """
+    MJPEG stream (multipart/x-mixed-replace). Each part is the newest frame when the client
+    is ready for it, so slow clients skip frames instead of falling behind.
+    Query: max_sec (stream length, capped by LIVE_MAX_SEC).
+    At most LIVE_MAX_STREAMS streams run at once; more get 503 (poll /api/live/<camera>.jpg instead).
+    """
+    reader = _live_reader(cam_id)
+    if reader is None:
+        return jsonify({"error": "camera not live"}), 404
+    if not LIVE_STREAMS.acquire(blocking=False):
+        reader.close()
+        resp = jsonify({"error": "too many live streams", "max_streams": LIVE_MAX_STREAMS})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "10"
+        return resp
+    max_sec = min(float(request.args.get("max_sec", LIVE_MAX_SEC)), LIVE_MAX_SEC)
+
+    def frames():
+        # The reader remaps the ring when a restarted worker recreates it, and latest()
+        # treats its restarted sequence as new frames, so `seq` never strands the stream
+        seq = 0
+        end = time.monotonic() + max_sec
+        while time.monotonic() < end:
+            item = _wait_frame(reader, seq, timeout=5.0)
+            if item is None:
+                continue
+            seq, _, jpeg = item
+            yield (b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: "
+                   + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+
+    def done():
+        reader.close()
+        LIVE_STREAMS.release()
+
+    resp = Response(stream_with_context(frames()), mimetype="multipart/x-mixed-replace; boundary=frame")
+    resp.headers["Cache-Control"] = "no-store"
+    # Runs once the response is closed, also when the client left before the first frame
+    resp.call_on_close(done)
+    return resp
+
+
+def all_galleries(user_ids: list[str]) -> dict:
+    """Galleries of these users from their enrollment folders (cached embeddings are reused)."""
+    engine = get_face_engine()
+    return {uid: build_gallery_for_dir(ENROLL_DIR / uid, engine, min_face_size=MIN_FACE_SIZE) for uid in user_ids}
+
+
+def refresh_galleries(user_ids: list[str] | None = None) -> dict:
+    """
+    Bring the on-disk embedding caches of these users (default: everyone) up to date.
+    Runs as a background job; the worker builds its galleries from the same caches.
+    """
+    engine = get_face_engine()
+    names = {u["id"]: u["name"] for u in load_users()}
+    ids = user_ids or list(names)
+    galleries = all_galleries(ids)
+    signature = cache_signature(engine, MIN_FACE_SIZE)
+    if user_ids:
+        manifest = update_snapshot(galleries, names, signature, rebuild=lambda: all_galleries(list(names)))
+    else:
+        manifest = publish_snapshot(galleries, names, signature)
+    return {"embeddings": {uid: int(g.shape[0]) for uid, g in galleries.items()}, "generation": manifest["generation"]}
+
+
+@app.post("/api/galleries/refresh")
+def api_refresh_galleries():
+    """Re-scan enrollment folders (e.g. after copying photos in by hand) in the background."""
+    job = JOBS.submit("refresh", refresh_galleries)
+    return jsonify({"job": job_json(job)}), 202
+
+
+def enroll_new_photos(user_id: str, names: list[str]) -> dict:
+    """Embed just the uploaded photos (one batch), then publish a new gallery generation."""
+    engine = get_face_engine()
+    d = user_enroll_path(user_id)
+    report = enroll_photos(d, [d / n for n in names], engine, min_face_size=MIN_FACE_SIZE, dup_sim=DUPLICATE_SIM)
+    signature = cache_signature(engine, MIN_FACE_SIZE)
+    gallery = EmbeddingCache(d, signature).gallery()
+    names = {u["id"]: u["name"] for u in load_users()}
+    manifest = update_snapshot({user_id: gallery}, names, signature, rebuild=lambda: all_galleries(list(names)))
+    return {
+        "photos": report,
+        "added": sum(1 for r in report if r["face_found"]),
+        "generation": manifest["generation"],
+    }
+
+
+def cluster_json(c: dict, counts: dict, promoted: dict) -> dict:
+    events, newest = counts.get(c["id"], (0, None))
+    latest = open_event_store(CSV_PATH).get(newest) if newest else None
+    return {
+        "id": c["id"],
+        "sightings": c["count"],
+        "events": events,
+        "first_seen": _iso(c["first_seen"]),
+        "last_seen": _iso(c["last_seen"]),
+        "last_alert": _iso(c["last_alert"]),
+        # Seen often enough to be someone who belongs here (a neighbour, a courier...)
+        "suggest_enroll": c["count"] >= CLUSTER_SUGGEST_SIGHTINGS and c["id"] not in promoted,
+        "promoted_to": promoted.get(c["id"], {}).get("user_id"),
+        "latest_event": event_json(latest) if latest else None,
+        "events_url": f"{request.host_url.rstrip('/')}/api/events?cluster={c['id']}",
+    }
+
+
+@app.get("/api/clusters")
+def list_clusters():
+    """
+    Unknown-face clusters made by the worker, most sightings first.
+    Query: limit, min_sightings.
+    """
+    manifest = read_clusters(CLUSTERS_DIR) or {"clusters": []}
+    limit = min(int(request.args.get("limit", "100")), 1000)
+    min_sightings = int(request.args.get("min_sightings", "1"))
+    counts = open_event_store(CSV_PATH).cluster_counts()
+    promoted = read_promoted(CLUSTERS_DIR)
+    found = [c for c in manifest["clusters"] if c["count"] >= min_sightings]
+    found.sort(key=lambda c: (c["count"], c["last_seen"]), reverse=True)
+    clusters = [cluster_json(c, counts, promoted) for c in found[:limit]]
+    return jsonify({"clusters": clusters, "count": len(clusters), "total": len(manifest["clusters"])})
+
+
+def promote_cluster_job(cluster_id: int, user_id: str, max_photos: int) -> dict:
+    """Enroll a cluster's stored embeddings as a user's photos, then publish a new gallery generation."""
+    engine = get_face_engine()
+    manifest = read_clusters(CLUSTERS_DIR) or {}
+    if manifest.get("model_tag") and manifest["model_tag"] != engine.model_tag:
+        raise RuntimeError(f"cluster embeddings come from {manifest['model_tag']}, the API runs {engine.model_tag}"
+                           " (set the same FACE_PROFILE for both)")
+    signature = cache_signature(engine, MIN_FACE_SIZE)
+    d = user_enroll_path(user_id)
+    photos = promote_cluster(cluster_id, user_id, d, CSV_PATH, signature, max_photos=max_photos,
+                             clusters_dir=CLUSTERS_DIR)
+    if not photos:
+        raise RuntimeError("no event of this cluster has a snapshot and a stored embedding")
+    gallery = EmbeddingCache(d, signature).gallery()
+    names = {u["id"]: u["name"] for u in load_users()}
+    manifest = update_snapshot({user_id: gallery}, names, signature, rebuild=lambda: all_galleries(list(names)))
+    return {"photos": photos, "added": len(photos), "generation": manifest["generation"]}
+
+
+@app.post("/api/clusters/<int:cluster_id>/promote")
+def api_promote_cluster(cluster_id: int):
+    """
+    Enroll an unknown-face cluster as a user, without re-embedding anything.
+    Body: {"name": "..."} for a new user or {"user_id": "..."} to add to one; optional "max_photos" (10).
+    """
+    manifest = read_clusters(CLUSTERS_DIR) or {"clusters": []}
+    if not any(c["id"] == cluster_id for c in manifest["clusters"]):
+        return jsonify({"error": "cluster not found"}), 404
+    if cluster_id in read_promoted(CLUSTERS_DIR):
+        return jsonify({"error": "cluster already promoted"}), 409
+    data = request.get_json(silent=True) or {}
+    if data.get("user_id"):
+        user = get_user(data["user_id"])
+        if not user:
+            return jsonify({"error": "user not found"}), 404
+    else:
+        name = (data.get("name") or "").strip()
+        if not name:
+            return jsonify({"error": "name or user_id required"}), 400
+        user = create_user(name)
+    max_photos = min(int(data.get("max_photos", 10)), 50)
+
+    job = JOBS.submit("promote", promote_cluster_job, cluster_id, user["id"], max_photos, user_id=user["id"])
+    wait = min(float(request.args.get("wait", UPLOAD_WAIT_SEC)), UPLOAD_WAIT_SEC)
+    job = JOBS.wait(job["id"], wait) if wait > 0 else job
+    body = {"ok": True, "user": user, "cluster_id": cluster_id, "job": job_json(job)}
+    if job["status"] == "done":
+        return jsonify({**body, **job["result"]}), 200
+    if job["status"] == "failed":
+        return jsonify({**body, "ok": False, "error": job["error"]}), 500
+    return jsonify(body), 202
+
+
+def job_json(job: dict) -> dict:
+    return {**job, "status_url": f"{request.host_url.rstrip('/')}/api/jobs/{job['id']}"}
+
+
+@app.get("/api/jobs/<job_id>")
+def api_job_status(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify({"job": job_json(job)})
 
-def refresh_galleries():
-    global GALLERIES
-    users = load_users()
-    ENGINE = get_face_engine()
-    GALLERIES = load_all_user_galleries(users, ENGINE, ENROLL_DIR, min_face_size=MIN_FACE_SIZE)
 
 @app.post("/api/users")
 def api_create_user():
@@ -88,9 +527,10 @@ def api_create_user():
     name = (data.get("name") or "").strip()
     if not name:
         return jsonify({"error": "name required"}), 400
+    # A new user has no photos yet, so there is no gallery to build (and with no snapshot yet,
+    # nothing to add the name to: the first full build will have it)
     user = create_user(name)
-    # refresh galleries so new empty user exists
-    refresh_galleries()
+    update_snapshot({}, {u["id"]: u["name"] for u in load_users()}, None)
     return jsonify({"user": user}), 201
 
 @app.get("/api/users")
@@ -126,6 +566,18 @@ def api_upload_photos(user_id: str=None):
         f.save(out)
         saved.append(out.name)
 
-    # rebuild galleries for this user
-    refresh_galleries()
-    return jsonify({"ok": True, "saved": saved, "user_id": user_id})
+    if not saved:
+        return jsonify({"error": "no supported images", "allowed": sorted({e.lower() for e in ALLOWED_EXTS})}), 400
+
+    # Only the new photos are embedded, on the background job thread. Wait a little so
+    # the usual small upload answers with its quality report; otherwise poll the job.
+    job = JOBS.submit("enroll", enroll_new_photos, user_id, saved, user_id=user_id)
+    wait = min(float(request.args.get("wait", UPLOAD_WAIT_SEC)), UPLOAD_WAIT_SEC)
+    job = JOBS.wait(job["id"], wait) if wait > 0 else job
+    body = {"ok": True, "saved": saved, "user_id": user_id, "job": job_json(job)}
+    if job["status"] == "done":
+        body["photos"] = job["result"]["photos"]
+        return jsonify(body), 200
+    if job["status"] == "failed":
+        return jsonify({**body, "ok": False, "error": job["error"]}), 500
+    return jsonify(body), 202
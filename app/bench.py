@@ -0,0 +1,138 @@
+from __future__ import annotations
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+from .config import load_config, update_config
+
+# Offline benchmark: replays one clip through the full worker pipeline (run()) headless,
+# once per variant, each in a fresh process so timings, CPU and peak RSS don't mix.
+#   python -m app.bench clip.mp4 --motion diff background --schedule fixed adaptive --matcher exact ivf
+
+AXES = {
+    "motion": ("motion", "engine"),
+    "schedule": ("face", "schedule", "mode"),
+    "matcher": ("face", "matcher", "backend"),
+}
+
+
+def variant_config(base: dict, clip: str, realtime: bool, out_dir: str, variant: dict) -> dict:
+    """Worker config for one run: file source, no window, no Telegram, events in a scratch dir."""
+    cfg = copy.deepcopy(base)
+    update_config(cfg, {
+        "show_window": False,
+        "diag_every_sec": 0,
+        "cameras": [{"id": "bench", "source": "file", "path": clip, "realtime": realtime}],
+        "events": {"dir": out_dir, "csv_path": str(Path(out_dir) / "events.csv")},
+        "notify": {"telegram": {"enabled": False}},
+        "metrics": {"enabled": False},
+        "live": {"enabled": False},
+        "retention": {"enabled": False},
+        "face": {"clustering": {"dir": str(Path(out_dir) / "clusters")}},
+    })
+    for axis, value in variant.items():
+        *path, leaf = AXES[axis]
+        node = cfg
+        for k in path:
+            node = node.setdefault(k, {})
+        node[leaf] = value
+    return cfg
+
+
+def _child(cfg: dict, results) -> None:
+    from .main import run
+    from .metrics import metrics
+
+    ru0 = resource.getrusage(resource.RUSAGE_SELF)
+    t0 = time.perf_counter()
+    error = None
+    try:
+        run(cfg)
+    except Exception as e:
+        error = repr(e)
+    wall = time.perf_counter() - t0
+    ru1 = resource.getrusage(resource.RUSAGE_SELF)
+
+    snap = metrics.snapshot()
+    counters = {}
+    for c in snap["counters"]:
+        tag = c["name"] + "".join(f"[{v}]" for k, v in sorted(c["labels"].items()) if k != "camera")
+        counters[tag] = counters.get(tag, 0) + c["value"]
+    cpu = (ru1.ru_utime - ru0.ru_utime) + (ru1.ru_stime - ru0.ru_stime)
+    results.put({
+        "error": error,
+        "wall_sec": round(wall, 2),
+        "frames": int(counters.get("frames_total", 0)),
+        "fps": round(counters.get("frames_total", 0) / wall, 2) if wall > 0 else 0.0,
+        "cpu_pct": round(100.0 * cpu / wall, 1) if wall > 0 else 0.0,   # 100 = one core
+        "rss_mb": round(ru1.ru_maxrss / 1024.0, 1),                        # peak, Linux reports KiB
+        "stages": metrics.summary(),
+        "counters": counters,
+    })
+
+
+def run_variant(cfg: dict) -> dict:
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    p = ctx.Process(target=_child, args=(cfg, results))
+    p.start()
+    try:
+        out = results.get()
+    except KeyboardInterrupt:
+        p.terminate()
+        raise
+    p.join()
+    return out
+
+
+def print_report(rows: list[tuple[dict, dict]]) -> None:
+    print("\n[Bench] results (stage: p50 ms / p95 ms / per sec)")
+    for variant, r in rows:
+        name = " ".join(f"{k}={v}" for k, v in variant.items()) or "config.yaml"
+        print(f"\n== {name}")
+        if r["error"]:
+            print(f"   FAILED: {r['error']}")
+        print(f"   frames={r['frames']} wall={r['wall_sec']}s fps={r['fps']} "
+              f"cpu={r['cpu_pct']}% rss={r['rss_mb']}MB")
+        for stage, (p50, p95, rate) in sorted(r["stages"].items()):
+            print(f"   {stage:<20} {p50:>8} {p95:>8} {rate:>8}")
+        interesting = {k: v for k, v in r["counters"].items() if not k.startswith("frames_total")}
+        print("   counters:", interesting)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a clip through the worker pipeline and compare variants")
+    parser.add_argument("clip", help="video file or folder of images")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--realtime", action="store_true",
+                        help="replay at the clip's native fps (frames are skipped when behind) instead of flat out")
+    parser.add_argument("--motion", nargs="+", help="motion engines to compare (diff, background)")
+    parser.add_argument("--schedule", nargs="+", help="detection schedules to compare (fixed, adaptive)")
+    parser.add_argument("--matcher", nargs="+", help="matcher backends to compare (exact, ivf)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    base = load_config(args.config)
+    axes = {a: getattr(args, a) for a in AXES if getattr(args, a)}
+    variants = [dict(zip(axes, combo)) for combo in itertools.product(*axes.values())] or [{}]
+
+    rows = []
+    for variant in variants:
+        with tempfile.TemporaryDirectory(prefix="bench-events-") as out_dir:
+            print(f"[Bench] running {variant or 'config.yaml'} on {args.clip}")
+            cfg = variant_config(base, args.clip, args.realtime, out_dir, variant)
+            rows.append((variant, run_variant(cfg)))
+
+    print_report(rows)
+    if args.json:
+        Path(args.json).write_text(json.dumps([{"variant": v, **r} for v, r in rows], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .config import load_config
+from .embed_cache import list_images
+from .engine_runtime import PROFILES, engine_kwargs
+from .users import load_users, ENROLL_DIR
+
+# Engine profile calibration on this machine and this household's enrolled photos:
+#   python -m app.calibrate                      # every profile
+#   python -m app.calibrate --profiles balanced light-int8 tiny-int8
+# Each profile runs in a fresh process (load time, latency, peak RSS don't mix). Accuracy
+# is leave-one-out on the enrolled set: every photo is matched against all the others,
+# the way the worker matches a camera face against the galleries.
+
+
+def enrolled_photos(users: list[dict], per_user: int = 0) -> list[tuple[str, Path]]:
+    out = []
+    for u in users:
+        paths = list_images(ENROLL_DIR / u["id"])
+        out += [(u["id"], p) for p in (paths[:per_user] if per_user > 0 else paths)]
+    return out
+
+
+def _ms(samples: list[float], q: float) -> float:
+    return round(1000.0 * float(np.percentile(samples, q)), 2) if samples else 0.0
+
+
+def match_accuracy(embs: np.ndarray, labels: list[str], max_distance: float) -> dict:
+    """
+    Leave-one-out over the enrolled embeddings (unit rows). A probe counts when its user has
+    another photo. rank1 = nearest other photo is the same user; tar = that, and within
+    max_distance; far = nearest photo of a *different* user is within max_distance.
+    """
+    labels = np.array(labels, dtype=object)
+    n = len(labels)
+    if n < 2:
+        return {"probes": 0, "rank1": None, "tar": None, "far": None}
+    sims = embs @ embs.T
+    np.fill_diagonal(sims, -np.inf)
+    same = labels[:, None] == labels[None, :]
+    np.fill_diagonal(same, False)
+    probes = same.any(axis=1)
+    if not probes.any():
+        return {"probes": 0, "rank1": None, "tar": None, "far": None}
+
+    best = np.argmax(sims, axis=1)
+    hit = labels[best] == labels
+    dist = 1.0 - sims[np.arange(n), best]
+    impostor = 1.0 - np.where(same | np.eye(n, dtype=bool), -np.inf, sims).max(axis=1)
+    p = probes
+    return {
+        "probes": int(p.sum()),
+        "rank1": round(float(hit[p].mean()), 4),
+        "tar": round(float((hit & (dist <= max_distance))[p].mean()), 4),
+        "far": round(float((impostor <= max_distance)[p].mean()), 4),
+    }
+
+
+def _child(profile: str, photos: list[tuple[str, str]], min_face_size: int, max_distance: float,
+           repeat: int, results) -> None:
+    from .face import FaceEngine
+
+    try:
+        kw = engine_kwargs(profile)
+        t0 = time.perf_counter()
+        engine = FaceEngine(**kw)
+        load_sec = time.perf_counter() - t0
+
+        det_t, emb_t, labels, embs, found = [], [], [], [], 0
+        for uid, path in photos:
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            for _ in range(max(1, repeat)):
+                t = time.perf_counter()
+                faces = engine.detect(img, min_face_size=min_face_size)
+                det_t.append(time.perf_counter() - t)
+            if not faces:
+                continue
+            found += 1
+            best = [max(faces, key=lambda f: f["score"])]
+            t = time.perf_counter()
+            engine.embed([img], [best])
+            emb_t.append(time.perf_counter() - t)
+            if "embedding" in best[0]:
+                labels.append(uid)
+                embs.append(best[0]["embedding"])
+
+        acc = match_accuracy(np.stack(embs) if embs else np.zeros((0, 512), np.float32), labels, max_distance)
+        results.put({
+            "profile": profile,
+            "model_tag": engine.model_tag,
+            "error": None,
+            "load_sec": round(load_sec, 2),
+            "photos": len(photos),
+            "faces_found": found,
+            "detect_p50_ms": _ms(det_t, 50),
+            "detect_p95_ms": _ms(det_t, 95),
+            "embed_p50_ms": _ms(emb_t, 50),
+            "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+            **acc,
+        })
+    except Exception as e:
+        results.put({"profile": profile, "error": repr(e)})
+
+
+def run_profile(profile: str, photos, min_face_size: int, max_distance: float, repeat: int) -> dict:
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    p = ctx.Process(target=_child, args=(profile, photos, min_face_size, max_distance, repeat, results))
+    p.start()
+    try:
+        out = results.get()
+    except KeyboardInterrupt:
+        p.terminate()
+        raise
+    p.join()
+    return out
+
+
+def recommend(rows: list[dict], reference: str, max_drop: float) -> str | None:
+    """Fastest profile whose rank-1 accuracy and TAR stay within max_drop of the reference, FAR no worse."""
+    ok = [r for r in rows if not r.get("error") and r.get("rank1") is not None]
+    ref = next((r for r in ok if r["profile"] == reference), None)
+    if ref is None:
+        return None
+    good = [
+        r for r in ok
+        if r["rank1"] >= ref["rank1"] - max_drop and r["tar"] >= ref["tar"] - max_drop and r["far"] <= ref["far"] + 1e-9
+    ]
+    return min(good, key=lambda r: r["detect_p50_ms"] + r["embed_p50_ms"])["profile"] if good else reference
+
+
+def print_report(rows: list[dict], max_distance: float) -> None:
+    print(f"\n[Calibrate] enrolled-set results (max_distance={max_distance})")
+    print(f"   {'profile':<12} {'load s':>7} {'det p50':>8} {'det p95':>8} {'emb ms':>7} {'rss MB':>7} "
+          f"{'found':>9} {'rank1':>6} {'tar':>6} {'far':>6}")
+    for r in rows:
+        if r.get("error"):
+            print(f"   {r['profile']:<12} FAILED: {r['error']}")
+            continue
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        print(f"   {r['profile']:<12} {r['load_sec']:>7} {r['detect_p50_ms']:>8} {r['detect_p95_ms']:>8} "
+              f"{r['embed_p50_ms']:>7} {r['rss_mb']:>7} {r['faces_found']:>4}/{r['photos']:<4} "
+              f"{fmt(r['rank1']):>6} {fmt(r['tar']):>6} {fmt(r['far']):>6}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure engine profiles (latency, match accuracy) on the enrolled photos")
+    parser.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--reference", default="balanced", help="profile the others must stay close to")
+    parser.add_argument("--max-drop", type=float, default=0.02, help="accepted loss in rank-1 accuracy / TAR")
+    parser.add_argument("--repeat", type=int, default=3, help="detector runs per photo (latency samples)")
+    parser.add_argument("--per-user", type=int, default=0, help="use at most this many photos per user (0 = all)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    face_cfg = load_config(args.config).get("face", {})
+    min_face_size = int(face_cfg.get("min_face_size", 80))
+    max_distance = float(face_cfg.get("max_distance", 0.45))
+    photos = [(uid, str(p)) for uid, p in enrolled_photos(load_users(), args.per_user)]
+    if not photos:
+        raise SystemExit("[Calibrate] No enrolled photos; add users and photos first")
+
+    profiles = list(dict.fromkeys([args.reference] + args.profiles)) if args.reference in PROFILES else args.profiles
+    rows = []
+    for profile in profiles:
+        print(f"[Calibrate] {profile}: {len(photos)} photos")
+        rows.append(run_profile(profile, photos, min_face_size, max_distance, args.repeat))
+
+    print_report(rows, max_distance)
+    best = recommend(rows, args.reference, args.max_drop)
+    if best is not None:
+        print(f"\n[Calibrate] Fastest profile within {args.max_drop:.0%} of {args.reference}: {best}  "
+              f"(set FACE_PROFILE={best} for both the api and the worker, then refresh the galleries)")
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
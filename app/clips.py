@@ -0,0 +1,184 @@
+from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .live import encode_jpeg
+from .metrics import metrics
+from .storage import ensure_dir, event_file_name
+
+# Event clips: every camera keeps a short pre-roll of its recent frames as downscaled
+# JPEG bytes (a few KB each, so the ring's memory is set by its byte budget, not by the
+# camera resolution). An event turns the pre-roll plus the next few seconds into a clip,
+# which one background thread decodes and writes as a video next to the snapshot.
+
+_STOP = object()
+
+
+class ClipWriter:
+    """
+    Writes finished clips on a background thread (shared by all cameras).
+    - submit() never blocks: when `max_queue` clips are already waiting the clip is dropped
+    - the file appears under its final name only once complete (written aside, then renamed)
+    """
+
+    def __init__(self, fourcc: str = "mp4v", max_queue: int = 4) -> None:
+        self.fourcc = fourcc
+        self.ext = ".avi" if fourcc.upper() == "MJPG" else ".mp4"
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread = threading.Thread(target=self._loop, name="clip-writer", daemon=True)
+        self.stats = {"written": 0, "dropped": 0, "failed": 0}
+
+    def start(self) -> "ClipWriter":
+        self._thread.start()
+        return self
+
+    def submit(self, path: str | Path, frames: list[tuple[float, bytes]], camera: str = "") -> bool:
+        try:
+            self._q.put_nowait((Path(path), frames, camera))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            metrics.inc("clips_dropped_total", camera=camera)
+            print(f"[Clips] Writer busy, clip {Path(path).name} dropped")
+            return False
+        return True
+
+    def write(self, path: Path, frames: list[tuple[float, bytes]]) -> None:
+        if not frames:
+            return
+        span = frames[-1][0] - frames[0][0]
+        fps = min(30.0, max(1.0, (len(frames) - 1) / span)) if span > 0 else 1.0
+        ensure_dir(path.parent)
+        # Same extension as the final name: OpenCV picks the container from it
+        tmp = path.with_name(f".tmp-{path.name}")
+        out, size = None, None
+        try:
+            for _, jpeg in frames:
+                img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if img is None:
+                    continue
+                if out is None:
+                    size = (img.shape[1], img.shape[0])
+                    out = cv2.VideoWriter(str(tmp), cv2.VideoWriter_fourcc(*self.fourcc), fps, size)
+                    if not out.isOpened():
+                        raise RuntimeError(f"no {self.fourcc} encoder for {path.suffix} in this OpenCV build")
+                elif (img.shape[1], img.shape[0]) != size:
+                    img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)  # camera reconnected at another size
+                out.write(img)
+        finally:
+            if out is not None:
+                out.release()
+        if tmp.exists():
+            os.replace(tmp, path)
+
+    def _loop(self) -> None:
+        while True:
+            item = self._q.get()
+            try:
+                if item is _STOP:
+                    return
+                path, frames, camera = item
+                try:
+                    with metrics.timer("stage_seconds", stage="clip_write", camera=camera):
+                        self.write(path, frames)
+                    self.stats["written"] += 1
+                    metrics.inc("clips_total", camera=camera)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    print(f"[Clips] Could not write {path.name}: {e}")
+            finally:
+                self._q.task_done()
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Write the clips already queued, then stop."""
+        if not self._thread.is_alive():
+            return
+        self._q.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+
+class ClipRecorder:
+    """
+    Pre-roll and clip recording of one camera; push() and trigger() run on its capture thread.
+    - push(frame) on every frame; at most `fps` frames per second are encoded (max_width, quality)
+    - the pre-roll keeps the last pre_sec seconds and never more than max_bytes
+    - trigger() starts a clip (pre-roll + post_sec seconds) and returns its path; events while
+      it records extend it, up to max_sec long and clip_max_bytes in size
+    """
+
+    def __init__(self, writer: ClipWriter, camera: str = "", pre_sec: float = 5.0, post_sec: float = 5.0,
+                 max_sec: float = 20.0, fps: float = 5.0, max_width: int = 640, quality: int = 70,
+                 max_bytes: int = 4 << 20, clip_max_bytes: int = 16 << 20) -> None:
+        self.writer = writer
+        self.camera = camera
+        self.pre_sec = float(pre_sec)
+        self.post_sec = float(post_sec)
+        self.max_sec = max(float(max_sec), self.pre_sec + self.post_sec)
+        self.interval = 1.0 / max(0.1, float(fps))
+        self.max_width = int(max_width)
+        self.quality = int(quality)
+        self.max_bytes = int(max_bytes)
+        self.clip_max_bytes = int(clip_max_bytes)
+        self._ring: deque[tuple[float, bytes]] = deque()
+        self._ring_bytes = 0
+        self._next = 0.0
+        self._clip: dict | None = None   # {path, frames, bytes, start, end}
+
+    def push(self, frame: np.ndarray) -> None:
+        now = time.monotonic()
+        clip = self._clip
+        if clip is not None and now >= clip["end"]:
+            self._finish()
+        if now < self._next:
+            return
+        self._next = now + self.interval
+
+        with metrics.timer("stage_seconds", stage="clip_encode", camera=self.camera):
+            jpeg = encode_jpeg(frame, self.max_width, self.quality)
+        if jpeg is None:
+            return
+        item = (now, jpeg)
+        self._ring.append(item)
+        self._ring_bytes += len(jpeg)
+        while self._ring and (now - self._ring[0][0] > self.pre_sec or self._ring_bytes > self.max_bytes):
+            self._ring_bytes -= len(self._ring.popleft()[1])
+
+        clip = self._clip
+        if clip is not None:
+            if clip["bytes"] + len(jpeg) > self.clip_max_bytes:
+                self._finish()
+            else:
+                clip["frames"].append(item)
+                clip["bytes"] += len(jpeg)
+
+    def trigger(self, events_dir: str | Path, label: str = "unknown") -> str:
+        """Path the clip of an event happening now will have (written once its post-roll is in)."""
+        now = time.monotonic()
+        clip = self._clip
+        if clip is not None:
+            clip["end"] = min(max(clip["end"], now + self.post_sec), clip["start"] + self.max_sec)
+            return str(clip["path"])
+        frames = list(self._ring)   # shares the JPEG bytes, nothing is copied
+        self._clip = {
+            "path": Path(events_dir) / event_file_name(label, self.writer.ext),
+            "frames": frames,
+            "bytes": self._ring_bytes,
+            "start": frames[0][0] if frames else now,
+            "end": now + self.post_sec,
+        }
+        return str(self._clip["path"])
+
+    def _finish(self) -> None:
+        clip, self._clip = self._clip, None
+        if clip is not None:
+            self.writer.submit(clip["path"], clip["frames"], camera=self.camera)
+
+    def flush(self) -> None:
+        """Hand over the clip being recorded as is (camera stopping)."""
+        self._finish()
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .embed_cache import EmbeddingCache
+from .event_embeddings import open_event_embeddings
+from .event_store import open_event_store
+from .users import DATA
+
+# Online clustering of UNKNOWN faces, so a stranger who keeps coming back is one
+# cluster instead of a stream of unrelated alerts:
+#   data/clusters/clusters.npy    float32 (max_clusters, 512) centroids, fixed size
+#   data/clusters/clusters.json   {"model_tag", "next_id", "clusters": [{id, row, count, ...}]}
+#   data/clusters/promoted.json   {cluster id: {"user_id", "ts"}}, written by the API
+# Leader clustering: a face joins the most similar centroid if it is at least join_sim
+# close, otherwise it starts a new cluster. Memory is bounded by max_clusters; past that
+# the cluster seen longest ago is forgotten. The worker owns clusters.*, the API owns
+# promoted.json; the worker drops promoted clusters on its next save.
+
+CLUSTERS_DIR = DATA / "clusters"
+MANIFEST = "clusters.json"
+CENTROIDS = "clusters.npy"
+PROMOTED = "promoted.json"
+EMB_DIM = 512
+
+
+def _write_json(path: Path, data) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def read_clusters(clusters_dir: str | Path = CLUSTERS_DIR) -> dict | None:
+    try:
+        return json.loads((Path(clusters_dir) / MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def read_promoted(clusters_dir: str | Path = CLUSTERS_DIR) -> dict[int, dict]:
+    try:
+        return {int(k): v for k, v in json.loads((Path(clusters_dir) / PROMOTED).read_text()).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+class UnknownClusters:
+    """
+    Shared by every camera pipeline of a worker.
+    - assign(embedding) -> cluster id (joins, or starts, a cluster)
+    - claim(cluster id) -> True if the cluster may alert now (and starts its cooldown)
+    - save() persists centroids and stats for the API
+    """
+
+    def __init__(self, clusters_dir: str | Path = CLUSTERS_DIR, join_sim: float = 0.5, max_clusters: int = 500,
+                 cooldown_sec: float = 600.0, max_weight: int = 50, model_tag: str | None = None) -> None:
+        self.dir = Path(clusters_dir)
+        self.join_sim = float(join_sim)
+        self.max_clusters = max(1, int(max_clusters))
+        self.cooldown = float(cooldown_sec)
+        self.max_weight = max(1, int(max_weight))   # later faces still move a well-known centroid a little
+        self.model_tag = model_tag
+        self._lock = threading.Lock()
+        self._centroids = np.zeros((self.max_clusters, EMB_DIM), dtype=np.float32)
+        self._used = np.zeros(self.max_clusters, dtype=bool)
+        self._row_id = np.zeros(self.max_clusters, dtype=np.int64)   # centroid row -> cluster id
+        self._info: dict[int, dict] = {}   # cluster id -> {row, count, first_seen, last_seen, last_alert}
+        self._next_id = 1
+        self._dirty = False
+        self.stats = {"assigned": 0, "created": 0, "evicted": 0, "suppressed": 0}
+        self._load()
+
+    def _load(self) -> None:
+        manifest = read_clusters(self.dir)
+        if manifest is None:
+            return
+        self._next_id = int(manifest.get("next_id", 1))
+        if self.model_tag and manifest.get("model_tag") != self.model_tag:
+            # Centroids of another face engine profile don't compare with ours
+            print(f"[Clusters] Starting over: clusters were made with {manifest.get('model_tag')}")
+            return
+        try:
+            centroids = np.load(self.dir / CENTROIDS)
+        except (OSError, ValueError) as e:
+            print(f"[Clusters] Ignoring unreadable {self.dir / CENTROIDS}: {e}")
+            return
+        for c in manifest.get("clusters", []):
+            row = int(c["row"])
+            if row >= self.max_clusters or row >= centroids.shape[0]:
+                continue
+            self._centroids[row] = centroids[row]
+            self._used[row] = True
+            self._row_id[row] = int(c["id"])
+            self._info[int(c["id"])] = {k: c.get(k) for k in ("row", "count", "first_seen", "last_seen", "last_alert")}
+
+    def assign(self, embedding: np.ndarray, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        e = np.asarray(embedding, dtype=np.float32).reshape(EMB_DIM)
+        e = e / (np.linalg.norm(e) + 1e-12)
+        with self._lock:
+            self._dirty = True
+            self.stats["assigned"] += 1
+            if self._info:
+                sims = self._centroids @ e
+                sims[~self._used] = -np.inf
+                row = int(np.argmax(sims))
+                if sims[row] >= self.join_sim:
+                    cid = int(self._row_id[row])
+                    c = self._info[cid]
+                    w = min(c["count"], self.max_weight)
+                    m = self._centroids[row] * w + e
+                    self._centroids[row] = m / (np.linalg.norm(m) + 1e-12)
+                    c["count"] += 1
+                    c["last_seen"] = now
+                    return cid
+            # A new stranger: take a free row, or the one of the cluster seen longest ago
+            free = np.flatnonzero(~self._used)
+            if free.size:
+                row = int(free[0])
+            else:
+                old = min(self._info, key=lambda i: self._info[i]["last_seen"])
+                row = self._info.pop(old)["row"]
+                self.stats["evicted"] += 1
+            cid = self._next_id
+            self._next_id += 1
+            self._centroids[row] = e
+            self._used[row] = True
+            self._row_id[row] = cid
+            self._info[cid] = {"row": row, "count": 1, "first_seen": now, "last_seen": now, "last_alert": None}
+            self.stats["created"] += 1
+            return cid
+
+    def claim(self, cid: int, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        with self._lock:
+            c = self._info.get(cid)
+            if c is None:
+                return True
+            if c["last_alert"] is not None and now - c["last_alert"] < self.cooldown:
+                self.stats["suppressed"] += 1
+                return False
+            c["last_alert"] = now
+            self._dirty = True
+            return True
+
+    def save(self, force: bool = False) -> bool:
+        """Write centroids + stats if anything changed; drops clusters the API promoted to users."""
+        promoted = read_promoted(self.dir)
+        with self._lock:
+            for cid in promoted:
+                c = self._info.pop(cid, None)
+                if c is not None:
+                    self._used[c["row"]] = False
+                    self._dirty = True
+            if not (self._dirty or force):
+                return False
+            centroids = self._centroids.copy()
+            clusters = [{"id": cid, **c} for cid, c in sorted(self._info.items())]
+            manifest = {"model_tag": self.model_tag, "next_id": self._next_id, "clusters": clusters,
+                        "join_sim": self.join_sim, "ts": time.time()}
+            self._dirty = False
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.dir / f".{CENTROIDS}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, centroids)
+        os.replace(tmp, self.dir / CENTROIDS)
+        _write_json(self.dir / MANIFEST, manifest)   # after the centroids it points into
+        return True
+
+    def __len__(self) -> int:
+        return len(self._info)
+
+
+def _crop(img: np.ndarray, bbox, pad: float = 0.5) -> np.ndarray:
+    """Face box grown by `pad` per side, clipped to the image."""
+    x, y, w, h = (int(v) for v in bbox)
+    H, W = img.shape[:2]
+    x0, y0 = max(0, int(x - pad * w)), max(0, int(y - pad * h))
+    x1, y1 = min(W, int(x + w + pad * w)), min(H, int(y + h + pad * h))
+    return img[y0:y1, x0:x1] if x1 > x0 and y1 > y0 else img
+
+
+def promote_cluster(cluster_id: int, user_id: str, enroll_dir: Path, csv_path: str | Path, signature: str,
+                    max_photos: int = 10, clusters_dir: str | Path = CLUSTERS_DIR) -> list[str]:
+    """
+    Enroll a cluster's faces as photos of `user_id` without running the recognizer: each of
+    the newest `max_photos` events of the cluster is cropped from its snapshot into the user's
+    folder, and the embedding stored with the event goes into the folder's embedding cache
+    under that photo (same mtime and size, so it counts as up to date). Returns the photo names.
+    """
+    store = open_event_store(csv_path)
+    embeddings = open_event_embeddings(csv_path)
+    cache = EmbeddingCache(enroll_dir, signature)
+    enroll_dir.mkdir(parents=True, exist_ok=True)
+    saved = []
+    for e in store.page(limit=max(1, int(max_photos)) * 3, cluster_id=cluster_id):
+        if len(saved) >= max_photos:
+            break
+        if not e.get("emb_count") or e.get("bbox_w") is None:
+            continue
+        emb = embeddings.of_event(e["id"])[:1]   # the event's best face, the one its bbox is of
+        img = cv2.imread(e["image_path"]) if e.get("image_path") else None
+        if img is None or not len(emb):
+            continue
+        path = enroll_dir / f"cluster{cluster_id}_event{e['id']}.jpg"
+        if not cv2.imwrite(str(path), _crop(img, (e["bbox_x"], e["bbox_y"], e["bbox_w"], e["bbox_h"]))):
+            continue
+        cache.put(path, emb[0])
+        saved.append(path.name)
+    if saved:
+        cache.save()
+        promoted = read_promoted(clusters_dir)
+        promoted[int(cluster_id)] = {"user_id": user_id, "ts": time.time(), "photos": len(saved)}
+        Path(clusters_dir).mkdir(parents=True, exist_ok=True)
+        _write_json(Path(clusters_dir) / PROMOTED, {str(k): v for k, v in promoted.items()})
+    return saved
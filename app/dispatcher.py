@@ -0,0 +1,232 @@
+from __future__ import annotations
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from .metrics import metrics
+from .notifier import send_telegram_photo
+from .storage import save_snapshot, log_event_csv, ensure_dir
+from .event_embeddings import open_event_embeddings
+
+# An event is a plain dict that flows through the sinks in order; each sink reads
+# what it needs and may add fields for the next one:
+#   {"frame", "events_dir", "label", "csv_path", "mirror_csv", "row": {...}, "caption"}
+#   SnapshotSink adds "image_path", EventLogSink adds "event_id".
+# An optional "embeddings" array (one row per face) is attached to the logged event by EventLogSink.
+
+_STOP = object()
+
+
+class Sink:
+    """One step of event handling. Failures are retried with exponential backoff."""
+
+    name = "sink"
+    retries = 2
+    backoff = 0.5
+
+    def handle(self, event: dict) -> None:
+        raise NotImplementedError
+
+    def give_up(self, event: dict, err: Exception) -> None:
+        print(f"[Events] {self.name} failed after {self.retries + 1} attempts: {err}")
+
+    def close(self) -> None:
+        pass
+
+
+class SnapshotSink(Sink):
+    name = "snapshot"
+
+    def handle(self, event: dict) -> None:
+        event["image_path"] = save_snapshot(event["frame"], event["events_dir"], label=event.get("label", "unknown"))
+        event["row"]["image_path"] = event["image_path"]
+
+    def give_up(self, event: dict, err: Exception) -> None:
+        super().give_up(event, err)
+        event["image_path"] = ""
+
+
+class EventLogSink(Sink):
+    name = "event-log"
+
+    def handle(self, event: dict) -> None:
+        # Each step once per event, also when a later one fails and the sink is retried
+        if "event_id" not in event:
+            event["event_id"] = log_event_csv(event["csv_path"], event["row"], mirror_csv=event.get("mirror_csv", False))
+        if event.get("embeddings") is not None and not event.get("emb_attached"):
+            # After the insert: rows only ever exist for events in the index (see EventEmbeddings)
+            open_event_embeddings(event["csv_path"]).attach(event["event_id"], event["embeddings"])
+            event["emb_attached"] = True
+
+
+class TelegramSink(Sink):
+    """
+    Sends the snapshot to Telegram over a pooled session. When Telegram stays
+    unreachable the message is spilled to an outbox directory and re-sent later.
+    Until the outbox is empty again, new messages go straight to it: the network is
+    not tried (so snapshots and the event log behind us never wait on it) and alerts
+    keep their order.
+    """
+
+    name = "telegram"
+
+    def __init__(self, bot_token: str | None, chat_id: str | None, outbox_dir: str | Path,
+                 retries: int = 2, backoff: float = 2.0, flush_every: float = 60.0) -> None:
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.outbox = ensure_dir(outbox_dir)
+        self.flush_every = float(flush_every)
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._offline = threading.Event()   # set while the outbox holds messages
+        if any(self.outbox.glob("*.json")):
+            self._offline.set()
+        self._thread = threading.Thread(target=self._flush_loop, name="telegram-outbox", daemon=True)
+        self._thread.start()
+
+    def handle(self, event: dict) -> None:
+        if not event.get("image_path") or not event.get("caption"):
+            return
+        if self._offline.is_set():
+            self.spill(event["image_path"], event["caption"])
+            return
+        send_telegram_photo(self.bot_token, self.chat_id, event["image_path"], event["caption"])
+        print("[NOTIFY][TG] Sent photo+caption")
+
+    def give_up(self, event: dict, err: Exception) -> None:
+        print(f"[NOTIFY][TG] Unreachable ({err}); queued in outbox")
+        self.spill(event["image_path"], event["caption"])
+
+    def spill(self, image_path: str, caption: str) -> None:
+        name = f"{time.time():.6f}_{uuid.uuid4().hex[:6]}.json"
+        tmp = self.outbox / f".{name}.tmp"
+        tmp.write_text(json.dumps({"image_path": image_path, "caption": caption, "queued_at": time.time()}))
+        os.replace(tmp, self.outbox / name)
+        self._offline.set()
+
+    def flush_outbox(self) -> int:
+        """Re-send queued messages oldest first; stops at the first failure. Returns how many were sent."""
+        sent = 0
+        with self._flush_lock:
+            for p in sorted(self.outbox.glob("*.json")):
+                try:
+                    msg = json.loads(p.read_text())
+                except (OSError, ValueError):
+                    p.unlink(missing_ok=True)
+                    continue
+                if not Path(msg.get("image_path", "")).exists():
+                    # Snapshot is gone (e.g. retention); nothing left to send
+                    p.unlink(missing_ok=True)
+                    continue
+                try:
+                    send_telegram_photo(self.bot_token, self.chat_id, msg["image_path"], msg["caption"])
+                except Exception:
+                    break
+                p.unlink(missing_ok=True)
+                sent += 1
+            else:
+                # Everything that was queued went out; try the network again for new messages,
+                # unless more were spilled meanwhile
+                if not any(self.outbox.glob("*.json")):
+                    self._offline.clear()
+        if sent:
+            print(f"[NOTIFY][TG] Sent {sent} queued message(s) from outbox")
+        return sent
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_every):
+            if any(self.outbox.glob("*.json")):
+                self.flush_outbox()
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+class EventDispatcher:
+    """
+    Runs events through their sinks on background threads so the frame loop never
+    blocks on disk or network I/O.
+    - submit() never blocks: when the bounded queue is full the event is dropped and counted
+    - each sink retries with exponential backoff on its own
+    - close() drains what is already queued before stopping
+    """
+
+    def __init__(self, sinks: list[Sink], max_queue: int = 64, workers: int = 1) -> None:
+        self.sinks = sinks
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"event-dispatch-{i}", daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+        self.stats = {"submitted": 0, "dropped": 0, "done": 0}
+        metrics.gauge_fn("event_queue_depth", self.qsize)
+
+    def start(self) -> "EventDispatcher":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def submit(self, event: dict) -> bool:
+        try:
+            self._q.put_nowait(event)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            metrics.inc("events_dropped_total")
+            print("[Events] Dispatcher queue full, event dropped")
+            return False
+        self.stats["submitted"] += 1
+        metrics.inc("events_total")
+        return True
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def _run_sink(self, sink: Sink, event: dict) -> None:
+        delay = sink.backoff
+        for attempt in range(sink.retries + 1):
+            try:
+                with metrics.timer("stage_seconds", stage=sink.name):
+                    sink.handle(event)
+                return
+            except Exception as e:
+                metrics.inc("sink_errors_total", sink=sink.name)
+                if attempt == sink.retries:
+                    sink.give_up(event, e)
+                    return
+                time.sleep(delay)
+                delay *= 2
+
+    def _loop(self) -> None:
+        while True:
+            event = self._q.get()
+            try:
+                if event is _STOP:
+                    return
+                for sink in self.sinks:
+                    self._run_sink(sink, event)
+                self.stats["done"] += 1
+            finally:
+                self._q.task_done()
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Finish queued events, then stop the workers and sinks."""
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            # The stop markers queue up behind pending events, waiting for room until the deadline
+            try:
+                self._q.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+        left = self._q.qsize()
+        if left:
+            print(f"[Events] Dispatcher stopped with {left} event(s) undelivered")
+        for sink in self.sinks:
+            sink.close()
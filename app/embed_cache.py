@@ -0,0 +1,157 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+CACHE_NAME = ".embeddings.npz"
+IMAGE_EXTS = ("*.jpg", "*.jpeg", "*.png", "*.JPG", "*.PNG")
+EMB_DIM = 512
+
+
+def list_images(dir_path: Path) -> list[Path]:
+    paths = []
+    for ext in IMAGE_EXTS:
+        paths.extend(dir_path.glob(ext))
+    return sorted(set(paths))
+
+
+class EmbeddingCache:
+    """
+    Per-directory store of enrollment embeddings, saved next to the photos.
+    - Entries are keyed by file name and validated by (mtime_ns, size), so a refresh
+      only embeds new or changed photos and forgets deleted ones.
+    - Photos without a usable face are remembered too, so they are not re-detected.
+    - `signature` ties the cache to the model/detector settings that produced it;
+      a mismatch throws the whole cache away. signature=None accepts any cache
+      (used when no engine is loaded and nothing can be re-embedded anyway).
+    """
+
+    def __init__(self, dir_path: str | Path, signature: str | None) -> None:
+        self.dir = Path(dir_path)
+        self.path = self.dir / CACHE_NAME
+        self.signature = signature
+        # name -> {"mtime_ns", "size", "embedding" (or None when no face was found)}
+        self.entries: dict[str, dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as z:
+                cached_sig = str(z["signature"])
+                if self.signature is None:
+                    self.signature = cached_sig
+                elif cached_sig != self.signature:
+                    print(f"[Face] Embedding cache {self.path} is for another model, rebuilding")
+                    return
+                names = z["names"]
+                mtimes = z["mtime_ns"]
+                sizes = z["sizes"]
+                has_face = z["has_face"]
+                embs = z["embeddings"]
+        except Exception as e:
+            print(f"[Face] Ignoring unreadable embedding cache {self.path}: {e}")
+            return
+        for i, name in enumerate(names):
+            self.entries[str(name)] = {
+                "mtime_ns": int(mtimes[i]),
+                "size": int(sizes[i]),
+                "embedding": embs[i] if has_face[i] else None,
+            }
+
+    def save(self) -> None:
+        if self.signature is None:
+            return
+        names = sorted(self.entries)
+        embs = np.zeros((len(names), EMB_DIM), dtype=np.float32)
+        has_face = np.zeros(len(names), dtype=bool)
+        for i, n in enumerate(names):
+            e = self.entries[n]["embedding"]
+            if e is not None:
+                embs[i] = e
+                has_face[i] = True
+
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{CACHE_NAME}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                signature=np.array(self.signature),
+                names=np.array(names, dtype=str),
+                mtime_ns=np.array([self.entries[n]["mtime_ns"] for n in names], dtype=np.int64),
+                sizes=np.array([self.entries[n]["size"] for n in names], dtype=np.int64),
+                has_face=has_face,
+                embeddings=embs,
+            )
+        # Readers (API and worker) never see a half-written cache
+        os.replace(tmp, self.path)
+
+    def is_fresh(self, path: Path, st: os.stat_result | None = None) -> bool:
+        e = self.entries.get(path.name)
+        if e is None:
+            return False
+        st = st or path.stat()
+        return e["mtime_ns"] == st.st_mtime_ns and e["size"] == st.st_size
+
+    def put(self, path: Path, embedding: np.ndarray | None, st: os.stat_result | None = None) -> None:
+        st = st or path.stat()
+        self.entries[path.name] = {
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "embedding": None if embedding is None else np.asarray(embedding, dtype=np.float32),
+        }
+
+    def refresh(self, engine, min_face_size: int = 80, chunk: int = 16) -> bool:
+        """
+        Sync the cache with the directory. Returns True if anything changed.
+        With engine=None, stale photos are skipped (kept out of the gallery) instead of embedded.
+        """
+        current = {}
+        for p in list_images(self.dir):
+            try:
+                current[p.name] = (p, p.stat())
+            except FileNotFoundError:
+                continue
+
+        changed = False
+        for name in list(self.entries):
+            if name not in current:
+                del self.entries[name]
+                changed = True
+
+        stale = [(p, st) for p, st in current.values() if not self.is_fresh(p, st)]
+        if stale and engine is None:
+            print(f"[Face] {len(stale)} photo(s) in {self.dir} need embedding but no face engine is loaded")
+            stale = []
+
+        # Detect per photo, then embed the best face of each photo in one batched call per chunk
+        for i in range(0, len(stale), chunk):
+            imgs, bests, owners = [], [], []
+            for p, st in stale[i:i + chunk]:
+                img = cv2.imread(str(p))
+                items = engine.detect(img, min_face_size=min_face_size) if img is not None else []
+                if not items:
+                    self.put(p, None, st)
+                    continue
+                imgs.append(img)
+                bests.append([max(items, key=lambda d: d["score"])])
+                owners.append((p, st))
+            engine.embed(imgs, bests)
+            for (p, st), b in zip(owners, bests):
+                self.put(p, b[0].get("embedding"), st)
+            changed = True
+
+        if changed:
+            self.save()
+        return changed
+
+    def gallery(self) -> np.ndarray:
+        embs = [self.entries[n]["embedding"] for n in sorted(self.entries)]
+        embs = [e for e in embs if e is not None]
+        if not embs:
+            return np.zeros((0, EMB_DIM), dtype=np.float32)
+        g = np.stack(embs, axis=0).astype(np.float32)
+        return g / (np.linalg.norm(g, axis=1, keepdims=True) + 1e-12)
@@ -8,6 +8,18 @@ from .face import FaceEngine
 _engine: Optional[FaceEngine] = None
 _lock = threading.Lock()
 
+# Named engine profiles (FACE_PROFILE), from most accurate to lightest. API and worker
+# must run the same one: embeddings of different packs / INT8 copies don't compare.
+# `python -m app.calibrate` measures them on the enrolled photos.
+PROFILES = {
+    "accurate": {"model": "buffalo_l", "det_size": (640, 640), "quantize": False},
+    "balanced": {"model": "buffalo_l", "det_size": (320, 320), "quantize": False},
+    "light": {"model": "buffalo_s", "det_size": (320, 320), "quantize": False},
+    "light-int8": {"model": "buffalo_s", "det_size": (320, 320), "quantize": True},
+    "tiny-int8": {"model": "buffalo_sc", "det_size": (256, 256), "quantize": True},
+}
+DEFAULT_PROFILE = "balanced"
+
 def _env_tuple(name: str, default: Tuple[int, int]) -> Tuple[int, int]:
     raw = os.getenv(name, "")
     if raw:
@@ -18,6 +30,38 @@ def _env_tuple(name: str, default: Tuple[int, int]) -> Tuple[int, int]:
             pass
     return default
 
+def _env_int(name: str) -> Optional[int]:
+    raw = os.getenv(name, "")
+    return int(raw) if raw.strip() else None
+
+def engine_kwargs(profile: Optional[str] = None) -> dict:
+    """
+    FaceEngine settings from the environment (shared by the API, the worker and pool processes).
+    The profile (FACE_PROFILE) picks model, detector size and quantization; INSIGHTFACE_MODEL,
+    INSIGHTFACE_DET_SIZE and ONNX_QUANTIZE override it. An explicit `profile` argument is
+    taken as is (used by the calibration run to compare profiles).
+    """
+    explicit = profile is not None
+    name = profile or os.getenv("FACE_PROFILE", DEFAULT_PROFILE)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown face profile {name!r} (one of {', '.join(PROFILES)})")
+    prof = PROFILES[name]
+    quantize = os.getenv("ONNX_QUANTIZE", "")
+    return {
+        "providers": [p.strip() for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()],
+        "det_size": prof["det_size"] if explicit else _env_tuple("INSIGHTFACE_DET_SIZE", prof["det_size"]),
+        "min_det_score": float(os.getenv("MIN_DET_SCORE", "0.60")),
+        "model": prof["model"] if explicit else (os.getenv("INSIGHTFACE_MODEL") or prof["model"]),
+        "quantize": prof["quantize"] if explicit or not quantize else quantize.lower() in ("1", "true", "yes"),
+        "intra_op_threads": _env_int("ONNX_INTRA_OP_THREADS"),
+        "inter_op_threads": _env_int("ONNX_INTER_OP_THREADS"),
+        "graph_opt": os.getenv("ONNX_GRAPH_OPT", "all"),
+        "model_cache_dir": os.getenv("ONNX_MODEL_CACHE") or None,
+    }
+
+def engine_loaded() -> bool:
+    return _engine is not None
+
 def get_face_engine() -> FaceEngine:
     global _engine
     if _engine is not None:
@@ -25,15 +69,8 @@ def get_face_engine() -> FaceEngine:
 
     with _lock:
         if _engine is None:
-            model_name = os.getenv("INSIGHTFACE_MODEL", "buffalo_l")
-            providers = [p.strip() for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
-            det_size = _env_tuple("INSIGHTFACE_DET_SIZE", (320, 320))
-            min_det_score = float(os.getenv("MIN_DET_SCORE", "0.60"))
-
-            # Construct the engine
-            _engine = FaceEngine(
-                providers=providers,
-                det_size=det_size,
-                min_det_score=min_det_score,
-            )
+            kw = engine_kwargs()
+            print(f"[Face] Loading {kw['model']}{' (INT8)' if kw['quantize'] else ''} "
+                  f"det_size={kw['det_size'][0]}x{kw['det_size'][1]} on {','.join(kw['providers'])}")
+            _engine = FaceEngine(**kw)
     return _engine
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .event_store import open_event_store
+
+# Face embeddings of logged events, for "find this person" searches:
+#   data/events/events.emb        append-only float16 matrix, (rows, 512), no header
+#   data/events/events.emb.lock   flock: exclusive to append / compact, shared to read
+# An event points at its rows with emb_row / emb_count in the event index (events.db), so
+# the index stays the source of truth: time filters are SQL, and events deleted by
+# retention simply stop being referenced. Rows are appended and pointed at under the
+# exclusive lock, after the event is in the index, so every row the index doesn't
+# reference is garbage. compact() (run by retention) rewrites the file with the live rows
+# only and moves the pointers in the same lock. Readers memory-map the file and look up
+# rows under the shared lock; a mapping keeps the file it was made of, so they can
+# compute on it after the lock is released.
+
+EMB_NAME = "events.emb"
+EMB_DIM = 512
+ROW_BYTES = EMB_DIM * 2
+_CHUNK = 8192   # rows converted to float32 per matrix product
+
+
+def _face_rows(first: np.ndarray, count: np.ndarray) -> np.ndarray:
+    """Every row number of events given as (first row, row count) runs, in order."""
+    return np.repeat(first, count) + np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+
+
+class EventEmbeddings:
+    """
+    Append-only embedding matrix next to an event store.
+    - attach(event_id, embs) -> (first row, count); safe across threads and processes
+    - of_event(event_id) -> the event's rows, best face first
+    - search(query, ...) -> most similar events
+    - compact() drops the rows of deleted events
+    """
+
+    def __init__(self, path: str | Path, csv_path: str | Path | None = None) -> None:
+        self.path = Path(path)
+        # The event store is found by the CSV path it was opened with (events.csv -> events.db)
+        self.csv_path = Path(csv_path) if csv_path is not None else self.path.with_name("events.csv")
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._lock = threading.Lock()
+        self._map: np.ndarray | None = None
+        self._stamp: tuple[int, int] | None = None   # (inode, size) the map was made of
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        # A fresh open file per call: flock then also excludes threads of this process
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _store(self):
+        return open_event_store(self.csv_path)
+
+    def attach(self, event_id: int, embs) -> tuple[int, int]:
+        """Append an event's face embeddings (best face first) and point the event at them."""
+        embs = np.asarray(embs, dtype=np.float32).reshape(-1, EMB_DIM)
+        embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12)
+        data = embs.astype("<f2").tobytes()
+        with self._locked(exclusive=True):
+            with open(self.path, "ab") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size % ROW_BYTES:
+                    # Torn row from a crash mid-write: nothing references it, drop it
+                    size -= size % ROW_BYTES
+                    f.truncate(size)
+                f.write(data)
+                f.flush()
+            first, count = size // ROW_BYTES, int(embs.shape[0])
+            self._store().set_embeddings(event_id, first, count)
+        return first, count
+
+    def rows(self) -> int:
+        try:
+            return os.path.getsize(self.path) // ROW_BYTES
+        except FileNotFoundError:
+            return 0
+
+    def matrix(self) -> np.ndarray:
+        """Read-only (rows, EMB_DIM) float16 view of the file; re-mapped when it has grown or was compacted."""
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_ino, st.st_size // ROW_BYTES)
+        except FileNotFoundError:
+            stamp = (0, 0)
+        with self._lock:
+            if self._map is None or self._stamp != stamp:
+                n = stamp[1]
+                self._map = (np.memmap(self.path, dtype="<f2", mode="r", shape=(n, EMB_DIM))
+                             if n else np.zeros((0, EMB_DIM), dtype="<f2"))
+                self._stamp = stamp
+            return self._map
+
+    def of_event(self, event_id: int) -> np.ndarray:
+        """(faces, EMB_DIM) float32 embeddings stored with an event, best face first; empty if none."""
+        with self._locked(exclusive=False):
+            e = self._store().get(event_id)
+            if e is None or not e.get("emb_count"):
+                return np.zeros((0, EMB_DIM), dtype=np.float32)
+            m = self.matrix()
+        return np.asarray(m[e["emb_row"]:e["emb_row"] + e["emb_count"]], dtype=np.float32)
+
+    def similarity(self, query: np.ndarray, rows: np.ndarray, m: np.ndarray | None = None) -> np.ndarray:
+        """Cosine similarity of `query` to each of `rows` (runs of consecutive rows are read as slices)."""
+        q = np.asarray(query, dtype=np.float32).reshape(EMB_DIM)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        m = self.matrix() if m is None else m
+        out = np.empty(rows.shape[0], dtype=np.float32)
+        for i in range(0, rows.shape[0], _CHUNK):
+            r = rows[i:i + _CHUNK]
+            if r.size and np.all(np.diff(r) == 1):
+                block = m[r[0]:r[-1] + 1]   # contiguous run: a slice, no gather
+            else:
+                block = m[r]
+            out[i:i + r.size] = block.astype(np.float32) @ q
+        return out
+
+    def search(self, query: np.ndarray, limit: int = 20, min_similarity: float = 0.0,
+               exclude_id: int | None = None, **filters) -> list[tuple[int, float]]:
+        """
+        Events most similar to `query`, best first: [(event_id, similarity)]. An event with
+        several faces counts with its best one. `filters` go to EventStore.embedded_rows.
+        """
+        with self._locked(exclusive=False):
+            ids, first, count = self._store().embedded_rows(**filters)
+            m = self.matrix()   # the file those rows point into
+        if exclude_id is not None:
+            keep = ids != exclude_id
+            ids, first, count = ids[keep], first[keep], count[keep]
+        if not ids.size:
+            return []
+        # One row number per face, and which event it belongs to
+        owner = np.repeat(np.arange(ids.size), count)
+        rows = _face_rows(first, count)
+        valid = rows < m.shape[0]
+        sims = np.full(ids.size, -np.inf, dtype=np.float32)
+        np.maximum.at(sims, owner[valid], self.similarity(query, rows[valid], m))
+        order = np.argsort(-sims)
+        out = []
+        for i in order[:max(0, int(limit))]:
+            if sims[i] < min_similarity:
+                break
+            out.append((int(ids[i]), float(sims[i])))
+        return out
+
+    def compact(self, min_dead_fraction: float = 0.25) -> int:
+        """
+        Rewrite the file with only the rows events still reference, once at least
+        `min_dead_fraction` of it is garbage. The new pointers are committed in one
+        transaction together with the swap of the file. Returns the rows dropped.
+        """
+        with self._locked(exclusive=True):
+            total = self.rows()
+            store = self._store()
+            ids, first, count = store.embedded_rows()
+            live = int(count.sum()) if count.size else 0
+            dead = total - live
+            if dead <= 0 or dead < min_dead_fraction * total:
+                return 0
+            m = self.matrix()
+            new_first = np.cumsum(count) - count
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            try:
+                with open(tmp, "wb") as f:
+                    for i in range(0, ids.size, _CHUNK):
+                        # Events are in id order, so their rows mostly come in long runs
+                        f.write(np.ascontiguousarray(m[_face_rows(first[i:i + _CHUNK], count[i:i + _CHUNK])]).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                store.move_embeddings(ids, new_first, swap=lambda: os.replace(tmp, self.path))
+            finally:
+                tmp.unlink(missing_ok=True)
+        return dead
+
+
+_logs: dict[Path, EventEmbeddings] = {}
+_logs_lock = threading.Lock()
+
+
+def open_event_embeddings(csv_path: str | Path) -> EventEmbeddings:
+    """Shared EventEmbeddings living next to `csv_path` (events.csv -> events.emb)."""
+    path = Path(csv_path).with_name(EMB_NAME).resolve()
+    with _logs_lock:
+        log = _logs.get(path)
+        if log is None:
+            log = _logs[path] = EventEmbeddings(path, csv_path)
+    return log
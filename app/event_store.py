@@ -0,0 +1,444 @@
+from __future__ import annotations
+import argparse
+import csv
+import sqlite3
+import threading
+from pathlib import Path
+
+import numpy as np
+
+DB_NAME = "events.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts          TEXT NOT NULL,
+    camera      TEXT NOT NULL DEFAULT '',
+    label       TEXT NOT NULL DEFAULT '',
+    distance    REAL,
+    bbox_x      INTEGER,
+    bbox_y      INTEGER,
+    bbox_w      INTEGER,
+    bbox_h      INTEGER,
+    image_path  TEXT NOT NULL DEFAULT '',
+    clip_path   TEXT NOT NULL DEFAULT '',
+    bytes       INTEGER,
+    compacted   INTEGER NOT NULL DEFAULT 0,
+    emb_row     INTEGER,
+    emb_count   INTEGER NOT NULL DEFAULT 0,
+    cluster_id  INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_label_id ON events (label, id);
+CREATE INDEX IF NOT EXISTS events_camera_id ON events (camera, id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# compacted: the snapshot was rewritten smaller, or checked and left as it was
+REENCODED = 1
+KEPT = 2
+
+COLUMNS = ("id", "ts", "camera", "label", "distance", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "image_path", "clip_path")
+
+# Columns added after the first release: (name, definition) for ALTER TABLE on older databases
+ADDED_COLUMNS = (
+    ("clip_path", "TEXT NOT NULL DEFAULT ''"),
+    ("bytes", "INTEGER"),                       # snapshot + clip on disk; NULL = not measured yet
+    ("compacted", "INTEGER NOT NULL DEFAULT 0"),  # retention re-encode: 0 to do, REENCODED, or KEPT
+    ("emb_row", "INTEGER"),                     # first face embedding in events.emb (app/event_embeddings.py)
+    ("emb_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("cluster_id", "INTEGER"),                  # unknown-face cluster (app/clusters.py)
+)
+# Indexes on added columns (created once the columns exist)
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS events_clip ON events (clip_path) WHERE clip_path != '';
+CREATE INDEX IF NOT EXISTS events_label_bytes ON events (label, bytes);
+CREATE INDEX IF NOT EXISTS events_unmeasured ON events (id) WHERE bytes IS NULL;
+CREATE INDEX IF NOT EXISTS events_uncompacted ON events (id) WHERE compacted = 0;
+CREATE INDEX IF NOT EXISTS events_cluster_id ON events (cluster_id, id) WHERE cluster_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS events_embedded ON events (id, ts, emb_row, emb_count, label, camera) WHERE emb_count > 0;
+"""
+
+
+def _num(v, cast):
+    if v is None or v == "":
+        return None
+    try:
+        return cast(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class EventStore:
+    """
+    SQLite event index (WAL mode, so the API reads while the worker writes).
+    - Events are appended with increasing ids; ids double as page cursors.
+    - page() walks an index newest-first, so its cost follows the page size,
+      not the number of stored events.
+    """
+
+    def __init__(self, db_path: str | Path) -> None:
+        self.path = Path(db_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        # Only takes effect on a new database (see compact() for older ones)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection) -> None:
+        have = {r["name"] for r in conn.execute("PRAGMA table_info(events)")}
+        for name, decl in ADDED_COLUMNS:
+            if name in have:
+                continue
+            try:
+                with conn:
+                    conn.execute(f"ALTER TABLE events ADD COLUMN {name} {decl}")
+            except sqlite3.OperationalError as e:
+                # The other process (API / worker) added it first
+                if "duplicate column" not in str(e):
+                    raise
+        conn.executescript(ADDED_INDEXES)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, row: dict) -> int:
+        """
+        Append one event ({timestamp, camera, label, distance, bbox, image_path, clip_path,
+        emb_row, emb_count, cluster_id}); returns its id.
+        """
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO events (ts, camera, label, distance, bbox_x, bbox_y, bbox_w, bbox_h, image_path, clip_path,"
+                " emb_row, emb_count, cluster_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._values(row),
+            )
+        return int(cur.lastrowid)
+
+    @staticmethod
+    def _values(row: dict) -> tuple:
+        bbox = row.get("bbox") or (row.get("bbox_x"), row.get("bbox_y"), row.get("bbox_w"), row.get("bbox_h"))
+        return (
+            str(row.get("timestamp", "")),
+            str(row.get("camera", "") or ""),
+            str(row.get("label", "") or ""),
+            _num(row.get("distance"), float),
+            _num(bbox[0], int),
+            _num(bbox[1], int),
+            _num(bbox[2], int),
+            _num(bbox[3], int),
+            str(row.get("image_path", "") or ""),
+            str(row.get("clip_path", "") or ""),
+            _num(row.get("emb_row"), int),
+            _num(row.get("emb_count"), int) or 0,
+            _num(row.get("cluster_id"), int),
+        )
+
+    def get(self, event_id: int) -> dict | None:
+        r = self._conn().execute("SELECT * FROM events WHERE id = ?", (int(event_id),)).fetchone()
+        return dict(r) if r else None
+
+    def page(
+        self,
+        limit: int = 100,
+        before_id: int | None = None,
+        since_id: int | None = None,
+        before_ts: str | None = None,
+        since_ts: str | None = None,
+        labels: list[str] | None = None,
+        camera: str | None = None,
+        cluster_id: int | None = None,
+    ) -> list[dict]:
+        """
+        Newest-first page of events matching the filters. With a `since` cursor the page is
+        the `limit` events right after it (not the newest ones), so a poller paging forward
+        from its last seen event skips nothing.
+        """
+        where, args = [], []
+        if before_id is not None:
+            where.append("id < ?")
+            args.append(int(before_id))
+        if since_id is not None:
+            where.append("id > ?")
+            args.append(int(since_id))
+        if before_ts:
+            where.append("ts < ?")
+            args.append(before_ts)
+        if since_ts:
+            where.append("ts >= ?")
+            args.append(since_ts)
+        if labels:
+            where.append(f"label IN ({','.join('?' * len(labels))})")
+            args.extend(labels)
+        if camera is not None:
+            where.append("camera = ?")
+            args.append(camera)
+        if cluster_id is not None:
+            where.append("cluster_id = ?")
+            args.append(int(cluster_id))
+
+        sql = "SELECT * FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        forward = since_id is not None or bool(since_ts)
+        sql += f" ORDER BY id {'ASC' if forward else 'DESC'} LIMIT ?"
+        args.append(max(0, int(limit)))
+        rows = [dict(r) for r in self._conn().execute(sql, args)]
+        return rows[::-1] if forward else rows
+
+    def embedded_rows(
+        self,
+        since_ts: str | None = None,
+        before_ts: str | None = None,
+        labels: list[str] | None = None,
+        camera: str | None = None,
+    ):
+        """(ids, emb_row, emb_count) arrays of events with stored embeddings, oldest first."""
+        where, args = ["emb_count > 0"], []
+        if since_ts:
+            where.append("ts >= ?")
+            args.append(since_ts)
+        if before_ts:
+            where.append("ts < ?")
+            args.append(before_ts)
+        if labels:
+            where.append(f"label IN ({','.join('?' * len(labels))})")
+            args.extend(labels)
+        if camera is not None:
+            where.append("camera = ?")
+            args.append(camera)
+        # Plain tuples: this can be every event in the store
+        cur = self._conn().cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            f"SELECT id, emb_row, emb_count FROM events WHERE {' AND '.join(where)} ORDER BY id", args
+        ).fetchall()
+        a = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        return a[:, 0], a[:, 1], a[:, 2]
+
+    def cluster_counts(self) -> dict[int, tuple[int, int]]:
+        """{cluster_id: (events, newest event id)} over every clustered event."""
+        return {
+            int(r[0]): (int(r[1]), int(r[2]))
+            for r in self._conn().execute(
+                "SELECT cluster_id, COUNT(*), MAX(id) FROM events WHERE cluster_id IS NOT NULL GROUP BY cluster_id"
+            )
+        }
+
+    # --- retention (app/retention.py) ---
+
+    @staticmethod
+    def _label_filter(labels: list[str] | None, exclude: list[str] | None) -> tuple[list[str], list]:
+        where, args = [], []
+        if labels:
+            where.append(f"label IN ({','.join('?' * len(labels))})")
+            args.extend(labels)
+        if exclude:
+            where.append(f"label NOT IN ({','.join('?' * len(exclude))})")
+            args.extend(exclude)
+        return where, args
+
+    def oldest(self, limit: int, before_ts: str | None = None, labels: list[str] | None = None,
+               exclude: list[str] | None = None) -> list[dict]:
+        """Oldest-first events (optionally older than before_ts, with / without these labels)."""
+        where, args = self._label_filter(labels, exclude)
+        if before_ts:
+            where.append("ts < ?")
+            args.append(before_ts)
+        sql = "SELECT * FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id LIMIT ?"
+        args.append(max(0, int(limit)))
+        return [dict(r) for r in self._conn().execute(sql, args)]
+
+    def total_bytes(self, labels: list[str] | None = None, exclude: list[str] | None = None) -> int:
+        where, args = self._label_filter(labels, exclude)
+        sql = "SELECT COALESCE(SUM(bytes), 0) FROM events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return int(self._conn().execute(sql, args).fetchone()[0])
+
+    def unmeasured(self, limit: int, before_ts: str) -> list[dict]:
+        """Events older than before_ts whose disk usage has not been recorded yet."""
+        return [dict(r) for r in self._conn().execute(
+            "SELECT * FROM events WHERE bytes IS NULL AND ts < ? ORDER BY id LIMIT ?", (before_ts, int(limit))
+        )]
+
+    def uncompacted(self, limit: int, before_ts: str) -> list[dict]:
+        return [dict(r) for r in self._conn().execute(
+            "SELECT * FROM events WHERE compacted = 0 AND ts < ? ORDER BY id LIMIT ?", (before_ts, int(limit))
+        )]
+
+    def first_clip_owner(self, clip_path: str) -> int | None:
+        """Lowest event id referencing this clip (events during a recording share one clip)."""
+        r = self._conn().execute("SELECT MIN(id) FROM events WHERE clip_path = ?", (clip_path,)).fetchone()
+        return r[0]
+
+    def clip_in_use(self, clip_path: str, excluding: list[int]) -> bool:
+        marks = ",".join("?" * len(excluding)) or "NULL"
+        return self._conn().execute(
+            f"SELECT 1 FROM events WHERE clip_path = ? AND id NOT IN ({marks}) LIMIT 1", (clip_path, *excluding)
+        ).fetchone() is not None
+
+    def set_bytes(self, sizes: list[tuple[int, int]], compacted: int | None = None) -> None:
+        """[(event_id, bytes)]; `compacted` (REENCODED / KEPT) also records the snapshots' re-encode state."""
+        conn = self._conn()
+        with conn:
+            if compacted is not None:
+                conn.executemany("UPDATE events SET bytes = ?, compacted = ? WHERE id = ?",
+                                 [(b, int(compacted), i) for i, b in sizes])
+            else:
+                conn.executemany("UPDATE events SET bytes = ? WHERE id = ?", [(b, i) for i, b in sizes])
+
+    def set_embeddings(self, event_id: int, emb_row: int, emb_count: int) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE events SET emb_row = ?, emb_count = ? WHERE id = ?",
+                         (int(emb_row), int(emb_count), int(event_id)))
+
+    def move_embeddings(self, ids, emb_rows, swap) -> None:
+        """
+        Point events at new embedding rows (events.emb compaction) in one transaction;
+        `swap()` puts the rewritten file in place just before it commits.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("UPDATE events SET emb_row = ? WHERE id = ?",
+                             zip((int(r) for r in emb_rows), (int(i) for i in ids)))
+            swap()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, ids: list[int]) -> int:
+        conn = self._conn()
+        with conn:
+            cur = conn.executemany("DELETE FROM events WHERE id = ?", [(int(i),) for i in ids])
+        return cur.rowcount
+
+    def iter_all(self, chunk: int = 1000):
+        """Every event oldest first, fetched in id-ordered chunks."""
+        last = 0
+        while True:
+            rows = [dict(r) for r in self._conn().execute(
+                "SELECT * FROM events WHERE id > ? ORDER BY id LIMIT ?", (last, int(chunk))
+            )]
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1]["id"]
+
+    def compact(self, max_pages: int = 2048) -> int:
+        """
+        Give free pages back to the filesystem, at most max_pages per call, and truncate the WAL.
+        A database created before incremental auto-vacuum is rewritten once (VACUUM) to switch.
+        Returns the number of pages freed.
+        """
+        conn = self._conn()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)})").fetchall()
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return int(before - after)
+
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM events").fetchone()[0])
+
+    def get_meta(self, key: str) -> str | None:
+        r = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return r[0] if r else None
+
+    def import_csv(self, csv_path: str | Path, once: bool = True) -> int:
+        """
+        Load an events.csv written by older versions, oldest first so ids follow time.
+        With once=True the import is recorded and skipped on later calls.
+        """
+        csv_path = Path(csv_path)
+        if not csv_path.exists():
+            return 0
+        marker = f"imported:{csv_path.resolve()}"
+        conn = self._conn()
+        # BEGIN IMMEDIATE: the worker and the API may both try this on first start
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if once and conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                conn.execute("ROLLBACK")
+                return 0
+            with csv_path.open("r", newline="") as f:
+                rows = sorted(csv.DictReader(f), key=lambda r: r.get("timestamp", ""))
+            conn.executemany(
+                "INSERT INTO events (ts, camera, label, distance, bbox_x, bbox_y, bbox_w, bbox_h, image_path, clip_path,"
+                " emb_row, emb_count, cluster_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._values(r) for r in rows],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (marker, str(len(rows))))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+_stores: dict[Path, EventStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_event_store(csv_path: str | Path) -> EventStore:
+    """
+    Shared EventStore living next to `csv_path` (events.csv -> events.db).
+    The first open imports the legacy CSV once, so no history is lost.
+    """
+    db_path = Path(csv_path).with_name(DB_NAME).resolve()
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = EventStore(db_path)
+            n = store.import_csv(csv_path)
+            if n:
+                print(f"[Events] Imported {n} rows from {csv_path}")
+            _stores[db_path] = store
+    return store
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event store maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="import an events.csv into the event store")
+    imp.add_argument("csv_path")
+    imp.add_argument("--db", help="database path (default: events.db next to the CSV)")
+    imp.add_argument("--force", action="store_true", help="import even if this CSV was imported before")
+    args = parser.parse_args()
+
+    if args.cmd == "import":
+        store = EventStore(args.db or Path(args.csv_path).with_name(DB_NAME))
+        n = store.import_csv(args.csv_path, once=not args.force)
+        print(f"[Events] Imported {n} rows into {store.path} ({store.count()} total)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,68 @@
 from __future__ import annotations
+import os
 import cv2
 import numpy as np
 from pathlib import Path
-from insightface.app import FaceAnalysis
+from .embed_cache import EmbeddingCache
+
+# We load an InsightFace model pack ("buffalo_l", "buffalo_s", ...) but only its
+# detector and recognizer; detection and embedding are driven directly so every
+# aligned crop of a pass goes through the recognizer in one batched ONNX call.
+# Each model gets its own ONNX Runtime session (thread caps, graph optimization level,
+# optionally an INT8 copy and a cached optimized graph), see FaceEngine.__init__.
+# insightface / onnxruntime are imported when an engine is built, so the gallery and
+# matching helpers here stay cheap to import (the API never loads a model to start).
+
+# Landmark / gender-age models shipped in the packs; never loaded
+_ATTRIBUTE_MODELS = ("1k3d68", "2d106det", "genderage")
+GRAPH_OPT_LEVELS = ("disable", "basic", "extended", "all")
+
+
+def model_pack_files(name: str) -> tuple[Path, Path]:
+    """(detector, recognizer) .onnx files of an InsightFace model pack, downloaded on first use."""
+    from insightface.utils import ensure_available
+
+    root = os.getenv("INSIGHTFACE_HOME", "~/.insightface")
+    pack = Path(ensure_available("models", name, root=root))
+    det = rec = None
+    for f in sorted(pack.glob("*.onnx")):
+        if f.stem.startswith(("det_", "scrfd")):
+            det = det or f
+        elif not f.stem.startswith(_ATTRIBUTE_MODELS):
+            rec = rec or f
+    if det is None or rec is None:
+        raise RuntimeError(f"Model pack {name!r} in {pack} has no detector/recognizer")
+    return det, rec
+
+
+def quantized_copy(path: Path, out_dir: Path) -> Path:
+    """INT8 copy of an ONNX model (dynamic quantization: weights stored as uint8), made once."""
+    out = out_dir / path.name
+    if out.exists():
+        return out
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tmp = out_dir / f".{os.getpid()}.{path.name}"
+    print(f"[Face] Quantizing {path.name} to INT8 (one-time) -> {out}")
+    quantize_dynamic(str(path), str(tmp), weight_type=QuantType.QUInt8)
+    os.replace(tmp, out)   # API and worker may both be quantizing; last one wins, same bytes
+    return out
 
-# We use InsightFace's "FaceAnalysis" helper to detect faces and compute embeddings.
 
 class FaceEngine:
     """
     Wraps detector + embedder in a tiny, testable interface.
     - detect_and_embed(frame_bgr) -> list of {bbox, score, embedding}
       bbox = (x, y, w, h), score ~ detection confidence, embedding = 512-dim vector (L2-normalized)
+    - detect_and_embed_batch([frame, ...]) -> one such list per frame, all faces embedded in one call
+    - detect() / embed() expose the two halves for callers that only need boxes
+    Model choice and session tuning:
+    - model: InsightFace pack name (buffalo_l is the accurate one, buffalo_s / buffalo_sc are lighter)
+    - quantize: run INT8 copies of both models (made on first use, cached under model_cache_dir)
+    - intra_op_threads / inter_op_threads / graph_opt: ONNX Runtime session options
+    - model_cache_dir: also keep the optimized graph of each model there, so later starts skip
+      graph optimization (the file is specific to this machine's CPU / provider)
     """
 
     def __init__(
@@ -18,42 +70,179 @@ class FaceEngine:
         providers: list[str] | None = None,
         det_size: tuple[int, int] = (320, 320),
         min_det_score: float = 0.60,
+        max_batch: int = 32,
+        intra_op_threads: int | None = None,
+        model: str = "buffalo_l",
+        quantize: bool = False,
+        inter_op_threads: int | None = None,
+        graph_opt: str = "all",
+        model_cache_dir: str | Path | None = None,
     ) -> None:
-        # 'buffalo_l' = good default pipeline (detector + embedder)
-        self.app = FaceAnalysis(name="buffalo_l", providers=providers or ["CPUExecutionProvider"])
-        self.app.prepare(ctx_id=0, det_size=det_size)
+        from insightface.utils import face_align
+
+        if graph_opt not in GRAPH_OPT_LEVELS:
+            raise ValueError(f"graph_opt must be one of {GRAPH_OPT_LEVELS}, got {graph_opt!r}")
+        self.providers = providers or ["CPUExecutionProvider"]
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_opt = graph_opt
+        variant = f"{model}-int8" if quantize else model
+
+        det_file, rec_file = model_pack_files(model)
+        cache_dir = Path(model_cache_dir) / variant if model_cache_dir else None
+        if quantize:
+            int8_dir = cache_dir or det_file.parent / "int8"
+            det_file, rec_file = quantized_copy(det_file, int8_dir), quantized_copy(rec_file, int8_dir)
+
+        self.det_model = self._load(det_file, cache_dir)
+        self.rec_model = self._load(rec_file, cache_dir)
+        if getattr(self.det_model, "taskname", None) != "detection":
+            raise RuntimeError(f"{det_file} is not a face detector")
+        if getattr(self.rec_model, "taskname", None) != "recognition":
+            raise RuntimeError(f"{rec_file} is not a face recognizer")
+        self.det_model.prepare(0, input_size=tuple(det_size), det_thresh=0.5)
+        self.rec_model.prepare(0)
+        self._norm_crop = face_align.norm_crop
         self.min_det_score = float(min_det_score)
+        # Identifies what produced an embedding (used to invalidate on-disk caches);
+        # a different pack or the INT8 copy gives embeddings that don't mix with the others
+        self.model_tag = f"{variant}@{det_size[0]}x{det_size[1]}"
+        self.max_batch = max(1, int(max_batch))
+        self._batched_rec = True  # flipped off if the recognizer rejects batch > 1
 
-    def detect_and_embed(self, frame_bgr: np.ndarray, min_face_size: int = 80) -> list[dict]:
-        faces = self.app.get(frame_bgr)  # returns a list of faces with bbox, det_score, embedding
+    def _load(self, path: Path, cache_dir: Path | None):
+        """One model on its own session. insightface's get_model() drops sess_options, so route it ourselves."""
+        import onnxruntime as ort
+        from insightface.model_zoo.model_zoo import ModelRouter
+
+        so = ort.SessionOptions()
+        if self.intra_op_threads:
+            so.intra_op_num_threads = int(self.intra_op_threads)
+        if self.inter_op_threads:
+            so.inter_op_num_threads = int(self.inter_op_threads)
+        so.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[self.graph_opt]
+
+        src, saved = str(path), None
+        if cache_dir is not None and self.graph_opt != "disable":
+            device = self.providers[0].replace("ExecutionProvider", "").lower()
+            optimized = cache_dir / f"{path.stem}.{self.graph_opt}.{device}.onnx"
+            if optimized.exists():
+                # Already optimized: load as is
+                src = str(optimized)
+                so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                saved = cache_dir / f".{os.getpid()}.{optimized.name}"
+                so.optimized_model_filepath = str(saved)
+
+        model = ModelRouter(src).get_model(sess_options=so, providers=self.providers)
+        if saved is not None and saved.exists():
+            os.replace(saved, optimized)
+        return model
+
+    def detect(self, frame_bgr: np.ndarray, min_face_size: int = 80) -> list[dict]:
+        """Faces in one frame as {bbox, score, kps}, filtered by size and detection score."""
+        dets, kpss = self.det_model.detect(frame_bgr, max_num=0, metric="default")
         out: list[dict] = []
+        if dets is None:
+            return out
 
-        for f in faces:
-            x1, y1, x2, y2 = f.bbox.astype(int)
+        for i, d in enumerate(dets):
+            x1, y1, x2, y2 = d[:4].astype(int)
             w, h = x2 - x1, y2 - y1
             if w < min_face_size or h < min_face_size:
                 continue
 
-            score = float(getattr(f, "det_score", 1.0))
+            score = float(d[4])
             if score < self.min_det_score:
                 continue
 
-            # Prefer normalized embedding if present
-            emb = getattr(f, "normed_embedding", None)
-            if emb is None or np.size(emb) == 0:
-                emb = np.asarray(getattr(f, "embedding"), dtype=np.float32)
-                # L2-normalize
-                emb = emb / (np.linalg.norm(emb) + 1e-12)
-            else:
-                emb = np.asarray(emb, dtype=np.float32)
-
             out.append({
                 "bbox": (int(x1), int(y1), int(w), int(h)),
                 "score": score,
-                "embedding": emb,
+                "kps": kpss[i] if kpss is not None else None,
             })
         return out
 
+    def detect_rois(self, frame_bgr: np.ndarray, rois, min_face_size: int = 80) -> list[dict]:
+        """
+        Detect only inside regions (x, y, w, h) of the frame. Each crop is sent to the
+        detector at its own scale, so small faces are not lost to the full-frame downscale.
+        Boxes and landmarks are returned in frame coordinates.
+        """
+        out: list[dict] = []
+        for x, y, w, h in rois:
+            crop = frame_bgr[y:y + h, x:x + w]
+            if crop.size == 0:
+                continue
+            for f in self.detect(crop, min_face_size=min_face_size):
+                fx, fy, fw, fh = f["bbox"]
+                f["bbox"] = (fx + x, fy + y, fw, fh)
+                if f["kps"] is not None:
+                    f["kps"] = f["kps"] + np.array([x, y], dtype=f["kps"].dtype)
+                out.append(f)
+        return out
+
+    def embed(self, frames: list[np.ndarray], faces_per_frame: list[list[dict]]) -> None:
+        """
+        Fill in "embedding" for every face (faces_per_frame[i] belongs to frames[i]).
+        All aligned crops are run through the recognizer together, in chunks of max_batch.
+        """
+        crops = []
+        owners = []
+        size = self.rec_model.input_size[0]
+        for frame, faces in zip(frames, faces_per_frame):
+            for f in faces:
+                if f.get("kps") is None:
+                    continue
+                crops.append(self._norm_crop(frame, landmark=f["kps"], image_size=size))
+                owners.append(f)
+        if not crops:
+            return
+
+        feats = self._rec_feats(crops)
+        feats = feats / (np.linalg.norm(feats, axis=1, keepdims=True) + 1e-12)
+        for f, emb in zip(owners, feats):
+            f["embedding"] = emb
+
+    def _rec_feats(self, crops: list[np.ndarray]) -> np.ndarray:
+        if self._batched_rec:
+            try:
+                chunks = [
+                    self.rec_model.get_feat(crops[i:i + self.max_batch])
+                    for i in range(0, len(crops), self.max_batch)
+                ]
+                return np.concatenate(chunks, axis=0).astype(np.float32)
+            except Exception as e:
+                # Some exported recognizers have a fixed batch dimension of 1
+                print(f"[Face] Batched recognition unavailable, falling back to per-face calls: {e}")
+                self._batched_rec = False
+        return np.concatenate([self.rec_model.get_feat(c) for c in crops], axis=0).astype(np.float32)
+
+    def detect_batch(self, frames: list[np.ndarray], min_face_size: int = 80,
+                     rois: list | None = None) -> list[list[dict]]:
+        return [
+            self.detect_rois(frame, rois[i], min_face_size=min_face_size)
+            if rois is not None and rois[i] is not None
+            else self.detect(frame, min_face_size=min_face_size)
+            for i, frame in enumerate(frames)
+        ]
+
+    def detect_and_embed_batch(self, frames: list[np.ndarray], min_face_size: int = 80,
+                               rois: list | None = None) -> list[list[dict]]:
+        """rois[i], when given and not None, limits detection in frames[i] to those regions."""
+        faces_per_frame = self.detect_batch(frames, min_face_size=min_face_size, rois=rois)
+        self.embed(frames, faces_per_frame)
+        return [[f for f in faces if "embedding" in f] for faces in faces_per_frame]
+
+    def detect_and_embed(self, frame_bgr: np.ndarray, min_face_size: int = 80) -> list[dict]:
+        return self.detect_and_embed_batch([frame_bgr], min_face_size=min_face_size)[0]
+
 
 def cosine_dist_to_gallery(emb: np.ndarray, gallery: np.ndarray) -> float:
     """Smaller is better. With normalized vectors, distance = 1 - max cosine similarity."""
@@ -72,25 +261,69 @@ def l2_dist_to_gallery(emb: np.ndarray, gallery: np.ndarray) -> float:
     dists = np.sqrt(np.sum(diffs * diffs, axis=1))
     return float(np.min(dists))
 
-def build_gallery_for_dir(dir_path: Path, engine: FaceEngine, min_face_size: int = 80) -> np.ndarray:
-    paths = []
-    for ext in ("*.jpg","*.jpeg","*.png","*.JPG","*.PNG"):
-        paths.extend(dir_path.glob(ext))
-    embs = []
+def cache_signature(engine: FaceEngine | None, min_face_size: int = 80) -> str | None:
+    if engine is None:
+        return None
+    return f"{engine.model_tag}|min_face={int(min_face_size)}|min_score={engine.min_det_score:.3f}"
+
+def build_gallery_for_dir(dir_path: Path, engine: FaceEngine | None, min_face_size: int = 80) -> np.ndarray:
+    """Gallery matrix for one enrollment folder; only new or changed photos are embedded."""
+    cache = EmbeddingCache(dir_path, cache_signature(engine, min_face_size))
+    cache.refresh(engine, min_face_size=min_face_size)
+    return cache.gallery()
+
+def enroll_photos(dir_path: Path, paths: list[Path], engine: FaceEngine, min_face_size: int = 80,
+                  dup_sim: float = 0.95) -> list[dict]:
+    """
+    Embed only these newly saved photos of one enrollment folder (one batched recognizer
+    call) and add them to the folder's embedding cache. Returns a quality report per photo:
+    {file, face_found, faces, det_score, face_size, duplicate_of, max_similarity}
+    `duplicate_of` names an already enrolled photo (or an earlier one of this batch) whose
+    embedding has cosine similarity >= dup_sim; such photos add little to the gallery.
+    """
+    cache = EmbeddingCache(dir_path, cache_signature(engine, min_face_size))
+    names = [n for n, e in sorted(cache.entries.items()) if e["embedding"] is not None]
+    known = [cache.entries[n]["embedding"] for n in names]
+
+    report, imgs, bests, owners = [], [], [], []
     for p in paths:
+        st = p.stat()
         img = cv2.imread(str(p))
+        items = engine.detect(img, min_face_size=min_face_size) if img is not None else []
+        r = {"file": p.name, "face_found": bool(items), "faces": len(items), "det_score": None,
+             "face_size": None, "duplicate_of": None, "max_similarity": None}
         if img is None:
-            continue
-        items = engine.detect_and_embed(img, min_face_size=min_face_size)
+            r["error"] = "unreadable image"
+        report.append(r)
         if not items:
+            cache.put(p, None, st)
             continue
         best = max(items, key=lambda d: d["score"])
-        embs.append(best["embedding"])
-    if not embs:
-        return np.zeros((0,512), dtype=np.float32)
-    g = np.stack(embs, axis=0).astype(np.float32)
-    g = g / (np.linalg.norm(g, axis=1, keepdims=True) + 1e-12)
-    return g
+        r["det_score"] = round(best["score"], 3)
+        r["face_size"] = [best["bbox"][2], best["bbox"][3]]
+        imgs.append(img)
+        bests.append([best])
+        owners.append((p, st, r))
+    engine.embed(imgs, bests)
+
+    for (p, st, r), b in zip(owners, bests):
+        emb = b[0].get("embedding")
+        if emb is None:
+            r["face_found"] = False
+            cache.put(p, None, st)
+            continue
+        emb = emb / (np.linalg.norm(emb) + 1e-12)
+        if known:
+            sims = np.stack(known) @ emb
+            j = int(np.argmax(sims))
+            r["max_similarity"] = round(float(sims[j]), 3)
+            if sims[j] >= dup_sim:
+                r["duplicate_of"] = names[j]
+        cache.put(p, emb, st)
+        names.append(p.name)
+        known.append(emb)
+    cache.save()
+    return report
 
 def load_all_user_galleries(users: list[dict], engine: FaceEngine, enroll_root: Path, min_face_size: int = 80) -> dict[str, np.ndarray]:
     """Return {user_id: gallery_matrix}."""
@@ -101,10 +334,147 @@ def load_all_user_galleries(users: list[dict], engine: FaceEngine, enroll_root:
         galleries[uid] = g
     return galleries
 
-def best_match_across_users(emb: np.ndarray, galleries: dict[str, np.ndarray], metric="cosine"):
+class GalleryIndex:
+    """
+    Every enrolled embedding in one contiguous float32 matrix, grouped by user,
+    with a parallel user-id array.
+    - search(queries, k) answers top-k users for a whole batch with one matmul
+    - add()/remove() edit the packed matrix in place when enrollment changes
+    Rows are expected to be L2-normalized (as FaceEngine produces them).
+    """
+
+    def __init__(self, dim: int = 512, capacity: int = 256) -> None:
+        self.dim = int(dim)
+        self._data = np.zeros((max(1, capacity), self.dim), dtype=np.float32)
+        self._n = 0
+        self._users: list[str] = []    # user order in the matrix
+        self._counts: list[int] = []   # rows per user, same order
+        self._codes = np.zeros(self._data.shape[0], dtype=np.int32)  # row -> index into _users
+
+    @classmethod
+    def from_galleries(cls, galleries: dict[str, np.ndarray], dim: int = 512) -> "GalleryIndex":
+        total = sum(int(g.shape[0]) for g in galleries.values())
+        idx = cls(dim=dim, capacity=max(total, 1))
+        for uid, g in galleries.items():
+            idx.add(uid, g)
+        return idx
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:self._n]
+
+    @property
+    def user_ids(self) -> np.ndarray:
+        """Parallel user-id array: user_ids[i] owns matrix[i]."""
+        users = np.array(self._users, dtype=object)
+        return users[self._codes[:self._n]] if self._users else np.zeros(0, dtype=object)
+
+    def users(self) -> list[str]:
+        return list(self._users)
+
+    def _reserve(self, n: int) -> None:
+        if n <= self._data.shape[0]:
+            return
+        cap = max(n, 2 * self._data.shape[0])
+        data = np.zeros((cap, self.dim), dtype=np.float32)
+        data[:self._n] = self._data[:self._n]
+        codes = np.zeros(cap, dtype=np.int32)
+        codes[:self._n] = self._codes[:self._n]
+        self._data, self._codes = data, codes
+
+    def add(self, uid: str, embs: np.ndarray) -> None:
+        """Set the embeddings of `uid` (replacing any it had)."""
+        self.remove(uid)
+        embs = np.asarray(embs, dtype=np.float32).reshape(-1, self.dim)
+        if embs.shape[0] == 0:
+            return
+        m = embs.shape[0]
+        self._reserve(self._n + m)
+        self._data[self._n:self._n + m] = embs
+        self._codes[self._n:self._n + m] = len(self._users)
+        self._users.append(uid)
+        self._counts.append(m)
+        self._n += m
+
+    def append(self, uid: str, embs: np.ndarray) -> None:
+        """Add more embeddings to `uid`, keeping any it already has."""
+        if uid in self._users:
+            i = self._users.index(uid)
+            start = sum(self._counts[:i])
+            old = self._data[start:start + self._counts[i]].copy()
+            embs = np.concatenate([old, np.asarray(embs, dtype=np.float32).reshape(-1, self.dim)], axis=0)
+        self.add(uid, embs)
+
+    def remove(self, uid: str) -> None:
+        if uid not in self._users:
+            return
+        i = self._users.index(uid)
+        start = sum(self._counts[:i])
+        c = self._counts[i]
+        end = self._n
+        # Shift the tail down over the removed block
+        self._data[start:end - c] = self._data[start + c:end]
+        self._codes[start:end - c] = self._codes[start + c:end]
+        self._codes[start:end - c][self._codes[start:end - c] > i] -= 1
+        self._n -= c
+        del self._users[i]
+        del self._counts[i]
+
+    def search(self, queries: np.ndarray, k: int = 1, metric: str = "cosine") -> tuple[list[list[str]], np.ndarray]:
+        """
+        Top-k users for each query row. Returns (user_ids, distances) where
+        user_ids[i] has up to k entries and distances is (M, k) (inf where fewer users exist).
+        """
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        m = q.shape[0]
+        if self._n == 0 or m == 0:
+            return [[] for _ in range(m)], np.full((m, k), np.inf, dtype=np.float32)
+
+        sims = q @ self.matrix.T                     # (M, N)
+        starts = np.cumsum([0] + self._counts[:-1])
+        per_user = np.maximum.reduceat(sims, starts, axis=1)   # (M, U) best sim per user
+
+        u = per_user.shape[1]
+        kk = min(k, u)
+        if kk < u:
+            top = np.argpartition(-per_user, kk - 1, axis=1)[:, :kk]
+        else:
+            top = np.tile(np.arange(u), (m, 1))
+        top_sims = np.take_along_axis(per_user, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_sims = np.take_along_axis(top_sims, order, axis=1)
+
+        dists = np.full((m, k), np.inf, dtype=np.float32)
+        dists[:, :kk] = sims_to_dist(top_sims, metric)
+        uids = [[self._users[j] for j in row] for row in top]
+        return uids, dists
+
+    def best_match(self, emb: np.ndarray, metric: str = "cosine"):
+        uids, dists = self.search(emb, k=1, metric=metric)
+        if not uids[0]:
+            return None, float("inf")
+        return uids[0][0], float(dists[0, 0])
+
+
+def sims_to_dist(sims: np.ndarray, metric: str = "cosine") -> np.ndarray:
+    """Cosine similarities of unit vectors -> distances (cosine: 1 - s, l2: sqrt(2 - 2s))."""
+    if metric == "l2":
+        return np.sqrt(np.maximum(2.0 - 2.0 * sims, 0.0))
+    return 1.0 - sims
+
+
+def best_match_across_users(emb: np.ndarray, galleries, metric="cosine"):
     """
     Return (user_id, distance) for the best match, or (None, inf) if none.
+    `galleries` is a matcher (GalleryIndex, or any backend from app.ann) or a {user_id: matrix} dict.
     """
+    if hasattr(galleries, "best_match"):
+        return galleries.best_match(emb, metric=metric)
+
     best_uid, best_dist = None, float("inf")
     for uid, gal in galleries.items():
         if gal.size == 0:
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .users import DATA
+
+# The enrolled gallery is shared between the API and the worker as a versioned snapshot:
+#   data/gallery/gallery-<generation>.npy   every embedding, float32 (N, 512), grouped by user
+#   data/gallery/manifest.json              {"generation", "file", "signature", "users": [...]}
+# Whoever enrolls writes a new .npy under a new name and then swaps the manifest in with
+# os.replace, so a reader sees either the old or the new generation, never a mix. The
+# worker stats the manifest each loop (nothing else while idle) and memory-maps the new
+# .npy when the generation changes.
+
+GALLERY_DIR = DATA / "gallery"
+MANIFEST = "manifest.json"
+KEEP_GENERATIONS = 2
+EMB_DIM = 512
+
+
+@contextmanager
+def _locked(gallery_dir: Path):
+    """Serialize snapshot writers (API job thread, worker startup) across processes."""
+    gallery_dir.mkdir(parents=True, exist_ok=True)
+    with open(gallery_dir / ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_manifest(gallery_dir: str | Path = GALLERY_DIR) -> dict | None:
+    try:
+        return json.loads((Path(gallery_dir) / MANIFEST).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def load_snapshot(gallery_dir: str | Path = GALLERY_DIR, manifest: dict | None = None):
+    """(manifest, {user_id: gallery rows}) of the current generation; rows are views of a memory map."""
+    gallery_dir = Path(gallery_dir)
+    manifest = manifest or read_manifest(gallery_dir)
+    if manifest is None:
+        return None, {}
+    matrix = np.load(gallery_dir / manifest["file"], mmap_mode="r")
+    galleries = {
+        u["id"]: matrix[u["start"]:u["start"] + u["count"]]
+        for u in manifest["users"]
+    }
+    return manifest, galleries
+
+
+def _write(gallery_dir: Path, galleries: dict[str, np.ndarray], names: dict[str, str],
+           signature: str | None, generation: int) -> dict:
+    users, rows, start = [], [], 0
+    for uid, g in galleries.items():
+        g = np.asarray(g, dtype=np.float32).reshape(-1, EMB_DIM)
+        users.append({"id": uid, "name": names.get(uid, uid), "start": start, "count": int(g.shape[0])})
+        rows.append(g)
+        start += int(g.shape[0])
+    matrix = np.concatenate(rows, axis=0) if rows else np.zeros((0, EMB_DIM), dtype=np.float32)
+
+    name = f"gallery-{generation:06d}.npy"
+    tmp = gallery_dir / f".{name}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, matrix)
+    os.replace(tmp, gallery_dir / name)
+
+    manifest = {
+        "generation": generation,
+        "file": name,
+        "signature": signature,
+        "users": users,
+        "rows": int(matrix.shape[0]),
+        "ts": time.time(),
+    }
+    tmp = gallery_dir / f".{MANIFEST}.tmp"
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, gallery_dir / MANIFEST)   # commit point
+
+    # Readers still mapping an older file keep it alive (unlink doesn't touch live maps)
+    for old in sorted(gallery_dir.glob("gallery-*.npy"))[:-KEEP_GENERATIONS]:
+        old.unlink(missing_ok=True)
+    return manifest
+
+
+def publish_snapshot(galleries: dict[str, np.ndarray], names: dict[str, str], signature: str | None,
+                     gallery_dir: str | Path = GALLERY_DIR) -> dict:
+    """Replace the whole snapshot with these galleries (a new generation)."""
+    gallery_dir = Path(gallery_dir)
+    with _locked(gallery_dir):
+        current = read_manifest(gallery_dir)
+        generation = (current["generation"] + 1) if current else 1
+        return _write(gallery_dir, galleries, names, signature, generation)
+
+
+def update_snapshot(changed: dict[str, np.ndarray | None], names: dict[str, str], signature: str | None,
+                    gallery_dir: str | Path = GALLERY_DIR, rebuild=None) -> dict | None:
+    """
+    New generation with these users' galleries replaced (None removes a user); everyone
+    else is copied from the current generation. `names` is the full id -> name map.
+    signature=None keeps the current one (e.g. a new user, no engine loaded).
+    With no generation yet there is nothing to copy from: `rebuild()` -> {user id: gallery}
+    builds everyone's galleries instead (a full build, like publish_snapshot); without it
+    nothing is written and None is returned (the worker publishes a full snapshot when it starts).
+    """
+    gallery_dir = Path(gallery_dir)
+    with _locked(gallery_dir):
+        manifest, galleries = load_snapshot(gallery_dir)
+        if manifest is None:
+            if rebuild is None:
+                return None
+            galleries = rebuild()
+        if signature is None and manifest is not None:
+            signature = manifest.get("signature")
+        galleries = {uid: g for uid, g in galleries.items() if uid in names}
+        for uid, g in changed.items():
+            if g is None:
+                galleries.pop(uid, None)
+            else:
+                galleries[uid] = g
+        for uid in names:
+            # Users without photos yet still get a (empty) entry and their name
+            galleries.setdefault(uid, np.zeros((0, EMB_DIM), dtype=np.float32))
+        generation = (manifest["generation"] + 1) if manifest else 1
+        return _write(gallery_dir, galleries, names, signature, generation)
+
+
+class SnapshotWatcher:
+    """
+    Worker side. poll() costs one stat() while nothing changed; when the manifest was
+    swapped it returns (manifest, galleries) of the new generation, else None.
+    """
+
+    def __init__(self, gallery_dir: str | Path = GALLERY_DIR) -> None:
+        self.dir = Path(gallery_dir)
+        self.generation = 0
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.dir / MANIFEST)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def seen(self, manifest: dict) -> None:
+        """Mark a generation as already applied (e.g. the one this process just wrote)."""
+        self.generation = manifest["generation"]
+        self._stamp = self._stat()
+
+    def poll(self):
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        manifest = read_manifest(self.dir)
+        if manifest is None or manifest["generation"] == self.generation:
+            return None
+        try:
+            manifest, galleries = load_snapshot(self.dir, manifest)
+        except OSError as e:
+            # A newer generation replaced it between reading the manifest and mapping; next poll
+            print(f"[Face] Could not load gallery generation {manifest['generation']}: {e}")
+            self._stamp = None
+            return None
+        self.generation = manifest["generation"]
+        return manifest, galleries
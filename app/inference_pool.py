@@ -0,0 +1,310 @@
+from __future__ import annotations
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Frames travel to the pool through shared-memory slots: the parent copies a frame into
+# a free slot for the duration of a call, workers map the same memory as an ndarray, and only small results
+# (boxes, landmarks, embeddings) come back through the result queue, tagged with task ids.
+# A slot whose task timed out may still be read by a hung worker, so it is never reused:
+# it gets a fresh segment, and workers drop their mapping of a slot's old segment as soon
+# as a task names a new one.
+
+
+THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def _worker_main(task_q, result_q, engine_kw: dict, intra_op_threads: int) -> None:
+    from .face import FaceEngine
+
+    try:
+        engine = FaceEngine(**{**engine_kw, "intra_op_threads": intra_op_threads})
+    except Exception as e:
+        result_q.put(("hello", None, repr(e)))
+        return
+    result_q.put(("hello", {"model_tag": engine.model_tag, "min_det_score": engine.min_det_score}, None))
+
+    attached: dict[int, shared_memory.SharedMemory] = {}   # slot index -> its current segment
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        kind, task_id, slot_idx, shm_name, shape, dtype, payload = task
+        try:
+            shm = attached.get(slot_idx)
+            if shm is None or shm.name != shm_name:
+                if shm is not None:
+                    # The parent resized or retired this slot and unlinked the old segment
+                    _detach(shm)
+                shm = shared_memory.SharedMemory(name=shm_name)
+                attached[slot_idx] = shm
+            frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            if kind == "detect":
+                rois, min_face_size = payload
+                if rois is None:
+                    result = engine.detect(frame, min_face_size=min_face_size)
+                else:
+                    result = engine.detect_rois(frame, rois, min_face_size=min_face_size)
+            elif kind == "embed":
+                faces = [{"kps": k} for k in payload]
+                engine.embed([frame], [faces])
+                result = [f.get("embedding") for f in faces]
+            else:
+                raise ValueError(f"unknown task {kind}")
+            result_q.put((task_id, result, None))
+        except Exception as e:
+            result_q.put((task_id, None, repr(e)))
+        finally:
+            frame = None   # no view may outlive the task, or the segment can't be detached
+
+    for shm in attached.values():
+        _detach(shm)
+
+
+def _detach(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        pass  # a view is still alive; the mapping goes with the process
+
+
+class _Slot:
+    def __init__(self, nbytes: int) -> None:
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        self.nbytes = nbytes
+
+    def close(self) -> None:
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class InferencePool:
+    """
+    FaceEngine running in a pool of worker processes, usable wherever a FaceEngine is
+    (detect, detect_rois, detect_batch, embed, detect_and_embed[_batch]).
+    - every frame (and every ROI of a frame) is detected by whichever process is free
+    - embedding crops of a pass are spread over the processes too
+    - `intra_op_threads` caps ONNX Runtime threads per process, so size * threads ~ cores
+    """
+
+    def __init__(self, size: int = 2, intra_op_threads: int = 1, engine_kw: dict | None = None,
+                 timeout: float = 30.0, start_timeout: float = 300.0) -> None:
+        from .engine_runtime import engine_kwargs
+
+        self.size = max(1, int(size))
+        self.intra_op_threads = max(1, int(intra_op_threads))
+        self.engine_kw = engine_kw or engine_kwargs()
+        self.timeout = float(timeout)
+        self._ctx = mp.get_context("spawn")
+        self._task_q = self._ctx.Queue()
+        self._result_q = self._ctx.Queue()
+        self._procs = [self._spawn() for _ in range(self.size)]
+
+        # Wait for every worker to load its models; they report the engine identity
+        info = None
+        for _ in range(self.size):
+            kind, data, err = self._result_q.get(timeout=start_timeout)
+            if err:
+                self.close()
+                raise RuntimeError(f"Inference worker failed to start: {err}")
+            info = data
+        self.model_tag = info["model_tag"]
+        self.min_det_score = info["min_det_score"]
+
+        self._free: queue.Queue = queue.Queue()
+        self._slots: list[_Slot | None] = []
+        self._tainted: set[int] = set()   # slots a timed-out task may still be using
+        self._ids = itertools.count(1)
+        self._waiting: dict[int, list] = {}  # task id -> [event, result, error]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+        self._collector.start()
+        self.stats = {"tasks": 0, "restarts": 0, "timeouts": 0, "retired_slots": 0}
+
+    def _spawn(self):
+        p = self._ctx.Process(
+            target=_worker_main,
+            args=(self._task_q, self._result_q, self.engine_kw, self.intra_op_threads),
+            daemon=True,
+        )
+        # Keep each process's math libraries to its share of the cores. They read these when
+        # first imported, which in a spawned child is before _worker_main runs, so the child
+        # has to inherit them; the parent's own environment is put back right after
+        saved = {var: os.environ.get(var) for var in THREAD_VARS}
+        os.environ.update({var: str(self.intra_op_threads) for var in THREAD_VARS})
+        try:
+            p.start()
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+        return p
+
+    def _collect(self) -> None:
+        while not self._stop.is_set():
+            try:
+                task_id, result, err = self._result_q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if task_id == "hello":
+                continue  # a restarted worker is ready
+            with self._lock:
+                w = self._waiting.pop(task_id, None)
+            if w is not None:
+                w[1], w[2] = result, err
+                w[0].set()
+
+    def _check_workers(self) -> None:
+        for i, p in enumerate(self._procs):
+            if not p.is_alive():
+                print(f"[Pool] Inference worker {p.pid} died (exit {p.exitcode}); restarting")
+                self._procs[i] = self._spawn()
+                self.stats["restarts"] += 1
+
+    # --- frames <-> slots ---
+
+    def _acquire(self, frame: np.ndarray) -> int:
+        try:
+            idx = self._free.get_nowait()
+        except queue.Empty:
+            # Grow on demand: a batch holds one slot per frame until its results are back
+            with self._lock:
+                self._slots.append(None)
+                idx = len(self._slots) - 1
+        slot = self._slots[idx]
+        if slot is None or slot.nbytes < frame.nbytes:
+            if slot is not None:
+                slot.close()
+            slot = _Slot(frame.nbytes)
+            self._slots[idx] = slot
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=slot.shm.buf)[...] = frame
+        return idx
+
+    def _release(self, held: list[int]) -> None:
+        for idx in held:
+            with self._lock:
+                tainted = idx in self._tainted
+                self._tainted.discard(idx)
+            if tainted:
+                # Unlinking is safe for a worker still mapping it; the next call gets a fresh segment
+                self._slots[idx].close()
+                self._slots[idx] = None
+                self.stats["retired_slots"] += 1
+            self._free.put(idx)
+
+    def _submit(self, kind: str, idx: int, frame: np.ndarray, payload) -> list:
+        task_id = next(self._ids)
+        w = [threading.Event(), None, None]
+        with self._lock:
+            self._waiting[task_id] = w
+        self._task_q.put((kind, task_id, idx, self._slots[idx].shm.name, frame.shape, frame.dtype.str, payload))
+        self.stats["tasks"] += 1
+        return [task_id, w, idx]
+
+    def _abandon(self, pending: list) -> None:
+        """The call gives up on its tasks: every unfinished one may still touch its slot."""
+        with self._lock:
+            for tid, tw, idx in pending:
+                if not tw[0].is_set():
+                    self._waiting.pop(tid, None)
+                    self._tainted.add(idx)
+
+    def _wait(self, pending: list) -> list:
+        out = []
+        deadline = time.monotonic() + self.timeout
+        for task_id, w, _ in pending:
+            if not w[0].wait(max(0.0, deadline - time.monotonic())):
+                self._abandon(pending)
+                self.stats["timeouts"] += 1
+                self._check_workers()
+                raise RuntimeError(f"Inference task {task_id} timed out")
+            if w[2]:
+                self._abandon(pending)
+                raise RuntimeError(f"Inference task {task_id} failed: {w[2]}")
+            out.append(w[1])
+        return out
+
+    # --- FaceEngine interface ---
+
+    def detect_batch(self, frames: list[np.ndarray], min_face_size: int = 80,
+                     rois: list | None = None) -> list[list[dict]]:
+        self._check_workers()
+        held, pending, owners = [], [], []
+        try:
+            for i, frame in enumerate(frames):
+                regions = rois[i] if rois is not None else None
+                if regions is not None and not regions:
+                    continue
+                held.append(self._acquire(frame))
+                # Split ROIs over the pool so one busy frame still uses several cores
+                for part in ([None] if regions is None else [[r] for r in regions]):
+                    pending.append(self._submit("detect", held[-1], frame, (part, int(min_face_size))))
+                    owners.append(i)
+            results: list[list[dict]] = [[] for _ in frames]
+            for i, faces in zip(owners, self._wait(pending)):
+                results[i].extend(faces)
+            return results
+        finally:
+            self._release(held)
+
+    def detect(self, frame_bgr: np.ndarray, min_face_size: int = 80) -> list[dict]:
+        return self.detect_batch([frame_bgr], min_face_size=min_face_size)[0]
+
+    def detect_rois(self, frame_bgr: np.ndarray, rois, min_face_size: int = 80) -> list[dict]:
+        return self.detect_batch([frame_bgr], min_face_size=min_face_size, rois=[rois])[0]
+
+    def embed(self, frames: list[np.ndarray], faces_per_frame: list[list[dict]]) -> None:
+        held, pending, owners = [], [], []
+        try:
+            for frame, faces in zip(frames, faces_per_frame):
+                faces = [f for f in faces if f.get("kps") is not None]
+                if not faces:
+                    continue
+                held.append(self._acquire(frame))
+                # Spread the crops of a crowded frame over the processes
+                for chunk in np.array_split(np.arange(len(faces)), min(self.size, len(faces))):
+                    group = [faces[j] for j in chunk]
+                    pending.append(self._submit("embed", held[-1], frame, [f["kps"] for f in group]))
+                    owners.append(group)
+            for group, embs in zip(owners, self._wait(pending)):
+                for f, emb in zip(group, embs):
+                    if emb is not None:
+                        f["embedding"] = emb
+        finally:
+            self._release(held)
+
+    def detect_and_embed_batch(self, frames: list[np.ndarray], min_face_size: int = 80,
+                               rois: list | None = None) -> list[list[dict]]:
+        faces_per_frame = self.detect_batch(frames, min_face_size=min_face_size, rois=rois)
+        self.embed(frames, faces_per_frame)
+        return [[f for f in faces if "embedding" in f] for faces in faces_per_frame]
+
+    def detect_and_embed(self, frame_bgr: np.ndarray, min_face_size: int = 80) -> list[dict]:
+        return self.detect_and_embed_batch([frame_bgr], min_face_size=min_face_size)[0]
+
+    def close(self) -> None:
+        if hasattr(self, "_stop"):
+            self._stop.set()
+        for _ in self._procs:
+            self._task_q.put(None)
+        for p in self._procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        for slot in getattr(self, "_slots", []):
+            if slot is not None:
+                slot.close()
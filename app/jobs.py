@@ -0,0 +1,79 @@
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueue:
+    """
+    Background jobs for the API (gallery builds, model warmup) so requests return at once.
+    - one worker thread: jobs sharing the face engine run one after another
+    - get(job_id) reports {id, kind, status, ...}; status is queued|running|done|failed
+    - the newest `keep` jobs are remembered for status queries
+    """
+
+    def __init__(self, workers: int = 1, keep: int = 200) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="api-job")
+        self._jobs: OrderedDict[str, dict] = OrderedDict()
+        self._done: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.keep = int(keep)
+
+    def submit(self, kind: str, fn, *args, **info) -> dict:
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            **info,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._done[job["id"]] = threading.Event()
+            while len(self._jobs) > self.keep:
+                old, _ = self._jobs.popitem(last=False)
+                self._done.pop(old, None)
+        self._pool.submit(self._run, job, fn, args)
+        return dict(job)
+
+    def _run(self, job: dict, fn, args) -> None:
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        try:
+            job["result"] = fn(*args)
+            job["status"] = "done"
+        except Exception as e:
+            print(f"[Jobs] {job['kind']} {job['id']} failed: {e}")
+            traceback.print_exc()
+            job["error"] = str(e)
+            job["status"] = "failed"
+        job["finished_at"] = time.time()
+        with self._lock:
+            done = self._done.get(job["id"])
+        if done is not None:
+            done.set()
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: float) -> dict | None:
+        """Block up to `timeout` seconds for the job to finish; returns its current state."""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is not None:
+            done.wait(timeout)
+        return self.get(job_id)
+
+    def pending(self, kind: str | None = None) -> list[dict]:
+        with self._lock:
+            return [dict(j) for j in self._jobs.values()
+                    if j["status"] in ("queued", "running") and (kind is None or j["kind"] == kind)]
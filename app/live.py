@@ -0,0 +1,179 @@
+from __future__ import annotations
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Live view handoff between the worker and the API (separate processes / containers).
+# Each camera has a memory-mapped ring file data/live/<camera>.ring holding its latest
+# JPEG-encoded frames. The worker encodes a frame once; every API client copies the
+# same bytes out of the ring, so nothing is decoded or re-encoded per viewer.
+#
+# Layout (little endian):
+#   header (64 bytes): magic "LIVE", version, slots, slot_bytes, latest seq, writer ts, reader ts
+#   slot i at 64 + i * (24 + slot_bytes): seq (0 = being written), length, pad, ts, JPEG bytes
+# Slots are written round-robin with a seqlock: a reader checks the slot's seq before
+# and after copying, and retries if the writer overwrote it meanwhile.
+
+MAGIC = b"LIVE"
+VERSION = 1
+_HEADER = struct.Struct("<4sIIIQdd")
+HEADER_SIZE = 64
+_SLOT = struct.Struct("<QIId")
+_LATEST_OFF = 16
+_WRITER_TS_OFF = 24
+_READER_TS_OFF = 32
+
+
+def ring_path(live_dir: str | Path, cam_id: str) -> Path:
+    return Path(live_dir) / f"{cam_id}.ring"
+
+
+def encode_jpeg(frame: np.ndarray, max_width: int = 0, quality: int = 70) -> bytes | None:
+    """JPEG bytes of a frame, downscaled first when wider than max_width."""
+    h, w = frame.shape[:2]
+    if max_width and w > max_width:
+        scale = max_width / w
+        frame = cv2.resize(frame, (max_width, int(h * scale)), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return buf.tobytes() if ok else None
+
+
+class LiveWriter:
+    """
+    Worker side: publishes annotated frames of one camera.
+    - at most `fps` frames per second, downscaled to `max_width` before encoding
+    - encoding stops while no client has read the ring for `idle_sec`
+    """
+
+    def __init__(self, path: str | Path, slots: int = 4, slot_bytes: int = 1 << 20, fps: float = 10.0,
+                 quality: int = 70, max_width: int = 960, idle_sec: float = 5.0) -> None:
+        self.path = Path(path)
+        self.slots = max(3, int(slots))
+        self.slot_bytes = int(slot_bytes)
+        self.interval = 1.0 / max(0.1, float(fps))
+        self.quality = int(quality)
+        self.max_width = int(max_width)
+        self.idle_sec = float(idle_sec)
+        self.seq = 0
+        self._last = 0.0
+        self._too_big = 0
+
+        # Build the file next to its final name and swap it in, so readers never map a half-made ring
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = HEADER_SIZE + self.slots * (_SLOT.size + self.slot_bytes)
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "wb") as f:
+            f.truncate(size)
+        self._f = open(tmp, "r+b")
+        self._mm = mmap.mmap(self._f.fileno(), size)
+        self._mm[:_HEADER.size] = _HEADER.pack(MAGIC, VERSION, self.slots, self.slot_bytes, 0, 0.0, 0.0)
+        os.replace(tmp, self.path)
+
+    def watched(self, now: float | None = None) -> bool:
+        reader_ts = struct.unpack_from("<d", self._mm, _READER_TS_OFF)[0]
+        return (now or time.time()) - reader_ts < self.idle_sec
+
+    def due(self) -> bool:
+        """True when a frame should be published now (rate limit + someone is watching)."""
+        now = time.monotonic()
+        if now - self._last < self.interval or not self.watched():
+            return False
+        self._last = now
+        return True
+
+    def publish_frame(self, frame: np.ndarray) -> bool:
+        jpeg = encode_jpeg(frame, self.max_width, self.quality)
+        return jpeg is not None and self.publish(jpeg)
+
+    def publish(self, jpeg: bytes) -> bool:
+        if len(jpeg) > self.slot_bytes:
+            self._too_big += 1
+            if self._too_big == 1:
+                print(f"[Live] Frame of {len(jpeg)} bytes does not fit a {self.slot_bytes}-byte slot; skipped")
+            return False
+        seq = self.seq + 1
+        off = HEADER_SIZE + (seq % self.slots) * (_SLOT.size + self.slot_bytes)
+        mm = self._mm
+        struct.pack_into("<Q", mm, off, 0)  # mark slot as being written
+        mm[off + _SLOT.size:off + _SLOT.size + len(jpeg)] = jpeg
+        now = time.time()
+        _SLOT.pack_into(mm, off, seq, len(jpeg), 0, now)
+        struct.pack_into("<Qd", mm, _LATEST_OFF, seq, now)
+        self.seq = seq
+        return True
+
+    def close(self) -> None:
+        self._mm.close()
+        self._f.close()
+
+
+class LiveReader:
+    """API side: copies the newest JPEG out of a camera's ring; remaps when the worker recreates it."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._f = None
+        self._mm = None
+        self._ino = None
+
+    def _map(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return False
+        if self._mm is not None and st.st_ino == self._ino:
+            return True
+        self.close()
+        if st.st_size < HEADER_SIZE:
+            return False
+        f = open(self.path, "r+b")
+        mm = mmap.mmap(f.fileno(), st.st_size)
+        magic, version, slots, slot_bytes, *_ = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            f.close()
+            return False
+        self._f, self._mm, self._ino = f, mm, st.st_ino
+        self.slots, self.slot_bytes = slots, slot_bytes
+        return True
+
+    def latest(self, after: int = 0, retries: int = 3) -> tuple[int, float, bytes] | None:
+        """
+        (seq, ts, jpeg) of the newest frame if it is newer than `after`, else None. A ring
+        whose latest seq is below `after` was recreated by a restarted worker (sequence back
+        at 1), so its newest frame counts as new.
+        """
+        if not self._map():
+            return None
+        mm = self._mm
+        # Tell the worker someone is watching
+        struct.pack_into("<d", mm, _READER_TS_OFF, time.time())
+        for _ in range(retries):
+            seq = struct.unpack_from("<Q", mm, _LATEST_OFF)[0]
+            if seq == 0 or seq == after:
+                return None
+            off = HEADER_SIZE + (seq % self.slots) * (_SLOT.size + self.slot_bytes)
+            s1, length, _, ts = _SLOT.unpack_from(mm, off)
+            if s1 != seq or length > self.slot_bytes:
+                continue
+            data = mm[off + _SLOT.size:off + _SLOT.size + length]
+            if struct.unpack_from("<Q", mm, off)[0] == seq:
+                return seq, ts, data
+        return None
+
+    def writer_ts(self) -> float:
+        if not self._map():
+            return 0.0
+        return struct.unpack_from("<d", self._mm, _WRITER_TS_OFF)[0]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._f.close()
+        self._f = self._mm = self._ino = None
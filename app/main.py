@@ -1,33 +1,389 @@
 import cv2
 import numpy as np
 from pathlib import Path
+import copy
+import threading
 import time
 import os
-import sys
 import argparse
 import yaml
 from dotenv import load_dotenv
 from datetime import datetime
-from .storage import save_snapshot, log_event_csv
 from .config import load_config, update_config
-from .video import VideoSource, to_gray_blur, detect_motion
-from .face import FaceEngine, build_gallery_for_dir, cosine_dist_to_gallery, l2_dist_to_gallery
-from .notifier import notify_telegram, render_body
+from .video import (
+    VideoSource, ThreadedVideoSource, FileSource, FrameTimeout, EndOfStream, make_motion_engine, merge_rois,
+)
+from .face import cache_signature
+from .notifier import render_body
 from .users import load_users, ENROLL_DIR
-from .face import load_all_user_galleries, best_match_across_users
+from .face import load_all_user_galleries
+from .ann import make_matcher
+from .gallery_sync import SnapshotWatcher, publish_snapshot
 from .engine_runtime import get_face_engine
+from .inference_pool import InferencePool
+from .scheduler import FaceScheduler, DetectionScheduler
+from .tracker import FaceTracker
+from .dispatcher import EventDispatcher, SnapshotSink, EventLogSink, TelegramSink
+from .metrics import metrics, MetricsPublisher
+from .live import LiveWriter, ring_path
+from .clips import ClipRecorder, ClipWriter
+from .retention import Retention, RetentionThread
+from .clusters import UnknownClusters
+
+
+def camera_configs(cfg: dict) -> list[dict]:
+    """
+    Normalize the `cameras:` list (or the legacy single `input:` block) into one dict per camera.
+    Every camera gets an `id`, capture settings, its own `events_dir` and merged `motion` settings.
+    """
+    src_cfg = cfg.get("input", {})
+    events_dir = cfg.get("events", {}).get("dir", "data/events")
+    base = {
+        "source": src_cfg.get("source", "usb"),
+        "camera_index": cfg.get("camera_index", src_cfg.get("camera_index", 0)),
+        "rtsp_url": src_cfg.get("rtsp_url", ""),
+        "path": src_cfg.get("path", ""),
+        "realtime": src_cfg.get("realtime", True),
+        "loop": src_cfg.get("loop", False),
+        "frame_width": cfg.get("frame_width", 640),
+        "frame_height": cfg.get("frame_height", 480),
+        "threaded": src_cfg.get("threaded", True),
+        "buffer_size": src_cfg.get("buffer_size", 4),
+        "read_mode": src_cfg.get("read_mode", "latest"),
+        "reconnect_delay_sec": src_cfg.get("reconnect_delay_sec", 1.0),
+    }
+
+    cams = cfg.get("cameras") or []
+    if not cams:
+        # Single camera: keep writing straight into events.dir like before
+        cams = [{"id": "cam0", "events_dir": events_dir}]
+
+    out = []
+    for i, c in enumerate(cams):
+        cam = {**base, "rtsp_url": "", "path": "", **c} if cfg.get("cameras") else {**base, **c}
+        cam.setdefault("id", f"cam{i}")
+        cam["id"] = str(cam["id"])
+        cam.setdefault("events_dir", str(Path(events_dir) / cam["id"]))
+        cam["motion"] = update_config(copy.deepcopy(cfg.get("motion", {})), c.get("motion", {}))
+        out.append(cam)
+
+    ids = [c["id"] for c in out]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Camera ids must be unique: {ids}")
+    return out
+
+
+def open_camera(cam_cfg: dict) -> VideoSource:
+    if cam_cfg.get("source") == "file":
+        # Recorded clip or image folder (offline runs and benchmarks)
+        return FileSource(
+            cam_cfg["path"],
+            realtime=cam_cfg.get("realtime", True),
+            fps=cam_cfg.get("fps"),
+            loop=cam_cfg.get("loop", False),
+        )
+    use_rtsp = cam_cfg.get("source", "usb") == "rtsp"
+    rtsp_url = cam_cfg.get("rtsp_url", "") if use_rtsp else None
+    cam_args = (
+        cam_cfg.get("camera_index", 0),
+        cam_cfg.get("frame_width", 640),
+        cam_cfg.get("frame_height", 480),
+    )
+    if cam_cfg.get("threaded", True):
+        # Decode on a background thread so slow face inference never backs up the stream
+        return ThreadedVideoSource(
+            *cam_args,
+            rtsp_url=rtsp_url,
+            buffer_size=int(cam_cfg.get("buffer_size", 4)),
+            mode=cam_cfg.get("read_mode", "latest"),
+            reconnect_delay=float(cam_cfg.get("reconnect_delay_sec", 1.0)),
+        )
+    return VideoSource(*cam_args, rtsp_url=rtsp_url)
+
+
+class CameraPipeline:
+    """
+    Per-camera capture + motion stage. Face work is handed to the shared FaceScheduler;
+    results come back here for matching, overlays and events.
+    Each camera keeps its own motion state, cooldown and event directory.
+    """
+
+    def __init__(self, cam_cfg: dict, cam: VideoSource, scheduler: FaceScheduler | None, ctx: dict) -> None:
+        self.id = cam_cfg["id"]
+        self.cam = cam
+        self.scheduler = scheduler
+        self.ctx = ctx  # shared worker settings + galleries (swapped wholesale on refresh)
+        self.events_dir = cam_cfg["events_dir"]
+
+        motion_cfg = cam_cfg.get("motion", {})
+        self.motion_enabled = motion_cfg.get("enabled", True)
+        self.motion = make_motion_engine(motion_cfg)
+        self.visualize = motion_cfg.get("visualize", True)
+
+        self.detect_sched = DetectionScheduler(ctx.get("detect_cfg"), cameras=ctx.get("n_cameras", 1))
+        track_cfg = ctx.get("track_cfg") or {}
+        self.tracker = FaceTracker(track_cfg) if track_cfg.get("enabled", True) else None
+        self.frame_idx = 0
+        self.last_faces = []      # [(label, dist, bbox)] from the latest finished face pass
+        self.last_event_t = 0.0   # monotonic seconds of last logged UNKNOWN (used without tracking)
+        self.preview = None       # latest annotated frame for the preview window
+        self.error: Exception | None = None
+        self.finished = False     # replayed clip ran out
+
+        live_cfg = ctx.get("live_cfg") or {}
+        self.live = None          # live view ring read by the API
+        if live_cfg.get("enabled", False):
+            self.live = LiveWriter(
+                ring_path(live_cfg.get("dir", "data/live"), self.id),
+                slot_bytes=int(live_cfg.get("slot_kb", 1024)) * 1024,
+                fps=float(live_cfg.get("fps", 10)),
+                quality=int(live_cfg.get("quality", 70)),
+                max_width=int(live_cfg.get("max_width", 960)),
+                idle_sec=float(live_cfg.get("idle_sec", 5)),
+            )
+
+        clips_cfg = ctx.get("clips_cfg") or {}
+        self.clips = None         # pre-roll + event clip recording
+        if ctx.get("clip_writer") is not None:
+            self.clips = ClipRecorder(
+                ctx["clip_writer"],
+                camera=self.id,
+                pre_sec=float(clips_cfg.get("pre_sec", 5)),
+                post_sec=float(clips_cfg.get("post_sec", 5)),
+                max_sec=float(clips_cfg.get("max_sec", 20)),
+                fps=float(clips_cfg.get("fps", 5)),
+                max_width=int(clips_cfg.get("max_width", 640)),
+                quality=int(clips_cfg.get("quality", 70)),
+                max_bytes=int(float(clips_cfg.get("buffer_mb", 4)) * (1 << 20)),
+                clip_max_bytes=int(float(clips_cfg.get("clip_mb", 16)) * (1 << 20)),
+            )
+
+    def step(self) -> None:
+        ctx = self.ctx
+        try:
+            with metrics.timer("stage_seconds", stage="capture", camera=self.id):
+                frame = self.cam.read()
+        except FrameTimeout as e:
+            print(f"[{self.id}] {e}")
+            metrics.inc("capture_timeouts_total", camera=self.id)
+            return
+        self.frame_idx += 1
+        metrics.inc("frames_total", camera=self.id)
+        if self.clips is not None:
+            self.clips.push(frame)
+
+        # --- MOTION DETECTION ---
+        if self.motion_enabled:
+            with metrics.timer("stage_seconds", stage="motion", camera=self.id):
+                motion, rois, mask = self.motion.apply(frame)
+        else:
+            motion, rois, mask = False, [], None
+        bbox = rois[0] if rois else None
+
+        # --- FACE DETECTION (runs on the shared engine, results arrive asynchronously) ---
+        # Apply the previous pass first so the tracker is current before the next one is associated
+        if self.scheduler is not None:
+            job = self.scheduler.poll(self.id)
+            if job is not None:
+                self.detect_sched.observe_latency(job["latency"])
+                self.handle_faces(job["frame"], job["faces"], job["t_start"])
+                self.detect_sched.observe_result(self.last_faces)
+        submitted = False
+        now = time.monotonic()
+        self.detect_sched.observe_motion(now, motion, bbox)
+        if self.scheduler is not None and not self.scheduler.busy(self.id):
+            frame_area = frame.shape[0] * frame.shape[1]
+            if self.detect_sched.should_detect(now, self.frame_idx, motion, bbox, frame_area):
+                self.scheduler.submit(
+                    self.id, frame, self.frame_idx, rois=self.face_rois(rois, frame.shape), tracker=self.tracker
+                )
+                submitted = True
+        if not motion and (self.tracker is None or not self.tracker.active(time.monotonic())):
+            self.last_faces = []
+
+        live_due = self.live is not None and self.live.due()
+        if ctx["show_window"] or live_due:
+            # The submitted frame now belongs to the scheduler; draw on a copy
+            view = frame.copy() if submitted else frame
+            if self.visualize:
+                draw_faces(view, self.last_faces)
+            if ctx["show_window"]:
+                self.preview = view
+            if live_due:
+                # Encoded once here; every API client streams these same bytes
+                with metrics.timer("stage_seconds", stage="live_encode", camera=self.id):
+                    self.live.publish_frame(view)
+
+    def face_rois(self, rois, frame_shape):
+        """Padded/merged motion regions to run the detector on, or None for the whole frame."""
+        roi_cfg = self.ctx.get("roi_cfg") or {}
+        if not roi_cfg.get("enabled", False) or not rois:
+            return None
+        regions = merge_rois(
+            rois,
+            frame_shape,
+            pad=float(roi_cfg.get("pad", 0.25)),
+            min_side=int(roi_cfg.get("min_side", 160)),
+        )
+        covered = sum(w * h for _, _, w, h in regions)
+        if covered >= float(roi_cfg.get("max_frac", 0.6)) * frame_shape[0] * frame_shape[1]:
+            # Crops would cost about as much as the full frame
+            return None
+        return regions[:int(roi_cfg.get("max_regions", 4))]
+
+    def handle_faces(self, frame: np.ndarray, faces: list[dict], t_pass: float) -> None:
+        ctx = self.ctx
+        id_to_name = ctx["id_to_name"]
+
+        # best match across all users, every embedded face of the pass in one search
+        # (faces without an embedding were identified on an earlier pass; the tracker fills them in)
+        embedded = [f for f in faces if f.get("embedding") is not None]
+        if embedded:
+            with metrics.timer("stage_seconds", stage="match", camera=self.id):
+                uids, dists = ctx["galleries"].search(
+                    np.stack([f["embedding"] for f in embedded]), k=1, metric=ctx["match_metric"]
+                )
+            for i, f in enumerate(embedded):
+                uid = uids[i][0] if uids[i] else None
+                f["dist"] = float(dists[i, 0])
+                if uid is not None and f["dist"] <= ctx["max_distance"]:
+                    f["label"], f["uid"] = id_to_name.get(uid, uid), uid
+                else:
+                    f["label"], f["uid"] = "UNKNOWN", None
+                metrics.inc("faces_matched_total", camera=self.id, result="known" if f["uid"] else "unknown")
+
+        if self.tracker is not None:
+            self.tracker.update(faces, t_pass)
+        else:
+            faces = embedded
+            for f in faces:
+                f["alert"] = f["label"] == "UNKNOWN"
+
+        labeled_faces = [(f["label"], f["dist"], f["bbox"]) for f in faces]
+        unknown_candidates = [(f["dist"], f["bbox"], f) for f in faces if f.get("alert")]
+        self.last_faces = labeled_faces
+
+        # After reviewing all faces, decide whether to log one UNKNOWN: with clustering once per
+        # stranger per cluster cooldown; else once per new track when tracking, otherwise at
+        # most once per cooldown window
+        now_mono = time.monotonic()
+        if self.tracker is not None and unknown_candidates:
+            # Every new stranger in this pass is covered by the event, or suppressed with its cluster
+            self.tracker.mark_alerted({f["track_id"] for _, _, f in unknown_candidates})
+        if ctx.get("clusters") is not None:
+            unknown_candidates = self.cluster_candidates(ctx["clusters"], unknown_candidates)
+            due = bool(unknown_candidates)
+        elif self.tracker is not None:
+            due = bool(unknown_candidates)
+        else:
+            due = bool(unknown_candidates) and (now_mono - self.last_event_t >= ctx["cooldown_sec"])
+        if due:
+            # Pick the closest UNKNOWN
+            unknown_candidates.sort(key=lambda t: t[0])
+            best_dist, best_bbox, best = unknown_candidates[0]
+
+            draw_faces(frame, labeled_faces)
+
+            # Snapshot, event log and Telegram run on the dispatcher's threads
+            event = {
+                "frame": frame,
+                "events_dir": self.events_dir,
+                "label": "unknown",
+                "csv_path": ctx["csv_path"],
+                "mirror_csv": ctx["mirror_csv"],
+                "row": {
+                    "timestamp": datetime.now().isoformat(timespec="seconds"),
+                    "camera": self.id,
+                    "label": "UNKNOWN",
+                    "distance": best_dist,
+                    "bbox": best_bbox,
+                    "cluster_id": best.get("cluster_id"),
+                },
+            }
+            # Kept with the event for "find this person" searches (app/event_embeddings.py);
+            # the first row is the face of `bbox`
+            embs = [self.face_embedding(f) for _, _, f in unknown_candidates]
+            if embs[0] is not None:
+                event["embeddings"] = np.stack([e for e in embs if e is not None])
+            if self.clips is not None:
+                # Written a few seconds from now, once the post-roll is in
+                event["row"]["clip_path"] = self.clips.trigger(self.events_dir)
+            if ctx["send_telegram"]:
+                event["caption"] = render_body(ctx["telegram_cfg"].get("body_template", "Unknown face at {time}"))
+            queued = ctx["dispatcher"].submit(event)
+
+            print(f"[EVENT] UNKNOWN on {self.id}, d={best_dist:.3f}, queued={queued}")
+            self.last_event_t = now_mono
+
+    def face_embedding(self, f: dict) -> np.ndarray | None:
+        """This pass's embedding of a face, or its track's when it was not re-embedded."""
+        if f.get("embedding") is not None:
+            return f["embedding"]
+        if self.tracker is not None and f.get("track_id") is not None:
+            return self.tracker.embedding_of(f["track_id"])
+        return None
+
+    def cluster_candidates(self, clusters, candidates: list) -> list:
+        """Put each UNKNOWN candidate in its cluster; keep those whose cluster may alert now."""
+        due = []
+        for cand in candidates:
+            f = cand[2]
+            emb = self.face_embedding(f)
+            if emb is None:
+                due.append(cand)
+                continue
+            f["cluster_id"] = clusters.assign(emb)
+            if clusters.claim(f["cluster_id"]):
+                due.append(cand)
+            else:
+                metrics.inc("alerts_suppressed_total", camera=self.id)
+        return due
+
+    def finish(self, timeout: float = 30.0) -> None:
+        """Apply the face pass still in flight (end of a replayed clip)."""
+        deadline = time.monotonic() + timeout
+        while self.scheduler is not None and self.scheduler.busy(self.id) and time.monotonic() < deadline:
+            job = self.scheduler.poll(self.id)
+            if job is not None:
+                self.handle_faces(job["frame"], job["faces"], job["t_start"])
+            else:
+                time.sleep(0.01)
+        if self.clips is not None:
+            self.clips.flush()
+        self.finished = True
+
+    def run_forever(self, stop: threading.Event) -> None:
+        try:
+            while not stop.is_set():
+                self.step()
+        except EndOfStream as e:
+            print(f"[{self.id}] {e}")
+            self.finish()
+        except Exception as e:
+            print(f"[{self.id}] Camera loop failed: {e}")
+            self.error = e
+            stop.set()
 
-def run():
 
-    last_refresh = time.monotonic()
-    refresh_every = 300.0
+def draw_faces(frame, labeled_faces) -> None:
+    for label, dist, (fx, fy, fw, fh) in labeled_faces:
+        color = (0, 255, 0) if label != "UNKNOWN" else (0, 0, 255)
+        cv2.rectangle(frame, (fx, fy), (fx+fw, fy+fh), color, 2)
+        cv2.putText(frame, f"{label}", (fx, fy + fh + 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+
+def run(cfg: dict | None = None):
+    """Worker main loop. `cfg` replaces config.yaml (used by the benchmark harness)."""
 
     parser = argparse.ArgumentParser(add_help=False)
     parser.add_argument("--demo", action="store_true")
     args, _ = parser.parse_known_args()
 
     load_dotenv()
-    cfg = load_config()
+    from_file = cfg is None
+    if from_file:
+        cfg = load_config()
 
     ### TEST ###
     print("[diag] config loaded:", cfg)
@@ -35,7 +391,7 @@ def run():
     print("[diag] face:", cfg.get("face"))
     print("[diag] notify:", cfg.get("notify"))
 
-    if args.demo:
+    if args.demo and from_file:
         try:
             with open("demo.yaml", "r") as f:
                 demo_cfg = yaml.safe_load(f) or {}
@@ -44,179 +400,262 @@ def run():
         except Exception as e:
             print(f"[DEMO] Could not load demo.yaml: {e}")
 
-    src_cfg = cfg.get("input", {})
-    use_rtsp = src_cfg.get("source", "usb") == "rtsp"
-    rtsp_url = src_cfg.get("rtsp_url", "") if use_rtsp else None
-
-    cam = VideoSource(
-        cfg.get("camera_index", src_cfg.get("camera_index", 0)),
-        cfg.get("frame_width", 640),
-        cfg.get("frame_height", 480),
-        rtsp_url=rtsp_url
-        )
-    
+    cam_cfgs = camera_configs(cfg)
+
     ### TEST ###
-    print("[diag] opening camera...")
-    ok, frame = cam.grab() if hasattr(cam, "grab") else (False, None)
-    print("[diag] camera probe:", ok)
-    
+    print("[diag] opening cameras:", [c["id"] for c in cam_cfgs])
+    cams = {}
+    try:
+        for c in cam_cfgs:
+            cams[c["id"]] = open_camera(c)
+    except Exception:
+        for cam in cams.values():
+            cam.release()
+        raise
+
     notify_cfg = cfg.get("notify", {})
-    
+
     telegram_cfg = notify_cfg.get("telegram", {})
     send_telegram = telegram_cfg.get("enabled")
     bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
     chat_id = os.getenv("TELEGRAM_CHAT_ID")
 
     ### TEST ###
-    try:
-        import requests
-        r = requests.get(
-            f"https://api.telegram.org/bot{bot_token}/sendMessage",
-            params={"chat_id": chat_id, "text": "✅ Startup OK: worker is live"}
-        )
-        print("[diag] telegram status:", r.status_code, r.text[:200])
-    except Exception as e:
-        print("[diag] telegram FAILED:", e)
-    
+    if send_telegram:
+        try:
+            import requests
+            r = requests.get(
+                f"https://api.telegram.org/bot{bot_token}/sendMessage",
+                params={"chat_id": chat_id, "text": "✅ Startup OK: worker is live"}
+            )
+            print("[diag] telegram status:", r.status_code, r.text[:200])
+        except Exception as e:
+            print("[diag] telegram FAILED:", e)
+
     events_cfg = cfg.get("events", {})
-    events_dir = events_cfg.get("dir", "data/events")
     csv_path = events_cfg.get("csv_path", "data/events/events.csv")
     cooldown_sec = float(events_cfg.get("cooldown_sec", 5))
 
-    last_event_t = 0.0  # monotonic seconds of last logged UNKNOWN
-
-    prev_gray = None
-    motion_cfg = cfg.get("motion", {})
-    motion_enabled = motion_cfg.get("enabled", True)
-    thr = motion_cfg.get("threshold", 25)
-    min_area = motion_cfg.get("min_area", 1200)
-    visualize = motion_cfg.get("visualize", True)
-
     face_cfg = cfg.get("face", {})
     face_enabled = face_cfg.get("enabled", True)
+    min_face_size = face_cfg.get("min_face_size", 80)
     engine = None
-    if face_enabled:
+    pool_cfg = face_cfg.get("pool", {})
+    if face_enabled and int(pool_cfg.get("size", 0)) > 0:
+        # Face analysis in worker processes; frames are handed over through shared memory
+        engine = InferencePool(
+            size=int(pool_cfg["size"]),
+            intra_op_threads=int(pool_cfg.get("intra_op_threads", 1)),
+            timeout=float(pool_cfg.get("timeout_sec", 30)),
+        )
+        print(f"[diag] inference pool: {engine.size} processes x {engine.intra_op_threads} threads")
+    elif face_enabled:
         engine = get_face_engine()
 
     users = load_users()
-    galleries = load_all_user_galleries(users, engine, ENROLL_DIR, min_face_size=face_cfg.get("min_face_size", 80))
+    matcher_cfg = face_cfg.get("matcher", {})
+    user_galleries = load_all_user_galleries(users, engine, ENROLL_DIR, min_face_size=min_face_size)
+    galleries = make_matcher(user_galleries, matcher_cfg)
     id_to_name = {u["id"]: u["name"] for u in users}
-    
+    # Start from the enrollment folders, then follow the gallery generations the API publishes
+    gallery_snapshots = SnapshotWatcher()
+    try:
+        gallery_snapshots.seen(
+            publish_snapshot(user_galleries, id_to_name, cache_signature(engine, min_face_size))
+        )
+    except OSError as e:
+        print(f"[Face] Could not write the gallery snapshot: {e}")
+
+    sinks = [SnapshotSink(), EventLogSink()]
+    if send_telegram:
+        sinks.append(TelegramSink(
+            bot_token,
+            chat_id,
+            telegram_cfg.get("outbox_dir", "data/outbox/telegram"),
+            retries=int(telegram_cfg.get("retries", 2)),
+            flush_every=float(telegram_cfg.get("outbox_flush_sec", 60)),
+        ))
+    dispatcher = EventDispatcher(
+        sinks,
+        max_queue=int(events_cfg.get("queue_size", 64)),
+        workers=int(events_cfg.get("dispatch_workers", 1)),
+    ).start()
+
+    clips_cfg = cfg.get("clips", {})
+    clip_writer = None
+    if clips_cfg.get("enabled", False):
+        clip_writer = ClipWriter(
+            fourcc=str(clips_cfg.get("fourcc", "mp4v")),
+            max_queue=int(clips_cfg.get("writer_queue", 4)),
+        ).start()
+
+    # Age / size limits for stored events, applied a bounded batch at a time
+    retention_cfg = cfg.get("retention", {})
+    retention = None
+    if retention_cfg.get("enabled", False):
+        retention = RetentionThread(
+            Retention(csv_path, retention_cfg, mirror_csv=bool(events_cfg.get("mirror_csv", False))),
+            interval_sec=float(retention_cfg.get("interval_sec", 300)),
+        ).start()
+
+    # Strangers seen again within cluster cooldown_sec don't alert again (instead of one global cooldown)
+    cluster_cfg = face_cfg.get("clustering", {})
+    clusters = None
+    if face_enabled and engine is not None and cluster_cfg.get("enabled", False):
+        clusters = UnknownClusters(
+            cluster_cfg.get("dir", "data/clusters"),
+            join_sim=float(cluster_cfg.get("join_sim", 0.5)),
+            max_clusters=int(cluster_cfg.get("max_clusters", 500)),
+            cooldown_sec=float(cluster_cfg.get("cooldown_sec", 600)),
+            max_weight=int(cluster_cfg.get("max_weight", 50)),
+            model_tag=engine.model_tag,
+        )
+        print(f"[Clusters] {len(clusters)} unknown-face clusters loaded")
+        metrics.gauge_fn("unknown_clusters", lambda: len(clusters))
+    cluster_save_every = float(cluster_cfg.get("save_sec", 30))
+    last_cluster_save = time.monotonic()
+
+    # Shared by every camera pipeline; galleries are swapped as a whole on refresh
+    ctx = {
+        "show_window": cfg.get("show_window", True),
+        "csv_path": csv_path,
+        "mirror_csv": bool(events_cfg.get("mirror_csv", False)),
+        "cooldown_sec": cooldown_sec,
+        "match_metric": face_cfg.get("match_metric", "cosine").lower(),
+        "max_distance": float(face_cfg.get("max_distance", 0.45)),
+        "send_telegram": send_telegram,
+        "telegram_cfg": telegram_cfg,
+        "dispatcher": dispatcher,
+        "detect_cfg": face_cfg.get("schedule", {}),
+        "roi_cfg": face_cfg.get("roi", {}),
+        "track_cfg": face_cfg.get("tracking", {}),
+        "live_cfg": cfg.get("live", {}),
+        "clips_cfg": clips_cfg,
+        "clip_writer": clip_writer,
+        "clusters": clusters,
+        "n_cameras": len(cam_cfgs),
+        "galleries": galleries,   # matcher (GalleryIndex / IVFIndex)
+        "id_to_name": id_to_name,
+    }
+
+    # One engine for all cameras, shared fairly
+    scheduler = None
     if face_enabled and engine is not None:
-        enroll_dir = face_cfg.get("enroll_dir")
-        gallery_cache = Path(enroll_dir) / "gallery.npy"
-        if gallery_cache.exists():
-            gallery = np.load(gallery_cache)
-            print(f"[Face] Loaded cached gallery with {gallery.shape[0]} embeddings from {gallery_cache}")
-        else:
-            gallery = build_gallery_for_dir(Path(enroll_dir), engine, min_face_size=face_cfg.get("min_face_size", 80))
-            print(f"[Face] Built new gallery with {gallery.shape[0]} embeddings from {enroll_dir}")
-            np.save(gallery_cache, gallery)
-
-    # Face recognition labels
-    match_metric = face_cfg.get("match_metric", "cosine").lower()
-    max_distance = float(face_cfg.get("max_distance", 0.45))
-
-    frame_idx = 0
-    last_faces = []
+        scheduler = FaceScheduler(
+            engine,
+            min_face_size=min_face_size,
+            batch_frames=int(face_cfg.get("batch_frames", 4)),
+        )
+        for c in cam_cfgs:
+            scheduler.register(c["id"])
+        scheduler.start()
+
+    pipelines = [CameraPipeline(c, cams[c["id"]], scheduler, ctx) for c in cam_cfgs]
+
+    # Stage timings and counters, published for the API's /metrics endpoint
+    for p in pipelines:
+        metrics.gauge_fn("camera_fps", lambda cid=p.id: metrics.rate("stage_seconds", stage="capture", camera=cid),
+                         camera=p.id)
+        if hasattr(p.cam, "stats"):
+            metrics.counter_fn("frames_dropped_total", lambda c=p.cam: c.stats()["dropped"], camera=p.id)
+            metrics.counter_fn("capture_reconnects_total", lambda c=p.cam: c.stats()["reconnects"], camera=p.id)
+    if scheduler is not None:
+        metrics.gauge_fn("face_queue_depth", scheduler.pending)
+    metrics_cfg = cfg.get("metrics", {})
+    publisher = None
+    if metrics_cfg.get("enabled", True):
+        publisher = MetricsPublisher(
+            metrics_cfg.get("path", "data/metrics/worker.json"),
+            every=float(metrics_cfg.get("publish_sec", 5)),
+        ).start()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=p.run_forever, args=(stop,), name=f"camera-{p.id}", daemon=True)
+        for p in pipelines
+    ]
+    for t in threads:
+        t.start()
+
+    last_diag = time.monotonic()
+    diag_every = float(cfg.get("diag_every_sec", 60))
 
     try:
-        while True:
-            if time.monotonic() - last_refresh > refresh_every:
-                users = load_users()
-                galleries = load_all_user_galleries(users, engine, ENROLL_DIR, min_face_size=face_cfg.get("min_face_size", 80))
-                id_to_name = {u["id"]: u["name"] for u in users}
-                last_refresh = time.monotonic()
-
-            frame = cam.read()
-            frame_idx += 1
-            gray = to_gray_blur(frame)
-
-            if prev_gray is None:
-                prev_gray = gray
-                if cfg.get("show_window", True):
-                    cv2.imshow("SecurityCam (Preview)", frame)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        break
-                continue
-
-            # --- MOTION DETECTION ---
-            if motion_enabled:
-                motion, bbox, mask = detect_motion(prev_gray, gray, thr, min_area)
-            else:
-                motion, bbox, mask = False, None, None
-
-            # --- FACE DETECTION (first pass: just draw boxes) ---
-            if motion and face_enabled and engine is not None and frame_idx % 3 == 0:
-                last_faces = engine.detect_and_embed(frame, min_face_size=face_cfg.get("min_face_size", 80))
-            if not motion:
-                last_faces = []
-            faces = last_faces
-
-            unknown_candidates = []
-            labeled_faces = []
-
-            # Draw overlays if you want to see it
-            if visualize and cfg.get("show_window", True):
-
-                # Face boxes (blue)
-                for f in faces:
-                    fx, fy, fw, fh = f["bbox"]
-                    emb = f["embedding"]
-
-                    # best match across all users
-                    uid, dist = best_match_across_users(emb, galleries, metric=match_metric)
-                    if uid is not None and dist <= max_distance:
-                        label = id_to_name.get(uid, uid)
-                    else:
-                        label = "UNKNOWN"
-
-                    labeled_faces.append((label, dist, (fx, fy, fw, fh)))
-
-                    if label == "UNKNOWN":
-                        unknown_candidates.append((dist, (fx, fy, fw, fh), emb))
-
-                    for label, dist, (fx, fy, fw, fh) in labeled_faces:
-                        color = (0, 255, 0) if label != "UNKNOWN" else (0, 0, 255)
-                        cv2.rectangle(frame, (fx, fy), (fx+fw, fy+fh), color, 2)
-                        cv2.putText(frame, f"{label}", (fx, fy + fh + 20),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-
-                # After reviewing all faces, decide whether to log one UNKNOWN
-                now_mono = time.monotonic()
-                if unknown_candidates and (now_mono - last_event_t >= cooldown_sec):
-                    # Pick the closest UNKNOWN
-                    unknown_candidates.sort(key=lambda t: t[0])
-                    best_dist, best_bbox, _ = unknown_candidates[0]
-
-                    image_path = save_snapshot(frame, events_dir, label="unknown")
-
-                    # Write CSV row
-                    log_event_csv(csv_path, {
-                        "timestamp": datetime.now().isoformat(timespec="seconds"),
-                        "label": "UNKNOWN",
-                        "distance": best_dist,
-                        "bbox": best_bbox,
-                        "image_path": image_path,
-                    })
-
-                    # Telegram notification
-                    if send_telegram:
-                        msg_text  = render_body(telegram_cfg.get("body_template", "Unknown face at {time}"))
-                        notify_telegram(bot_token, chat_id, image_path, msg_text)
-
-                    print(f"[EVENT] UNKNOWN logged, d={best_dist:.3f}, saved={bool(image_path)}")
-                    last_event_t = now_mono
-                
-                cv2.imshow("SecurityCam (Preview)", frame)
-
+        while not stop.is_set():
+            if all(p.finished for p in pipelines):
+                break  # every replayed clip has ended
+            if diag_every > 0 and time.monotonic() - last_diag > diag_every:
+                for p in pipelines:
+                    if hasattr(p.cam, "stats"):
+                        print(f"[diag] capture stats {p.id}:", p.cam.stats())
+                    print(f"[diag] detection schedule {p.id}:", p.detect_sched.stats())
+                    if p.tracker is not None:
+                        print(f"[diag] tracker {p.id}:", p.tracker.stats)
+                print("[diag] stage latency (p50 ms, p95 ms, per sec):", metrics.summary())
+                last_diag = time.monotonic()
+
+            if clusters is not None and time.monotonic() - last_cluster_save > cluster_save_every:
+                clusters.save()
+                last_cluster_save = time.monotonic()
+
+            # New gallery generation from the API: one stat() per loop while nothing changed
+            update = gallery_snapshots.poll()
+            if update is not None:
+                manifest, snapshot = update
+                model_tag = (manifest.get("signature") or "").split("|")[0]
+                if engine is not None and model_tag and model_tag != engine.model_tag:
+                    # Embedded by another profile: distances to our embeddings would be meaningless
+                    print(f"[Face] Ignoring gallery generation {manifest['generation']}: embedded with "
+                          f"{model_tag}, this worker runs {engine.model_tag} (set the same FACE_PROFILE for both)")
+                else:
+                    # Built aside and swapped in one assignment; cameras match against the old one meanwhile
+                    ctx["galleries"] = make_matcher(snapshot, matcher_cfg)
+                    ctx["id_to_name"] = {u["id"]: u["name"] for u in manifest["users"]}
+                    print(f"[Face] Gallery generation {manifest['generation']}: "
+                          f"{len(manifest['users'])} users, {manifest['rows']} embeddings")
+
+            if ctx["show_window"]:
+                for p in pipelines:
+                    if p.preview is not None:
+                        cv2.imshow(f"SecurityCam (Preview) - {p.id}", p.preview)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
-
-            # IMPORTANT: update the previous frame for next iteration
-            prev_gray = gray
+            else:
+                stop.wait(0.5)
 
     finally:
-        cam.release()
-        cv2.destroyAllWindows()
+        stop.set()
+        for t in threads:
+            t.join(timeout=5.0)
+        if scheduler is not None:
+            scheduler.stop()
+        if hasattr(engine, "close"):
+            engine.close()
+        # Let queued snapshots / log rows / alerts finish
+        dispatcher.close(timeout=float(events_cfg.get("drain_timeout_sec", 30)))
+        if clip_writer is not None:
+            for p in pipelines:
+                if p.clips is not None:
+                    p.clips.flush()
+            clip_writer.close(timeout=float(events_cfg.get("drain_timeout_sec", 30)))
+        if retention is not None:
+            retention.close()
+        if clusters is not None:
+            try:
+                clusters.save()
+            except OSError as e:
+                print(f"[Clusters] Could not save: {e}")
+        if publisher is not None:
+            publisher.close()
+        for cam_id, cam in cams.items():
+            if hasattr(cam, "stats"):
+                print(f"[diag] capture stats {cam_id}:", cam.stats())
+            cam.release()
+        for p in pipelines:
+            if p.live is not None:
+                p.live.close()
+        if ctx["show_window"]:
+            cv2.destroyAllWindows()
+
+    failed = [p for p in pipelines if p.error is not None]
+    if failed:
+        raise RuntimeError(f"Camera {failed[0].id} stopped: {failed[0].error}")
@@ -0,0 +1,261 @@
+from __future__ import annotations
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# Stage timings, counters and gauges for the worker, exposed in Prometheus text format.
+# The worker and the API are separate processes (containers), so the worker publishes a
+# JSON snapshot to a shared file and the API's /metrics renders it.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "securitycam_"
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """Cumulative buckets (for Prometheus) plus a rolling window for recent quantiles and rate."""
+
+    def __init__(self, window: float = 60.0, max_samples: int = 4096) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.window = window
+        self.recent: deque = deque(maxlen=max_samples)  # (monotonic t, value)
+
+    def observe(self, value: float, now: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append((now, value))
+
+    def _trim(self, now: float) -> None:
+        while self.recent and now - self.recent[0][0] > self.window:
+            self.recent.popleft()
+
+    def rate(self, now: float) -> float:
+        self._trim(now)
+        if len(self.recent) < 2:
+            return 0.0
+        span = max(now - self.recent[0][0], 1e-6)
+        return len(self.recent) / span
+
+    def snapshot(self, now: float) -> dict:
+        self._trim(now)
+        vals = sorted(v for _, v in self.recent)
+        q = {}
+        for p in (0.5, 0.95, 0.99):
+            q[str(p)] = vals[min(len(vals) - 1, int(p * len(vals)))] if vals else 0.0
+        cumulative, total = [], 0
+        for c in self.counts:
+            total += c
+            cumulative.append(total)
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count,
+                "quantiles": q, "rate": self.rate(now)}
+
+
+class Registry:
+    """
+    Thread-safe metrics store.
+    - observe()/timer(): per-stage latency histograms (seconds)
+    - inc(): monotonically increasing counters
+    - set()/gauge_fn(): current values
+    - gauge_fn()/counter_fn() callbacks are read at snapshot time
+    """
+
+    def __init__(self, window: float = 60.0) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        self._hists: dict[tuple, Histogram] = {}
+        self._counters: dict[tuple, float] = {}
+        self._gauges: dict[tuple, float] = {}
+        self._gauge_fns: dict[tuple, callable] = {}
+        self._counter_fns: dict[tuple, callable] = {}
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        k = _key(name, labels)
+        now = time.monotonic()
+        with self._lock:
+            h = self._hists.get(k)
+            if h is None:
+                h = self._hists[k] = Histogram(self.window)
+            h.observe(float(value), now)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        k = _key(name, labels)
+        with self._lock:
+            self._counters[k] = self._counters.get(k, 0) + n
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = float(value)
+
+    def gauge_fn(self, name: str, fn, **labels) -> None:
+        with self._lock:
+            self._gauge_fns[_key(name, labels)] = fn
+
+    def counter_fn(self, name: str, fn, **labels) -> None:
+        """Counter kept elsewhere (e.g. a capture thread's dropped-frame count), read at snapshot time."""
+        with self._lock:
+            self._counter_fns[_key(name, labels)] = fn
+
+    def rate(self, name: str, **labels) -> float:
+        """Recent observations per second of a histogram (e.g. frames per second for capture)."""
+        with self._lock:
+            h = self._hists.get(_key(name, labels))
+            return h.rate(time.monotonic()) if h is not None else 0.0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            gauges = dict(self._gauges)
+            counters = dict(self._counters)
+            fns = [(gauges, k, fn) for k, fn in self._gauge_fns.items()]
+            fns += [(counters, k, fn) for k, fn in self._counter_fns.items()]
+            hists = [(k, h.snapshot(now)) for k, h in self._hists.items()]
+        for target, k, fn in fns:
+            try:
+                target[k] = float(fn())
+            except Exception:
+                pass
+        return {
+            "ts": time.time(),
+            "histograms": [{"name": n, "labels": dict(l), **s} for (n, l), s in hists],
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in counters.items()],
+            "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in gauges.items()],
+        }
+
+    def summary(self, name: str = "stage_seconds") -> dict:
+        """{label values: (p50 ms, p95 ms, per sec)} for the [diag] log line."""
+        out = {}
+        for h in self.snapshot()["histograms"]:
+            if h["name"] == name:
+                labels = dict(h["labels"])
+                tag = "/".join([labels.pop("stage", "")] + list(labels.values()))
+                out[tag] = (round(h["quantiles"]["0.5"] * 1000, 1), round(h["quantiles"]["0.95"] * 1000, 1),
+                            round(h["rate"], 2))
+        return out
+
+
+# Process-wide registry, like the Prometheus client's default one
+metrics = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict, extra: dict | None = None) -> str:
+    items = {**labels, **(extra or {})}
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items.items()) + "}"
+
+
+def _value(v) -> str:
+    """A sample value at full precision (`:g` would turn 1234567 into 1.23457e+06)."""
+    v = float(v)
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return str(int(v)) if v.is_integer() and abs(v) < 2 ** 53 else repr(v)
+
+
+def render_prometheus(snap: dict, extra_labels: dict | None = None) -> str:
+    """Prometheus text exposition (version 0.0.4) of a Registry snapshot."""
+    lines: list[str] = []
+    typed: set[str] = set()
+
+    def header(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    extra = extra_labels or {}
+    # Samples of one metric family must be contiguous
+    hists = sorted(snap.get("histograms", []), key=lambda m: m["name"])
+    for h in hists:
+        name = PREFIX + h["name"]
+        header(name, "histogram")
+        labels = {**h["labels"], **extra}
+        for le, c in zip(list(BUCKETS) + ["+Inf"], h["buckets"]):
+            lines.append(f"{name}_bucket{_labels(labels, {'le': le})} {c}")
+        lines.append(f"{name}_sum{_labels(labels)} {h['sum']:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {h['count']}")
+    # Rolling-window view: quantiles and rate over the last `window` seconds
+    for h in hists:
+        name = PREFIX + h["name"] + "_recent"
+        header(name, "gauge")
+        for q, v in h["quantiles"].items():
+            lines.append(f"{name}{_labels({**h['labels'], **extra}, {'quantile': q})} {v:.6f}")
+    for h in hists:
+        name = PREFIX + h["name"] + "_recent_per_second"
+        header(name, "gauge")
+        lines.append(f"{name}{_labels({**h['labels'], **extra})} {h['rate']:.3f}")
+    for kind, key in (("counter", "counters"), ("gauge", "gauges")):
+        for m in sorted(snap.get(key, []), key=lambda m: m["name"]):
+            name = PREFIX + m["name"]
+            header(name, kind)
+            lines.append(f"{name}{_labels({**m['labels'], **extra})} {_value(m['value'])}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsPublisher:
+    """Writes the registry snapshot to `path` every `every` seconds (atomic replace)."""
+
+    def __init__(self, path: str | Path, every: float = 5.0, registry: Registry | None = None) -> None:
+        self.path = Path(path)
+        self.every = float(every)
+        self.registry = registry or metrics
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="metrics-publisher", daemon=True)
+
+    def start(self) -> "MetricsPublisher":
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def publish(self) -> None:
+        snap = self.registry.snapshot()
+        snap["interval"] = self.every
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        tmp.write_text(json.dumps(snap))
+        os.replace(tmp, self.path)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.every):
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"[Metrics] Could not publish to {self.path}: {e}")
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        try:
+            self.publish()
+        except Exception:
+            pass
+
+
+def load_snapshot(path: str | Path) -> dict | None:
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
@@ -1,19 +1,40 @@
 from __future__ import annotations
 from datetime import datetime
 import os
+import threading
 from typing import Optional
 import requests
 
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """One pooled HTTP session per process (keeps the TLS connection to Telegram alive)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=4)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+
+def send_telegram_photo(bot_token: str, chat_id: str | int, image_path: str, caption: str,
+                        timeout: tuple[float, float] = (5.0, 30.0)) -> None:
+    """Upload a local photo with caption; raises on any failure (callers decide about retries)."""
+    url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+    data = {"chat_id": chat_id, "caption": caption}
+    with open(image_path, "rb") as f:
+        r = get_session().post(url, data=data, files={"photo": f}, timeout=timeout)
+    r.raise_for_status()
+
+
 def notify_telegram(bot_token: str, chat_id: str | int, image_path_or_url: str, caption: str) -> None:
-    base = f"https://api.telegram.org/bot{bot_token}"
     try:
         # upload local file
-        url = f"{base}/sendPhoto"
-        data = {"chat_id": chat_id, "caption": caption}
-        with open(image_path_or_url, "rb") as f:
-            files = {"photo": f}
-            r = requests.post(url, data=data, files=files, timeout=30)
-        r.raise_for_status()
+        send_telegram_photo(bot_token, chat_id, image_path_or_url, caption)
         print("[NOTIFY][TG] Sent photo+caption")
     except Exception as e:
         print(f"[NOTIFY][TG] Failed to send photo+caption: {e}")
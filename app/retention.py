@@ -0,0 +1,264 @@
+from __future__ import annotations
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import cv2
+
+from .config import load_config
+from .event_embeddings import open_event_embeddings
+from .event_store import KEPT, REENCODED, open_event_store
+from .metrics import metrics
+from .storage import rewrite_events_csv
+
+# Retention for data/events: every pass does a bounded amount of work (at most `batch`
+# events measured, deleted and re-encoded), so it can run all day beside the cameras.
+#   1. record the disk usage (snapshot + clip) of settled events in the index
+#   2. delete events past their label's max_age_days, then the oldest of labels over max_mb,
+#      then the oldest overall while the whole store is over max_total_mb
+#   3. optionally re-encode snapshots older than reencode.after_days at lower quality
+#   4. give freed index pages back to the filesystem (incremental vacuum, WAL truncate), and
+#      rewrite events.emb without the face embeddings of deleted events once enough are dead
+# Policies are per label (`labels:`); `default` covers every label not listed.
+
+
+def _cutoff(days: float) -> str:
+    return (datetime.now() - timedelta(days=float(days))).isoformat(timespec="seconds")
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+class Retention:
+    def __init__(self, csv_path: str | Path, cfg: dict | None = None, mirror_csv: bool = False) -> None:
+        cfg = cfg or {}
+        self.csv_path = Path(csv_path)
+        self.store = open_event_store(csv_path)
+        self.mirror_csv = bool(mirror_csv)
+        self.batch = max(1, int(cfg.get("batch", 200)))
+        self.settle_sec = float(cfg.get("settle_sec", 120))   # clips finish writing within this
+        self.max_total_bytes = int(float(cfg.get("max_total_mb", 0)) * (1 << 20))
+        self.labels = dict(cfg.get("labels") or {})
+        self.default = self.labels.pop("default", {}) or {}
+        self.reencode = cfg.get("reencode") or {}
+        self.vacuum_pages = int(cfg.get("vacuum_pages", 2048))
+        self.embeddings = open_event_embeddings(csv_path)
+        self.emb_dead_fraction = float(cfg.get("embeddings_dead_fraction", 0.25))
+        self.csv_every = float(cfg.get("csv_rewrite_hours", 24)) * 3600
+        self._last_csv = time.monotonic()
+        self._deleted_since_csv = 0
+
+    def _policies(self):
+        """(labels, exclude, policy) per configured label, then the default for the rest."""
+        for label, policy in self.labels.items():
+            yield [label], None, policy or {}
+        yield None, list(self.labels) or None, self.default
+
+    def measure(self, budget: int) -> int:
+        rows = self.store.unmeasured(budget, before_ts=_cutoff(self.settle_sec / 86400))
+        sizes = []
+        for r in rows:
+            n = _size(r["image_path"])
+            clip = r.get("clip_path") or ""
+            # A clip shared by several events counts once, on the first of them
+            if clip and self.store.first_clip_owner(clip) == r["id"]:
+                n += _size(clip)
+            sizes.append((r["id"], n))
+        if sizes:
+            self.store.set_bytes(sizes)
+        return len(sizes)
+
+    def delete(self, rows: list[dict]) -> tuple[int, int]:
+        """Delete events and their files; a clip still used by a kept event stays. Returns (events, bytes)."""
+        if not rows:
+            return 0, 0
+        ids = [r["id"] for r in rows]
+        freed = 0
+        for r in rows:
+            files = [r["image_path"]]
+            clip = r.get("clip_path") or ""
+            if clip and not self.store.clip_in_use(clip, excluding=ids):
+                files.append(clip)
+            for f in files:
+                if not f:
+                    continue
+                freed += _size(f)
+                try:
+                    os.unlink(f)
+                except FileNotFoundError:
+                    pass
+        n = self.store.delete(ids)
+        self._deleted_since_csv += n
+        return n, freed
+
+    def _over(self, total: int, cap: int, budget: int, labels, exclude) -> list[dict]:
+        """Oldest events to drop so `total` gets under `cap` (at most `budget` of them)."""
+        out, excess = [], total - cap
+        for r in self.store.oldest(budget, labels=labels, exclude=exclude):
+            if excess <= 0:
+                break
+            out.append(r)
+            excess -= r["bytes"] or 0
+        return out
+
+    def expire(self, budget: int) -> tuple[int, int]:
+        deleted = freed = 0
+        for labels, exclude, policy in self._policies():
+            if budget - deleted <= 0:
+                break
+            if policy.get("max_age_days"):
+                rows = self.store.oldest(budget - deleted, before_ts=_cutoff(policy["max_age_days"]),
+                                         labels=labels, exclude=exclude)
+                n, b = self.delete(rows)
+                deleted, freed = deleted + n, freed + b
+            if policy.get("max_mb") and budget - deleted > 0:
+                cap = int(float(policy["max_mb"]) * (1 << 20))
+                total = self.store.total_bytes(labels=labels, exclude=exclude)
+                if total > cap:
+                    n, b = self.delete(self._over(total, cap, budget - deleted, labels, exclude))
+                    deleted, freed = deleted + n, freed + b
+        if self.max_total_bytes and budget - deleted > 0:
+            total = self.store.total_bytes()
+            if total > self.max_total_bytes:
+                n, b = self.delete(self._over(total, self.max_total_bytes, budget - deleted, None, None))
+                deleted, freed = deleted + n, freed + b
+        return deleted, freed
+
+    def recompress(self, budget: int) -> tuple[int, int]:
+        """Re-encode old snapshots at reencode.quality (and max_width); keeps the file only if smaller."""
+        if not self.reencode.get("enabled", False):
+            return 0, 0
+        quality = int(self.reencode.get("quality", 50))
+        max_width = int(self.reencode.get("max_width", 0))
+        rows = self.store.uncompacted(budget, before_ts=_cutoff(float(self.reencode.get("after_days", 7))))
+        done, saved, sizes = 0, 0, {REENCODED: [], KEPT: []}
+        for r in rows:
+            path = r["image_path"]
+            before = _size(path)
+            state = KEPT   # missing, unreadable or already small enough: nothing changes
+            img = cv2.imread(path) if before else None
+            if img is not None:
+                h, w = img.shape[:2]
+                if max_width and w > max_width:
+                    img = cv2.resize(img, (max_width, max(1, round(h * max_width / w))), interpolation=cv2.INTER_AREA)
+                ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ok and len(buf) < before:
+                    tmp = f"{path}.tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(buf.tobytes())
+                    os.replace(tmp, path)
+                    saved += before - len(buf)
+                    done += 1
+                    state = REENCODED
+            if r["bytes"] is not None:
+                sizes[state].append((r["id"], r["bytes"] - before + _size(path)))
+            else:
+                sizes[state].append((r["id"], None))   # measured later
+        for state, done_rows in sizes.items():
+            if done_rows:
+                # Only REENCODED snapshots get a new URL version in the API
+                self.store.set_bytes(done_rows, compacted=state)
+        return done, saved
+
+    def compact(self) -> tuple[int, int]:
+        """Returns (index pages freed, embedding rows dropped)."""
+        pages = self.store.compact(self.vacuum_pages)
+        emb_rows = self.embeddings.compact(self.emb_dead_fraction)
+        if emb_rows:
+            print(f"[Retention] Compacted {self.embeddings.path.name}: dropped {emb_rows} rows")
+        if self.mirror_csv and self._deleted_since_csv and time.monotonic() - self._last_csv >= self.csv_every:
+            # The CSV mirror only ever grows; rewrite it from what the index still holds
+            rows = ({
+                "timestamp": r["ts"], "camera": r["camera"], "label": r["label"], "distance": r["distance"],
+                "bbox": (r["bbox_x"], r["bbox_y"], r["bbox_w"], r["bbox_h"]), "image_path": r["image_path"],
+            } for r in self.store.iter_all())
+            n = rewrite_events_csv(self.csv_path, rows)
+            print(f"[Retention] Rewrote {self.csv_path.name} with {n} events")
+            self._last_csv = time.monotonic()
+            self._deleted_since_csv = 0
+        return pages, emb_rows
+
+    def run_pass(self) -> dict:
+        t0 = time.perf_counter()
+        measured = self.measure(self.batch)
+        deleted, freed = self.expire(self.batch)
+        reencoded, saved = self.recompress(self.batch)
+        pages, emb_rows = self.compact()
+        stats = {
+            "measured": measured,
+            "deleted": deleted,
+            "freed_bytes": freed,
+            "reencoded": reencoded,
+            "saved_bytes": saved,
+            "vacuumed_pages": pages,
+            "embedding_rows_dropped": emb_rows,
+            "events": self.store.count(),
+            "bytes": self.store.total_bytes(),
+            "sec": round(time.perf_counter() - t0, 3),
+        }
+        metrics.inc("retention_deleted_total", deleted)
+        metrics.inc("retention_freed_bytes_total", freed + saved)
+        return stats
+
+
+class RetentionThread:
+    """Runs Retention passes every `interval_sec` on a background thread (back to back while behind)."""
+
+    def __init__(self, retention: Retention, interval_sec: float = 300.0) -> None:
+        self.retention = retention
+        self.interval = float(interval_sec)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="retention", daemon=True)
+        self.last: dict = {}
+
+    def start(self) -> "RetentionThread":
+        self._thread.start()
+        return self
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.last = stats = self.retention.run_pass()
+                if stats["deleted"] or stats["reencoded"]:
+                    print(f"[Retention] {stats}")
+                busy = stats["deleted"] >= self.retention.batch or stats["measured"] >= self.retention.batch \
+                    or stats["reencoded"] >= self.retention.batch
+            except Exception as e:
+                print(f"[Retention] Pass failed: {e}")
+                busy = False
+            # Catching up on a backlog: a short breather instead of the full interval
+            self._stop.wait(1.0 if busy else self.interval)
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply the retention policy of config.yaml to the event store now")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--max-passes", type=int, default=1000)
+    args = parser.parse_args()
+
+    cfg = load_config(args.config)
+    events_cfg = cfg.get("events", {})
+    retention = Retention(
+        events_cfg.get("csv_path", "data/events/events.csv"),
+        cfg.get("retention", {}),
+        mirror_csv=bool(events_cfg.get("mirror_csv", False)),
+    )
+    for i in range(args.max_passes):
+        stats = retention.run_pass()
+        print(f"[Retention] pass {i + 1}: {stats}")
+        if max(stats["measured"], stats["deleted"], stats["reencoded"]) < retention.batch:
+            break
+
+
+if __name__ == "__main__":
+    main()
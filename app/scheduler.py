@@ -0,0 +1,273 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from .metrics import metrics
+
+
+class FaceScheduler:
+    """
+    Feeds one shared FaceEngine from several cameras.
+    - Each camera has at most one pending job; a newer submit replaces an older
+      unstarted one (we always want the freshest frame, never a backlog).
+    - A single inference thread serves cameras round-robin, so a busy camera
+      cannot starve the others. Up to `batch_frames` pending cameras are analyzed
+      together so all their faces share one recognition call.
+    - Results are collected per camera with poll().
+    """
+
+    def __init__(self, engine, min_face_size: int = 80, batch_frames: int = 4) -> None:
+        self.engine = engine
+        self.min_face_size = int(min_face_size)
+        self.batch_frames = max(1, int(batch_frames))
+        self._order: list[str] = []
+        self._next = 0
+        self._pending: dict[str, dict] = {}
+        self._running: set[str] = set()
+        self._results: dict[str, dict] = {}
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"jobs": 0, "batches": 0, "replaced": 0, "busy_sec": 0.0}
+
+    def register(self, cam_id: str) -> None:
+        with self._cond:
+            if cam_id not in self._order:
+                self._order.append(cam_id)
+
+    def start(self) -> "FaceScheduler":
+        self._thread = threading.Thread(target=self._loop, name="face-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    def busy(self, cam_id: str) -> bool:
+        """True while a job for this camera is queued, being processed or not yet polled."""
+        with self._cond:
+            return cam_id in self._pending or cam_id in self._running or cam_id in self._results
+
+    def submit(self, cam_id: str, frame: np.ndarray, frame_id: int = 0, rois: list | None = None,
+               tracker=None) -> None:
+        """
+        Queue `frame` for face analysis. The scheduler owns the array until the result comes back.
+        `rois` (x, y, w, h) restricts detection to those regions; None means the whole frame.
+        With a `tracker`, detections are associated to its tracks first and only faces
+        that need (re)verification are embedded.
+        """
+        job = {
+            "camera": cam_id,
+            "frame": frame,
+            "frame_id": frame_id,
+            "rois": rois,
+            "tracker": tracker,
+            "t_submit": time.monotonic(),
+        }
+        with self._cond:
+            if cam_id not in self._order:
+                self._order.append(cam_id)
+            if cam_id in self._pending:
+                self.stats["replaced"] += 1
+            self._pending[cam_id] = job
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        """Jobs waiting for the inference thread."""
+        with self._cond:
+            return len(self._pending)
+
+    def poll(self, cam_id: str) -> dict | None:
+        """Pop the finished job for `cam_id` ({camera, frame, frame_id, faces, ...}) if there is one."""
+        with self._cond:
+            return self._results.pop(cam_id, None)
+
+    def _pick(self) -> list[dict]:
+        """Take up to batch_frames pending jobs, starting after the camera served last."""
+        jobs = []
+        n = len(self._order)
+        start = self._next
+        for i in range(n):
+            cam_id = self._order[(start + i) % n]
+            job = self._pending.pop(cam_id, None)
+            if job is None:
+                continue
+            jobs.append(job)
+            self._running.add(cam_id)
+            self._next = (start + i + 1) % n
+            if len(jobs) >= self.batch_frames:
+                break
+        return jobs
+
+    def _analyze(self, jobs: list[dict], now: float) -> list[list[dict]]:
+        frames = [j["frame"] for j in jobs]
+        for job in jobs:
+            metrics.observe("stage_seconds", now - job["t_submit"], stage="face_queue", camera=job["camera"])
+        with metrics.timer("stage_seconds", stage="detect"):
+            results = self.engine.detect_batch(
+                frames, min_face_size=self.min_face_size, rois=[j.get("rois") for j in jobs]
+            )
+        for job, faces in zip(jobs, results):
+            if job.get("tracker") is not None:
+                job["tracker"].associate(faces, now)
+        # Every face of every camera in this pass goes through the recognizer in one call
+        to_embed = [[f for f in faces if f.get("needs_embedding", True)] for faces in results]
+        with metrics.timer("stage_seconds", stage="embed"):
+            self.engine.embed(frames, to_embed)
+        metrics.inc("faces_detected_total", sum(len(r) for r in results))
+        metrics.inc("faces_embedded_total", sum(len(r) for r in to_embed))
+        return results
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                jobs = self._pick()
+                while not jobs and not self._stop.is_set():
+                    self._cond.wait(timeout=0.5)
+                    jobs = self._pick()
+            if not jobs:
+                break
+
+            t0 = time.monotonic()
+            try:
+                results = self._analyze(jobs, t0)
+            except Exception as e:
+                print(f"[Face] Inference failed for cameras {[j['camera'] for j in jobs]}: {e}")
+                metrics.inc("face_pass_errors_total")
+                results = [[] for _ in jobs]
+            t_done = time.monotonic()
+            metrics.observe("stage_seconds", t_done - t0, stage="face_pass")
+            metrics.inc("face_passes_total")
+
+            with self._cond:
+                self.stats["jobs"] += len(jobs)
+                self.stats["batches"] += 1
+                self.stats["busy_sec"] += t_done - t0
+                for job, faces in zip(jobs, results):
+                    job["faces"] = faces
+                    job["t_start"] = t0
+                    job["t_done"] = t_done
+                    job["latency"] = t_done - t0
+                    self._running.discard(job["camera"])
+                    self._results[job["camera"]] = job
+
+
+def _iou(a, b) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class DetectionScheduler:
+    """
+    Decides, per camera and per frame, whether to run face detection.
+    - mode "fixed": every `every_n`-th frame with motion (the old behaviour)
+    - mode "adaptive": the interval between passes follows measured inference
+      latency and a CPU budget for the shared engine, shrinks for large motion,
+      drops to `min_interval_ms` right after a new blob appears (burst), and
+      backs off while every face in view is already identified.
+    observe_motion() follows the motion on every frame, also while a pass is in flight, so
+    a long pass doesn't make the same blob look new; should_detect() only decides whether
+    to submit the frame.
+    """
+
+    def __init__(self, cfg: dict | None = None, cameras: int = 1) -> None:
+        cfg = cfg or {}
+        self.mode = str(cfg.get("mode", "adaptive")).lower()
+        self.every_n = max(1, int(cfg.get("every_n", 3)))
+        self.cpu_budget = min(1.0, max(0.05, float(cfg.get("cpu_budget", 0.5))))
+        self.min_interval = float(cfg.get("min_interval_ms", 100)) / 1000.0
+        self.max_interval = float(cfg.get("max_interval_ms", 2000)) / 1000.0
+        self.burst_sec = float(cfg.get("burst_sec", 1.5))
+        self.idle_sec = float(cfg.get("idle_sec", 2.0))
+        self.known_backoff = max(1.0, float(cfg.get("known_backoff", 4.0)))
+        self.large_motion = float(cfg.get("large_motion_frac", 0.05))
+        self.cameras = max(1, int(cameras))
+
+        self.latency = float(cfg.get("initial_latency_ms", 150)) / 1000.0   # EMA of engine time per pass
+        self._last_run = 0.0
+        self._last_motion = float("-inf")
+        self._last_bbox = None
+        self._motion_frames = 0
+        self._burst_until = 0.0
+        self._new_blob = False   # a blob appeared that no pass has looked at yet
+        self._all_known = False
+        self.interval = self.min_interval
+        self.stats_counters = {"runs": 0, "skipped": 0, "bursts": 0}
+
+    def observe_latency(self, seconds: float) -> None:
+        self.latency = 0.8 * self.latency + 0.2 * float(seconds)
+
+    def observe_result(self, labeled_faces: list) -> None:
+        """labeled_faces = [(label, dist, bbox)]; all known -> back off until something changes."""
+        self._all_known = bool(labeled_faces) and all(l != "UNKNOWN" for l, _, _ in labeled_faces)
+
+    def _interval(self, now: float, bbox, frame_area: int) -> float:
+        # Spend at most cpu_budget of the engine, shared by all cameras
+        base = self.latency * self.cameras / self.cpu_budget
+        if now < self._burst_until:
+            return self.min_interval
+        if bbox is not None and frame_area > 0:
+            frac = (bbox[2] * bbox[3]) / frame_area
+            # Small, far-away blobs are checked less often than someone close to the camera
+            base *= 0.5 if frac >= self.large_motion else 1.0 + (1.0 - frac / self.large_motion)
+        if self._motion_frames > 0 and self._all_known:
+            base *= self.known_backoff
+        return min(self.max_interval, max(self.min_interval, base))
+
+    def observe_motion(self, now: float, motion: bool, bbox=None) -> None:
+        """Every frame: track the motion blob and start a burst when a new one appears."""
+        if not motion:
+            self._motion_frames = 0
+            return
+        new_blob = (now - self._last_motion > self.idle_sec) or (
+            bbox is not None and self._last_bbox is not None and _iou(bbox, self._last_bbox) < 0.05
+        )
+        if new_blob and self.mode != "fixed":
+            self._burst_until = now + self.burst_sec
+            self._new_blob = True
+            self._all_known = False
+            self.stats_counters["bursts"] += 1
+        self._last_motion = now
+        self._last_bbox = bbox
+        self._motion_frames += 1
+
+    def should_detect(self, now: float, frame_idx: int, motion: bool, bbox=None, frame_area: int = 0) -> bool:
+        """Whether to submit this frame; call observe_motion() for it first."""
+        if not motion:
+            self.stats_counters["skipped"] += 1
+            return False
+
+        if self.mode == "fixed":
+            run = frame_idx % self.every_n == 0
+        else:
+            self.interval = self._interval(now, bbox, frame_area)
+            run = self._new_blob or (now - self._last_run >= self.interval)
+
+        if run:
+            self._new_blob = False
+            self._last_run = now
+            self.stats_counters["runs"] += 1
+        else:
+            self.stats_counters["skipped"] += 1
+        return run
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "interval_ms": round(self.interval * 1000.0, 1),
+            "latency_ms": round(self.latency * 1000.0, 1),
+            "all_known": self._all_known,
+            **self.stats_counters,
+        }
@@ -4,6 +4,8 @@ from pathlib import Path
 from datetime import datetime
 import cv2
 import os
+import uuid
+from .event_store import open_event_store
 
 def ensure_dir(path: str | Path) -> Path:
     p = Path(path)
@@ -14,41 +16,88 @@ def timestamp_str() -> str:
     # Safe for filenames
     return datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
+def event_file_name(label: str, ext: str) -> str:
+    # Several events can fire within one second (tracks, clusters, cameras sharing a folder):
+    # milliseconds plus a random suffix keep their files apart while names still sort by time
+    now = datetime.now()
+    return f"{now.strftime('%Y-%m-%d_%H-%M-%S')}-{now.microsecond // 1000:03d}_{uuid.uuid4().hex[:6]}_{label}{ext}"
+
 def save_snapshot(frame_bgr, out_dir: str | Path, label: str = "unknown") -> str:
     out_dir = ensure_dir(out_dir)
-    fname = f"{timestamp_str()}_{label}.jpg"
+    fname = event_file_name(label, ".jpg")
     fpath = out_dir / fname
     cv2.imwrite(str(fpath), frame_bgr)
     return str(fpath)
 
-def log_event_csv(csv_path: str | Path, row: dict) -> None:
+def log_event_csv(csv_path: str | Path, row: dict, mirror_csv: bool = False) -> int:
+    """
+    Record an event in the event store next to `csv_path` (events.db) and return its id.
+    With mirror_csv=True the row is also appended to the CSV file itself.
+    """
+    event_id = open_event_store(csv_path).add(row)
+    if mirror_csv:
+        append_event_csv(csv_path, row)
+    return event_id
+
+CSV_FIELDS = [
+    "timestamp",
+    "camera",
+    "label",
+    "distance",
+    "bbox_x",
+    "bbox_y",
+    "bbox_w",
+    "bbox_h",
+    "image_path",
+]
+
+def _csv_row(row: dict) -> dict:
+    return {
+        "timestamp": row.get("timestamp", ""),
+        "camera": row.get("camera", ""),
+        "label": row.get("label", ""),
+        "distance": f"{row.get('distance', float('nan')):.3f}" if isinstance(row.get("distance", None), (float,int)) else row.get("distance",""),
+        "bbox_x": row.get("bbox", (None, None, None, None))[0],
+        "bbox_y": row.get("bbox", (None, None, None, None))[1],
+        "bbox_w": row.get("bbox", (None, None, None, None))[2],
+        "bbox_h": row.get("bbox", (None, None, None, None))[3],
+        "image_path": row.get("image_path", ""),
+    }
+
+def append_event_csv(csv_path: str | Path, row: dict) -> None:
     csv_path = Path(csv_path)
     ensure_dir(csv_path.parent)
 
     write_header = not csv_path.exists()
 
-    fieldnames = [
-        "timestamp",
-        "label",
-        "distance",
-        "bbox_x",
-        "bbox_y",
-        "bbox_w",
-        "bbox_h",
-        "image_path",
-    ]
+    fieldnames = CSV_FIELDS
+
+    if not write_header:
+        # Older files were written without some columns; keep appending in their layout
+        with csv_path.open("r", newline="") as f:
+            header = next(csv.reader(f), None)
+        if header:
+            fieldnames = header
+        else:
+            write_header = True
 
     with csv_path.open("a", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
         if write_header:
             writer.writeheader()
-        writer.writerow({
-            "timestamp": row.get("timestamp", ""),
-            "label": row.get("label", ""),
-            "distance": f"{row.get('distance', float('nan')):.3f}" if isinstance(row.get("distance", None), (float,int)) else row.get("distance",""),
-            "bbox_x": row.get("bbox", (None, None, None, None))[0],
-            "bbox_y": row.get("bbox", (None, None, None, None))[1],
-            "bbox_w": row.get("bbox", (None, None, None, None))[2],
-            "bbox_h": row.get("bbox", (None, None, None, None))[3],
-            "image_path": row.get("image_path", ""),
-        })
+        writer.writerow(_csv_row(row))
+
+def rewrite_events_csv(csv_path: str | Path, rows) -> int:
+    """Replace the CSV mirror with these rows (e.g. what retention kept); returns how many were written."""
+    csv_path = Path(csv_path)
+    ensure_dir(csv_path.parent)
+    tmp = csv_path.with_name(f".{csv_path.name}.tmp")
+    n = 0
+    with tmp.open("w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(_csv_row(row))
+            n += 1
+    os.replace(tmp, csv_path)
+    return n
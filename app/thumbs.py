@@ -0,0 +1,165 @@
+from __future__ import annotations
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+
+# Resized copies of event snapshots for the event list, cached on disk:
+#   data/thumbs/<size>/<snapshot path relative to the events dir>
+# Made on first request. JPEG sources are decoded at 1/2, 1/4 or 1/8 scale straight from
+# the DCT data (cv2.IMREAD_REDUCED_*), so a thumbnail costs a fraction of a full decode.
+# The cache is bounded by total bytes and evicts least recently served first.
+
+SIZES = {"thumb": 160, "small": 320, "medium": 640}   # name -> max width
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_TOUCH_SEC = 3600   # persist recency (file atime) at most this often per file
+
+
+def jpeg_size(path: Path) -> tuple[int, int] | None:
+    """(width, height) from a JPEG's SOF header without decoding it; None if not a JPEG."""
+    with open(path, "rb") as f:
+        if f.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            b = f.read(1)
+            while b and b != b"\xff":
+                b = f.read(1)
+            while b == b"\xff":
+                b = f.read(1)
+            if not b:
+                return None
+            marker = b[0]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                continue  # markers without a length
+            seg = f.read(2)
+            if len(seg) < 2:
+                return None
+            length = struct.unpack(">H", seg)[0]
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                h, w = struct.unpack(">xHH", f.read(5))
+                return w, h
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def read_scaled(src: Path, width: int):
+    """Decode `src` at the smallest JPEG scale that is still at least `width` wide."""
+    size = jpeg_size(src) if src.suffix.lower() in (".jpg", ".jpeg") else None
+    flag = cv2.IMREAD_COLOR
+    if size is not None:
+        for factor, reduced in _REDUCED:
+            if size[0] // factor >= width:
+                flag = reduced
+                break
+    return cv2.imread(str(src), flag)
+
+
+class ThumbCache:
+    """
+    Disk cache of resized snapshots, shared by the API's request threads.
+    - get(src, rel, size) returns the cached file, making it first if needed (or stale)
+    - total size stays under max_bytes; least recently served files are deleted first
+    - recency lives in memory and, coarsely, in file atimes so it survives restarts
+      (mtimes are left alone: they make the ETag / Last-Modified clients revalidate against)
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int = 64 << 20, quality: int = 75,
+                 sizes: dict[str, int] | None = None) -> None:
+        self.root = Path(root)
+        self.max_bytes = int(max_bytes)
+        self.quality = int(quality)
+        self.sizes = dict(sizes or SIZES)
+        self._lock = threading.Lock()
+        self._index: OrderedDict[Path, tuple[int, float]] | None = None   # path -> (bytes, last touch)
+        self._bytes = 0
+        self.stats = {"hits": 0, "made": 0, "evicted": 0}
+
+    def _load_index(self) -> None:
+        # Oldest atime first = least recently served first
+        found = []
+        for p in self.root.glob("*/**/*.jpg"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            found.append((st.st_atime, p, st.st_size))
+        found.sort()
+        self._index = OrderedDict((p, (n, mtime)) for mtime, p, n in found)
+        self._bytes = sum(n for _, _, n in found)
+
+    def path_for(self, rel: str, size: str) -> Path:
+        return self.root / size / Path(rel).with_suffix(".jpg")
+
+    def get(self, src: Path, rel: str, size: str) -> Path | None:
+        """Cached `size` version of the snapshot `src` (relative name `rel`); None if src is unreadable."""
+        width = self.sizes[size]
+        out = self.path_for(rel, size)
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            entry = self._index.get(out)
+        if entry is not None:
+            try:
+                fresh = out.stat().st_mtime >= src.stat().st_mtime
+            except FileNotFoundError:
+                fresh = False
+            if fresh:
+                self._touch(out, entry)
+                self.stats["hits"] += 1
+                return out
+
+        img = read_scaled(src, width)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        if w > width:
+            img = cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return None
+        out.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out.with_name(f".{out.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(buf.tobytes())
+        os.replace(tmp, out)
+        self.stats["made"] += 1
+        self._add(out, len(buf))
+        return out
+
+    def _touch(self, path: Path, entry: tuple[int, float]) -> None:
+        now = time.time()
+        with self._lock:
+            if path not in self._index:
+                return
+            self._index.move_to_end(path)
+            if now - entry[1] < _TOUCH_SEC:
+                return
+            self._index[path] = (entry[0], now)
+        try:
+            os.utime(path, (now, path.stat().st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def _add(self, path: Path, nbytes: int) -> None:
+        victims = []
+        with self._lock:
+            old = self._index.pop(path, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._index[path] = (nbytes, time.time())
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                victim, (n, _) = self._index.popitem(last=False)
+                self._bytes -= n
+                victims.append(victim)
+            self.stats["evicted"] += len(victims)
+        for v in victims:
+            v.unlink(missing_ok=True)
+
+    def usage(self) -> dict:
+        with self._lock:
+            files = len(self._index) if self._index is not None else 0
+            return {"files": files, "bytes": self._bytes, "max_bytes": self.max_bytes, **self.stats}
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import itertools
+import threading
+
+import numpy as np
+
+from .scheduler import _iou
+
+
+class Track:
+    """One face followed across detection passes, with its cached identity."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, bbox, now: float) -> None:
+        self.id = next(Track._ids)
+        self.state = np.array(_xywh_to_cxcywh(bbox), dtype=np.float64)   # cx, cy, w, h
+        self.velocity = np.zeros(4, dtype=np.float64)
+        self.last_seen = now
+        self.first_seen = now
+        self.hits = 1
+        self.embedding: np.ndarray | None = None
+        self.label: str | None = None        # user name or "UNKNOWN"; None = never verified
+        self.uid: str | None = None
+        self.dist = float("inf")
+        self.verified_at = float("-inf")
+        self.alerted = False
+
+    def predict(self, now: float) -> tuple[int, int, int, int]:
+        dt = max(0.0, now - self.last_seen)
+        cx, cy, w, h = self.state + self.velocity * dt
+        return _cxcywh_to_xywh((cx, cy, max(w, 1.0), max(h, 1.0)))
+
+    def correct(self, bbox, now: float, gain: float = 0.6) -> None:
+        """Alpha-beta update of position and velocity (a constant-velocity Kalman filter with fixed gain)."""
+        dt = max(1e-3, now - self.last_seen)
+        meas = np.array(_xywh_to_cxcywh(bbox), dtype=np.float64)
+        pred = self.state + self.velocity * dt
+        resid = meas - pred
+        self.state = pred + gain * resid
+        self.velocity = self.velocity + (gain * 0.5) * resid / dt
+        self.last_seen = now
+        self.hits += 1
+
+    @property
+    def bbox(self) -> tuple[int, int, int, int]:
+        return _cxcywh_to_xywh(self.state)
+
+
+def _xywh_to_cxcywh(b):
+    x, y, w, h = b
+    return (x + w / 2.0, y + h / 2.0, float(w), float(h))
+
+
+def _cxcywh_to_xywh(s):
+    cx, cy, w, h = s
+    return (int(round(cx - w / 2.0)), int(round(cy - h / 2.0)), int(round(w)), int(round(h)))
+
+
+class FaceTracker:
+    """
+    Lightweight multi-face tracker for one camera.
+    - associate(): greedy IoU matching of detections to predicted track boxes, run
+      right after detection; marks which faces still need an embedding
+    - update(): applies the association, re-identifies lost tracks by embedding
+      similarity, caches identity decisions and says which tracks should alert
+    A track is re-embedded only when its identity is unknown, stale
+    (reverify_sec / unknown_reverify_sec), or the association is uncertain.
+    """
+
+    def __init__(self, cfg: dict | None = None) -> None:
+        cfg = cfg or {}
+        self.iou_min = float(cfg.get("iou_min", 0.2))
+        self.confident_iou = float(cfg.get("confident_iou", 0.5))
+        self.max_age = float(cfg.get("max_age_sec", 5.0))
+        self.reid_keep = float(cfg.get("reid_keep_sec", 10.0))
+        self.reid_sim = float(cfg.get("reid_sim", 0.6))
+        self.reverify = float(cfg.get("reverify_sec", 10.0))
+        self.unknown_reverify = float(cfg.get("unknown_reverify_sec", 2.0))
+        self.min_hits = max(1, int(cfg.get("min_hits", 1)))
+        self.tracks: list[Track] = []
+        self._lost: list[Track] = []   # recently expired tracks kept for re-identification
+        self._lock = threading.Lock()
+        self.stats = {"embedded": 0, "reused": 0, "tracks": 0}
+
+    def associate(self, faces: list[dict], now: float) -> None:
+        """Set f["track_id"] (None = new face) and f["needs_embedding"] on every detection."""
+        with self._lock:
+            self._expire(now)
+            preds = [(t, t.predict(now)) for t in self.tracks]
+            pairs = []
+            for fi, f in enumerate(faces):
+                for ti, (t, pb) in enumerate(preds):
+                    iou = _iou(f["bbox"], pb)
+                    if iou >= self.iou_min:
+                        pairs.append((iou, fi, ti))
+            pairs.sort(reverse=True)
+
+            used_f, used_t = set(), set()
+            for f in faces:
+                f["track_id"] = None
+                f["needs_embedding"] = True
+            for iou, fi, ti in pairs:
+                if fi in used_f or ti in used_t:
+                    continue
+                used_f.add(fi)
+                used_t.add(ti)
+                t = preds[ti][0]
+                f = faces[fi]
+                f["track_id"] = t.id
+                f["needs_embedding"] = (
+                    t.label is None
+                    or iou < self.confident_iou
+                    or now - t.verified_at > (self.unknown_reverify if t.label == "UNKNOWN" else self.reverify)
+                )
+
+            for f in faces:
+                self.stats["embedded" if f["needs_embedding"] else "reused"] += 1
+
+    def update(self, faces: list[dict], now: float) -> None:
+        """
+        Apply an associated pass. Faces that were embedded must already carry
+        "label", "uid" and "dist"; the rest inherit them from their track.
+        Sets f["track_id"], f["label"], f["dist"] and f["alert"] (new, confirmed UNKNOWN track).
+        """
+        with self._lock:
+            by_id = {t.id: t for t in self.tracks}
+            for f in faces:
+                t = by_id.get(f.get("track_id"))
+                if t is None:
+                    t = self._revive(f, now)
+                    if t is None:
+                        t = Track(f["bbox"], now)
+                        self.stats["tracks"] += 1
+                    self.tracks.append(t)
+                    by_id[t.id] = t
+                    f["track_id"] = t.id
+                else:
+                    t.correct(f["bbox"], now)
+
+                if f.get("embedding") is not None and "label" in f:
+                    emb = f["embedding"]
+                    t.embedding = emb if t.embedding is None else _normalize(0.7 * t.embedding + 0.3 * emb)
+                    t.label, t.uid, t.dist = f["label"], f.get("uid"), float(f["dist"])
+                    t.verified_at = now
+                else:
+                    f["label"], f["uid"], f["dist"] = t.label or "UNKNOWN", t.uid, t.dist
+
+                f["alert"] = t.label == "UNKNOWN" and not t.alerted and t.hits >= self.min_hits
+
+    def embedding_of(self, track_id) -> np.ndarray | None:
+        """Running embedding of a track (for faces that were not re-embedded this pass)."""
+        with self._lock:
+            for t in self.tracks:
+                if t.id == track_id:
+                    return t.embedding
+        return None
+
+    def mark_alerted(self, track_ids) -> None:
+        with self._lock:
+            for t in self.tracks:
+                if t.id in track_ids:
+                    t.alerted = True
+
+    def _revive(self, f: dict, now: float) -> Track | None:
+        """Re-attach a new detection to a recently lost track with a similar embedding."""
+        emb = f.get("embedding")
+        if emb is None or not self._lost:
+            return None
+        cands = [t for t in self._lost if t.embedding is not None]
+        if not cands:
+            return None
+        sims = np.array([float(t.embedding @ emb) for t in cands])
+        i = int(np.argmax(sims))
+        if sims[i] < self.reid_sim:
+            return None
+        t = cands[i]
+        self._lost.remove(t)
+        t.state = np.array(_xywh_to_cxcywh(f["bbox"]), dtype=np.float64)
+        t.velocity[:] = 0.0
+        t.last_seen = now
+        t.hits += 1
+        return t
+
+    def _expire(self, now: float) -> None:
+        alive = []
+        for t in self.tracks:
+            if now - t.last_seen <= self.max_age:
+                alive.append(t)
+            else:
+                self._lost.append(t)
+        self.tracks = alive
+        self._lost = [t for t in self._lost if now - t.last_seen <= self.reid_keep]
+
+    def active(self, now: float) -> list[Track]:
+        with self._lock:
+            return [t for t in self.tracks if now - t.last_seen <= self.max_age]
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    return (v / (np.linalg.norm(v) + 1e-12)).astype(np.float32)
@@ -1,20 +1,44 @@
+import threading
+import time
+from pathlib import Path
 import cv2
 import numpy as np
 
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+class FrameTimeout(RuntimeError):
+    """No frame arrived in time; the grabber thread is still trying (e.g. reconnecting)."""
+
+
+class EndOfStream(RuntimeError):
+    """A replayed file or image sequence has no more frames."""
+
+
 class VideoSource:
     def __init__(self, camera_index: int, width: int, height: int, rtsp_url: str | None = None):
-        self.cap = cv2.VideoCapture(rtsp_url if rtsp_url else camera_index)
-        if not self.cap or not self.cap.isOpened():
-            raise RuntimeError("Could not open video source")
-
-        _set_if_supported(self.cap, cv2.CAP_PROP_FRAME_WIDTH,  width)
-        _set_if_supported(self.cap, cv2.CAP_PROP_FRAME_HEIGHT, height)
-        _set_if_supported(self.cap, cv2.CAP_PROP_FPS, 15)
+        self.camera_index = camera_index
+        self.width = width
+        self.height = height
+        self.rtsp_url = rtsp_url
+        self.cap = self._open()
 
         ok, _ = self.cap.read()
         if not ok:
             raise RuntimeError("Camera opened but no frames. Try a different camera_index (0,1,2).")
 
+    def _open(self):
+        cap = cv2.VideoCapture(self.rtsp_url if self.rtsp_url else self.camera_index)
+        if not cap or not cap.isOpened():
+            raise RuntimeError("Could not open video source")
+
+        _set_if_supported(cap, cv2.CAP_PROP_FRAME_WIDTH,  self.width)
+        _set_if_supported(cap, cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        _set_if_supported(cap, cv2.CAP_PROP_FPS, 15)
+        # Keep the driver-side queue short; we never want stale frames
+        _set_if_supported(cap, cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     def read(self):
         ok, frame = self.cap.read()
         if not ok:
@@ -25,6 +49,317 @@ class VideoSource:
         if self.cap:
             self.cap.release()
 
+
+class FrameRing:
+    """
+    Small ring of preallocated frame buffers shared by one writer and one reader.
+    - The writer decodes straight into the oldest free slot and never blocks.
+    - The reader asks for the latest frame or the next unread one; frames the
+      reader never saw are counted in `dropped`.
+    """
+
+    def __init__(self, size: int = 4) -> None:
+        if size < 3:
+            raise ValueError("FrameRing needs at least 3 slots")
+        self.size = int(size)
+        self._bufs: list[np.ndarray | None] = [None] * self.size
+        self._seqs = [0] * self.size      # 0 = empty or being written
+        self._stamps = [0.0] * self.size
+        self._cond = threading.Condition()
+        self._write_seq = 0   # sequence number of the newest published frame
+        self._read_seq = 0    # sequence number of the last frame handed out
+        self._reading = -1    # slot currently being copied out by the reader
+        self._writing = -1
+        self.dropped = 0
+
+    def acquire_slot(self, shape: tuple, dtype=np.uint8) -> np.ndarray:
+        """Claim the oldest slot that is neither being read nor the newest frame."""
+        with self._cond:
+            newest = self._seqs.index(self._write_seq) if self._write_seq else -1
+            candidates = [i for i in range(self.size) if i not in (self._reading, newest)]
+            idx = min(candidates, key=lambda i: self._seqs[i])
+            self._seqs[idx] = 0
+            self._writing = idx
+            buf = self._bufs[idx]
+            if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+                buf = np.empty(shape, dtype=dtype)
+                self._bufs[idx] = buf
+            return buf
+
+    def publish(self, frame: np.ndarray) -> None:
+        """Publish the claimed slot as the newest frame (adopts `frame` if it is not the slot buffer)."""
+        with self._cond:
+            idx = self._writing
+            if idx < 0:
+                raise RuntimeError("publish() without acquire_slot()")
+            if self._bufs[idx] is not frame:
+                self._bufs[idx] = frame
+            self._write_seq += 1
+            self._seqs[idx] = self._write_seq
+            self._stamps[idx] = time.monotonic()
+            self._writing = -1
+            self._cond.notify_all()
+
+    def _take(self, idx: int, out: np.ndarray | None) -> tuple[int, np.ndarray, float]:
+        seq = self._seqs[idx]
+        self.dropped += seq - self._read_seq - 1
+        self._read_seq = seq
+        self._reading = idx
+        buf = self._bufs[idx]
+        stamp = self._stamps[idx]
+        self._cond.release()
+        try:
+            if out is None or out.shape != buf.shape or out.dtype != buf.dtype:
+                out = buf.copy()
+            else:
+                np.copyto(out, buf)
+        finally:
+            self._cond.acquire()
+            self._reading = -1
+        return seq, out, stamp
+
+    def latest(self, timeout: float | None = None, out: np.ndarray | None = None):
+        """
+        Return (seq, frame, t_captured) for the newest frame newer than the last one read,
+        or None on timeout. Skipped frames are counted as dropped.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._write_seq > self._read_seq, timeout):
+                return None
+            return self._take(self._seqs.index(self._write_seq), out)
+
+    def next(self, timeout: float | None = None, out: np.ndarray | None = None):
+        """Return (seq, frame, t_captured) for the oldest unread frame, or None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._write_seq > self._read_seq, timeout):
+                return None
+            unread = [i for i in range(self.size) if self._seqs[i] > self._read_seq]
+            return self._take(min(unread, key=lambda i: self._seqs[i]), out)
+
+    @property
+    def written(self) -> int:
+        return self._write_seq
+
+
+class ThreadedVideoSource(VideoSource):
+    """
+    VideoSource that decodes on a dedicated thread into a FrameRing, so slow
+    consumers (face inference) never let the camera/RTSP buffer back up.
+    - read() returns the latest frame ("latest" mode) or the next unread one ("next" mode)
+    - dropped frames are counted in stats()
+    - the stream is reopened with backoff when it drops (typical for RTSP)
+    """
+
+    def __init__(
+        self,
+        camera_index: int,
+        width: int,
+        height: int,
+        rtsp_url: str | None = None,
+        buffer_size: int = 4,
+        mode: str = "latest",
+        read_timeout: float = 5.0,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 30.0,
+    ):
+        super().__init__(camera_index, width, height, rtsp_url=rtsp_url)
+        if mode not in ("latest", "next"):
+            raise ValueError(f"Unknown capture mode: {mode}")
+        self.mode = mode
+        self.read_timeout = float(read_timeout)
+        self.reconnect_delay = float(reconnect_delay)
+        self.max_reconnect_delay = float(max_reconnect_delay)
+        self.ring = FrameRing(buffer_size)
+        self.reconnects = 0
+        self.last_error: str | None = None
+        self._stop = threading.Event()
+        self._cap_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="frame-grabber", daemon=True)
+        self._thread.start()
+
+    def _loop(self) -> None:
+        delay = self.reconnect_delay
+        shape = None
+        while not self._stop.is_set():
+            with self._cap_lock:
+                cap = self.cap
+            if cap is None:
+                if not self._reconnect(delay):
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                else:
+                    delay = self.reconnect_delay
+                continue
+
+            buf = self.ring.acquire_slot(shape) if shape is not None else None
+            ok, frame = cap.read(buf) if buf is not None else cap.read()
+            if ok:
+                # First frame (or a stream size change) hands back a new array; adopt its shape
+                if frame is not buf:
+                    shape = frame.shape
+                    if buf is None:
+                        self.ring.acquire_slot(shape)
+                self.ring.publish(frame)
+                continue
+
+            self.last_error = "read failed"
+            print(f"[Video] Stream read failed, reconnecting in {delay:.1f}s")
+            with self._cap_lock:
+                if self.cap is not None:
+                    self.cap.release()
+                    self.cap = None
+            shape = None
+
+    def _reconnect(self, delay: float) -> bool:
+        if self._stop.wait(delay):
+            return False
+        try:
+            cap = self._open()
+        except RuntimeError as e:
+            self.last_error = str(e)
+            print(f"[Video] Reconnect failed: {e}")
+            return False
+        with self._cap_lock:
+            if self._stop.is_set():
+                cap.release()
+                return False
+            self.cap = cap
+        self.reconnects += 1
+        print(f"[Video] Reconnected (#{self.reconnects})")
+        return True
+
+    def read(self):
+        _, frame, _ = self.read_stamped()
+        return frame
+
+    def read_stamped(self, mode: str | None = None):
+        """Return (seq, frame, t_captured); raises if no frame arrives within read_timeout."""
+        mode = mode or self.mode
+        if mode == "next":
+            item = self.ring.next(timeout=self.read_timeout)
+        else:
+            item = self.ring.latest(timeout=self.read_timeout)
+        if item is None:
+            raise FrameTimeout(f"No frame from camera within {self.read_timeout:.1f}s")
+        return item
+
+    def read_latest(self):
+        return self.read_stamped("latest")[1]
+
+    def read_next(self):
+        return self.read_stamped("next")[1]
+
+    def stats(self) -> dict:
+        return {
+            "captured": self.ring.written,
+            "dropped": self.ring.dropped,
+            "reconnects": self.reconnects,
+            "connected": self.cap is not None,
+        }
+
+    def release(self):
+        self._stop.set()
+        self._thread.join(timeout=2.0)
+        with self._cap_lock:
+            if self.cap:
+                self.cap.release()
+                self.cap = None
+
+
+class FileSource(VideoSource):
+    """
+    Replays a video file or a directory of images (sorted by name) as if it were a camera.
+    - realtime=True paces frames at the clip's native fps (image folders use `fps`); when the
+      pipeline falls behind, frames are skipped like a live camera would and counted in `dropped`
+    - realtime=False hands out every frame as fast as the pipeline asks for them
+    - at the end, read() raises EndOfStream, or starts over with loop=True
+    """
+
+    def __init__(self, path: str | Path, realtime: bool = True, fps: float | None = None, loop: bool = False):
+        self.path = Path(path)
+        self.realtime = bool(realtime)
+        self.loop = bool(loop)
+        self.images: list[Path] | None = None
+        self.cap = None
+        if self.path.is_dir():
+            self.images = sorted(p for p in self.path.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+            if not self.images:
+                raise RuntimeError(f"No images in {self.path}")
+            self.fps = float(fps or 15.0)
+        else:
+            self.cap = self._open()
+            self.fps = float(fps or self.cap.get(cv2.CAP_PROP_FPS) or 15.0)
+        self.width = self.height = None
+        self.pos = 0          # index of the next frame in the clip
+        self.captured = 0
+        self.dropped = 0
+        self._t0: float | None = None
+
+    def _open(self):
+        cap = cv2.VideoCapture(str(self.path))
+        if not cap or not cap.isOpened():
+            raise RuntimeError(f"Could not open video file {self.path}")
+        return cap
+
+    def _rewind(self) -> None:
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = self._open()
+        self.pos = 0
+        self._t0 = None
+
+    def _skip(self) -> bool:
+        if self.images is not None:
+            if self.pos >= len(self.images):
+                return False
+        elif not self.cap.grab():
+            return False
+        self.pos += 1
+        return True
+
+    def _next_frame(self):
+        if self.images is not None:
+            while self.pos < len(self.images):
+                frame = cv2.imread(str(self.images[self.pos]))
+                self.pos += 1
+                if frame is not None:
+                    return frame
+            return None
+        ok, frame = self.cap.read()
+        if not ok:
+            return None
+        self.pos += 1
+        return frame
+
+    def read(self):
+        if self.realtime:
+            now = time.monotonic()
+            if self._t0 is None:
+                self._t0 = now - self.pos / self.fps
+            wait = self._t0 + self.pos / self.fps - now
+            if wait > 0:
+                time.sleep(wait)
+            # Behind schedule: jump to the frame a live camera would show now
+            due = int((now - self._t0) * self.fps)
+            while due > self.pos and self._skip():
+                self.dropped += 1
+        frame = self._next_frame()
+        if frame is None:
+            if not self.loop or self.pos == 0:
+                raise EndOfStream(f"End of {self.path}")
+            self._rewind()
+            return self.read()
+        self.captured += 1
+        return frame
+
+    def stats(self) -> dict:
+        return {"captured": self.captured, "dropped": self.dropped, "reconnects": 0, "connected": True}
+
+    def release(self):
+        if self.cap:
+            self.cap.release()
+            self.cap = None
+
+
 def _set_if_supported(cap, prop, value):
     try:
         cap.set(prop, value)
@@ -44,6 +379,14 @@ def detect_motion(prev_gray, curr_gray, threshold: int, min_area: int):
     - bbox: (x, y, w, h) of the largest moving blob or None
     - mask: binary image of motion (useful for debugging)
     """
+    motion, rois, mask = detect_motion_rois(prev_gray, curr_gray, threshold, min_area)
+    return motion, (rois[0] if rois else None), mask
+
+def detect_motion_rois(prev_gray, curr_gray, threshold: int, min_area: int):
+    """
+    Like detect_motion, but returns every qualifying blob:
+    (motion_bool, [bbox, ...] largest first, mask)
+    """
     # Pixel-wise difference
     delta = cv2.absdiff(prev_gray, curr_gray)
 
@@ -53,21 +396,203 @@ def detect_motion(prev_gray, curr_gray, threshold: int, min_area: int):
     # Fill gaps and smooth the mask
     mask = cv2.dilate(mask, None, iterations=2)
 
+    rois = mask_rois(mask, min_area)
+    return bool(rois), rois, mask
+
+def mask_rois(mask, min_area: int) -> list[tuple[int, int, int, int]]:
+    """Bounding boxes of blobs in a binary mask with area >= min_area, largest first."""
     # Find blobs
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    motion = False
-    best_bbox = None
-    best_area = 0
-
+    found = []
     for c in contours:
         area = cv2.contourArea(c)
         if area < min_area:
             continue
-        x, y, w, h = cv2.boundingRect(c)
-        if area > best_area:
-            best_area = area
-            best_bbox = (x, y, w, h)
-            motion = True
+        found.append((area, cv2.boundingRect(c)))
+    found.sort(key=lambda t: t[0], reverse=True)
+    return [tuple(int(v) for v in b) for _, b in found]
+
+def merge_rois(rois, frame_shape, pad: float = 0.25, min_side: int = 160):
+    """
+    Pad motion boxes (faces sit at the top of a moving body, so give them room),
+    grow them to at least min_side, clip to the frame and merge overlaps.
+    Returns a list of (x, y, w, h).
+    """
+    fh, fw = frame_shape[:2]
+    boxes = []
+    for x, y, w, h in rois:
+        px, py = int(w * pad), int(h * pad)
+        x1, y1, x2, y2 = x - px, y - py, x + w + px, y + h + py
+        # Enforce a minimum size around the box centre
+        if x2 - x1 < min_side:
+            cx = (x1 + x2) // 2
+            x1, x2 = cx - min_side // 2, cx + min_side // 2
+        if y2 - y1 < min_side:
+            cy = (y1 + y2) // 2
+            y1, y2 = cy - min_side // 2, cy + min_side // 2
+        boxes.append([max(0, x1), max(0, y1), min(fw, x2), min(fh, y2)])
+
+    # Merge until no two boxes overlap
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        while boxes:
+            a = boxes.pop()
+            for b in boxes:
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    b[:] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    merged = True
+                    break
+            else:
+                out.append(a)
+        boxes = out
+    return [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in boxes if x2 > x1 and y2 > y1]
+
+
+class DiffMotion:
+    """The original engine: blurred full-resolution frame differencing against the previous frame."""
+
+    def __init__(self, motion_cfg: dict) -> None:
+        self.threshold = motion_cfg.get("threshold", 25)
+        self.min_area = motion_cfg.get("min_area", 1200)
+        self.prev_gray = None
+
+    def apply(self, frame_bgr):
+        """Returns (motion_bool, [bbox, ...] largest first, mask)."""
+        gray = to_gray_blur(frame_bgr)
+        prev, self.prev_gray = self.prev_gray, gray
+        if prev is None:
+            return False, [], None
+        return detect_motion_rois(prev, gray, self.threshold, self.min_area)
+
+
+class BackgroundMotion:
+    """
+    Background-model motion on a downscaled frame.
+    - model "running_avg": exponential running average, only learned where nothing moves
+    - model "mog2": OpenCV's per-pixel Gaussian mixture (handles flicker / swaying leaves better)
+    Optional zones (polygons in 0-1 frame coordinates) include or exclude areas; include
+    zones may set their own min_area. ROIs are returned in full-resolution pixels.
+    """
+
+    def __init__(self, motion_cfg: dict) -> None:
+        bg_cfg = motion_cfg.get("background", {})
+        self.model = str(bg_cfg.get("model", "running_avg")).lower()
+        self.width = int(bg_cfg.get("width", 320))
+        self.alpha = float(bg_cfg.get("alpha", 0.05))
+        self.threshold = int(bg_cfg.get("threshold", motion_cfg.get("threshold", 25)))
+        self.blur = int(bg_cfg.get("blur", 5)) | 1
+        self.warmup = int(bg_cfg.get("warmup_frames", 15))
+        self.min_area = float(motion_cfg.get("min_area", 1200))
+        self.zones = motion_cfg.get("zones") or []
+        self._mog2 = None
+        if self.model == "mog2":
+            self._mog2 = cv2.createBackgroundSubtractorMOG2(
+                history=int(bg_cfg.get("mog2_history", 300)),
+                varThreshold=float(bg_cfg.get("mog2_var_threshold", 25)),
+                detectShadows=True,
+            )
+        elif self.model != "running_avg":
+            raise ValueError(f"Unknown background model: {self.model}")
+        self._bg = None
+        self._frames = 0
+        self._shape = None
+        self._scale = 1.0
+        self._zone_mask = None
+        self._zone_areas: list[tuple[np.ndarray, float]] = []
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+    def _prepare(self, shape) -> None:
+        h, w = shape[:2]
+        self._shape = shape[:2]
+        self._scale = min(1.0, self.width / float(w))
+        sw, sh = max(1, int(round(w * self._scale))), max(1, int(round(h * self._scale)))
+        self._small = (sw, sh)
+
+        # Zone masks are rasterized once per frame size
+        self._zone_mask = None
+        self._zone_areas = []
+        includes = [z for z in self.zones if z.get("type", "include") == "include"]
+        mask = np.full((sh, sw), 0 if includes else 255, dtype=np.uint8)
+        for z in self.zones:
+            pts = np.array([[px * sw, py * sh] for px, py in z.get("points", [])], dtype=np.int32)
+            if len(pts) < 3:
+                continue
+            if z.get("type", "include") == "include":
+                cv2.fillPoly(mask, [pts], 255)
+                if "min_area" in z:
+                    zm = np.zeros((sh, sw), dtype=np.uint8)
+                    cv2.fillPoly(zm, [pts], 1)
+                    self._zone_areas.append((zm, float(z["min_area"])))
+            else:
+                cv2.fillPoly(mask, [pts], 0)
+        if self.zones:
+            self._zone_mask = mask
+
+    def apply(self, frame_bgr):
+        """Returns (motion_bool, [bbox, ...] largest first in full-res pixels, mask at the downscaled size)."""
+        if self._shape != frame_bgr.shape[:2]:
+            self._prepare(frame_bgr.shape)
+            self._bg = None
+            self._frames = 0
+
+        small = cv2.resize(frame_bgr, self._small, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        if self.blur > 1:
+            gray = cv2.GaussianBlur(gray, (self.blur, self.blur), 0)
+        self._frames += 1
+
+        if self._mog2 is not None:
+            fg = self._mog2.apply(gray, learningRate=-1 if self._frames > self.warmup else 0.2)
+            # MOG2 marks shadows as 127; treat them as background
+            _, mask = cv2.threshold(fg, 200, 255, cv2.THRESH_BINARY)
+        else:
+            if self._bg is None:
+                self._bg = gray.astype(np.float32)
+                return False, [], None
+            delta = cv2.absdiff(gray, cv2.convertScaleAbs(self._bg))
+            _, mask = cv2.threshold(delta, self.threshold, 255, cv2.THRESH_BINARY)
+            # Learn fast while warming up, then only where nothing is moving
+            if self._frames <= self.warmup:
+                cv2.accumulateWeighted(gray, self._bg, 0.5)
+            else:
+                cv2.accumulateWeighted(gray, self._bg, self.alpha, mask=cv2.bitwise_not(mask))
+
+        if self._frames <= self.warmup:
+            return False, [], mask
+
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        mask = cv2.dilate(mask, None, iterations=2)
+        if self._zone_mask is not None:
+            mask = cv2.bitwise_and(mask, self._zone_mask)
+
+        s2 = self._scale * self._scale
+        rois = []
+        for x, y, w, h in mask_rois(mask, min(self._zone_min_areas() + [self.min_area]) * s2):
+            min_area = self._min_area_at(x + w // 2, y + h // 2)
+            if w * h < min_area * s2:
+                continue
+            inv = 1.0 / self._scale
+            rois.append((int(x * inv), int(y * inv), int(round(w * inv)), int(round(h * inv))))
+        return bool(rois), rois, mask
+
+    def _zone_min_areas(self) -> list[float]:
+        return [a for _, a in self._zone_areas]
+
+    def _min_area_at(self, cx: int, cy: int) -> float:
+        for zm, area in self._zone_areas:
+            if zm[cy, cx]:
+                return area
+        return self.min_area
+
 
-    return motion, best_bbox, mask
+def make_motion_engine(motion_cfg: dict):
+    """Motion engine selected by `motion.engine`: "diff" (default) or "background"."""
+    engine = str(motion_cfg.get("engine", "diff")).lower()
+    if engine == "diff":
+        return DiffMotion(motion_cfg)
+    if engine == "background":
+        return BackgroundMotion(motion_cfg)
+    raise ValueError(f"Unknown motion engine: {engine}")
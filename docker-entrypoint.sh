@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 set -e
-# Warm model into memory (no network; loads from /app/models)
-python -c "from app.engine_runtime import get_face_engine; get_face_engine(); print('[warmup] face engine ready')"
+# Models are prefetched into /app/models at build time. The API warms its engine on a
+# background thread after it starts serving (see wsgi.py); the worker loads its own.
 exec "$@"
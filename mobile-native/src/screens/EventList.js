@@ -30,7 +30,8 @@ export default function EventList({ navigation }) {
         style={styles.card}
       >
         {item.image_url ? (
-          <Image source={{ uri: item.image_url }} style={styles.image} resizeMode="cover" />
+          // Resized copy for the list; the full snapshot loads on the detail screen
+          <Image source={{ uri: item.thumbnails?.medium || item.image_url }} style={styles.image} resizeMode="cover" />
         ) : (
           <View style={[styles.image, styles.imagePlaceholder]}>
             <Text style={styles.placeholderText}>No image</Text>
@@ -1,5 +1,10 @@
 # wsgi.py
-from app.api import app
+import os
+from app.api import app, start_warmup
+
+# Load the face models in the background; requests are served meanwhile
+if os.getenv("FACE_WARMUP", "1") != "0":
+    start_warmup()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5050)
\ No newline at end of file